@@ -0,0 +1,232 @@
+import re
+
+import pandas as pd
+
+from .context_builder import (
+    apply_filters,
+    detect_column_roles,
+    find_date_range,
+    find_value_filters,
+)
+from .rollups import find_rollup, rollup_series
+
+# --- INTENT PARSING ---
+
+METRIC_PATTERNS = [
+    ('mean', re.compile(r'\b(average|avg|mean)\b', re.I)),
+    ('count', re.compile(r'\bhow many (entries|rows|records|timesheets|days|dates|employees|people|projects)\b|\bnumber of\b|\bcount\b', re.I)),
+    ('max', re.compile(r'\b(most|highest|maximum|max|top)\b', re.I)),
+    ('min', re.compile(r'\b(least|lowest|minimum|min|fewest)\b', re.I)),
+    ('sum', re.compile(r'\b(total|sum|how many hours|how much time|overall)\b', re.I)),
+]
+GROUP_PATTERNS = {
+    'employee': re.compile(r'\b(who|which (employee|person|member)|per (employee|person)|by (employee|person)|each (employee|person)|employees)\b', re.I),
+    'project': re.compile(r'\b(which project|per project|by project|each project|projects)\b', re.I),
+}
+# Questions asking for judgement rather than numbers go to the LLM
+OPEN_ENDED_PATTERN = re.compile(r'\b(why|explain|trend|pattern|insight|summar|anomal|unusual|suggest|recommend|compare|review|analy[sz]e)\w*', re.I)
+COUNT_SUBJECTS = {'employees': 'employee', 'people': 'employee', 'projects': 'project', 'days': 'date', 'dates': 'date'}
+# Naming one of these means the question is about an hours measure, not a row count
+MEASURE_WORDS = re.compile(r'\b(hours?|time|overtime)\b', re.I)
+TOP_N_PATTERN = re.compile(r'\btop (\d+)\b', re.I)
+# "per month", "by client", ... : a grouping the parser must understand or hand to the LLM
+GROUPING_PATTERN = re.compile(r'\b(per|by|each|every)\s+(\w+)', re.I)
+GROUP_WORDS = {'employee', 'employees', 'person', 'people', 'member', 'members', 'project', 'projects'}
+TIME_GROUP_WORDS = {'day', 'days', 'date', 'week', 'weeks', 'month', 'months', 'quarter', 'year', 'years', 'weekday'}
+
+def find_unparsed_grouping(question, value_filters):
+    """
+    True when the question groups by something the parser does not handle
+    (a time unit, another column, a column the sheet does not have).
+    "by <word>" only counts as a filter when the word is part of a cell
+    value the question matched, as in "hours logged by Alice".
+    """
+    matched_words = {
+        word
+        for values in value_filters.values()
+        for value in values
+        for word in re.findall(r'\w+', str(value).lower())
+    }
+    for keyword, word in GROUPING_PATTERN.findall(question.lower()):
+        if word in GROUP_WORDS or MEASURE_WORDS.fullmatch(word):
+            continue
+        if keyword == 'by' and word in matched_words:
+            continue
+        return True
+    return False
+
+def parse_query(question, df):
+    """
+    Turns a question into a structured aggregate query over df, or returns
+    None when the question is not a plain group-by/aggregate lookup (or
+    could be read more than one way).
+    """
+    if OPEN_ENDED_PATTERN.search(question):
+        return None
+
+    metrics = {name for name, pattern in METRIC_PATTERNS if pattern.search(question)}
+    if not metrics:
+        return None
+
+    roles = detect_column_roles(df)
+    lowered = question.lower()
+    named_measure = next((column for column in roles['hours'] if str(column).lower() in lowered), None)
+    measure = named_measure
+    if measure is None and roles['hours']:
+        overtime = [column for column in roles['hours'] if 'overtime' in str(column).lower()]
+        measure = overtime[0] if overtime and 'overtime' in lowered else roles['hours'][0]
+
+    subject = re.search(r'how many (\w+)', lowered)
+    count_role = COUNT_SUBJECTS.get(subject.group(1)) if subject else None
+    # "total number of hours", "count the hours": the hours are summed, not counted
+    if 'count' in metrics and count_role is None and (named_measure is not None or MEASURE_WORDS.search(question)):
+        metrics.discard('count')
+        metrics.add('sum')
+    # "most total hours" ranks employees by their totals
+    if metrics & {'max', 'min'}:
+        metrics.discard('sum')
+    if len(metrics) != 1:
+        return None
+    metric = metrics.pop()
+
+    if measure is None and metric != 'count':
+        return None
+    value_filters = find_value_filters(question, df, roles.get('employee'))
+    if find_unparsed_grouping(question, value_filters):
+        return None
+
+    group_by = None
+    for role, pattern in GROUP_PATTERNS.items():
+        if roles.get(role) is not None and pattern.search(question):
+            group_by = roles[role]
+            break
+
+    distinct = None
+    if metric == 'count':
+        if count_role is not None:
+            distinct = roles.get(count_role)
+            if distinct is None:
+                return None
+            # "How many employees are there?" names the counted column, it does not group by it
+            if group_by == distinct and not GROUPING_PATTERN.search(question):
+                group_by = None
+        if group_by is not None:
+            return None
+
+    # "Who logged the most hours" ranks employees by total hours
+    if metric in ('max', 'min') and group_by is None:
+        return None
+
+    # "Top 3 projects by hours" is a ranked list, not a single winner
+    limit = None
+    top = TOP_N_PATTERN.search(question)
+    if top:
+        if metric != 'max':
+            return None
+        metric, limit = 'sum', max(1, int(top.group(1)))
+
+    return {
+        'metric': metric,
+        'measure': measure,
+        'group_by': group_by,
+        'distinct': distinct,
+        'limit': limit,
+        'value_filters': value_filters,
+        'date_range': find_date_range(question),
+        'date_column': roles.get('date'),
+    }
+
+# --- EXECUTION ---
+
+def totals_from_rollups(query, rollups):
+    """Group totals for an unfiltered sum/max/min query read from the precomputed cube, or None."""
+    if query['value_filters'] or query['date_range'] or query['metric'] not in ('sum', 'max', 'min'):
+        return None
+    name = find_rollup(rollups, [query['group_by']])
+    return rollup_series(rollups, name, query['measure']) if name else None
+
+def run_query(df, query, rollups=None):
+    """Executes a structured query with vectorized pandas operations (or precomputed rollups)."""
+    if query['group_by'] is not None:
+        totals = totals_from_rollups(query, rollups)
+        if totals is not None and not totals.empty:
+            return {'rows': len(df), 'filters': [], 'query': query, 'value': rank_totals(totals, query['metric'], query.get('limit'))}
+
+    filtered, descriptions = apply_filters(df, query['value_filters'], query['date_range'], query['date_column'])
+    result = {'rows': len(filtered), 'filters': descriptions, 'query': query}
+
+    if filtered.empty:
+        result['value'] = None
+        return result
+
+    metric, measure, group_by = query['metric'], query['measure'], query['group_by']
+
+    if metric == 'count':
+        result['value'] = int(filtered[query['distinct']].nunique()) if query['distinct'] is not None else len(filtered)
+        return result
+
+    if group_by is None:
+        series = filtered[measure]
+        result['value'] = float(series.mean() if metric == 'mean' else series.sum())
+        return result
+
+    grouped = filtered.groupby(group_by, observed=True)[measure]
+    totals = grouped.mean() if metric == 'mean' else grouped.sum()
+    result['value'] = rank_totals(totals, metric, query.get('limit'))
+    return result
+
+def rank_totals(totals, metric, limit=None):
+    """Reduces per-group totals to the (name, value) pair or ranked list (at most `limit` long) a metric asks for."""
+    if metric == 'max':
+        return (str(totals.idxmax()), float(totals.max()))
+    if metric == 'min':
+        return (str(totals.idxmin()), float(totals.min()))
+    ranked = totals.sort_values(ascending=False)
+    if limit:
+        ranked = ranked.head(limit)
+    return [(str(name), float(value)) for name, value in ranked.items()]
+
+def format_result(result):
+    """Renders a query result as a short plain-text answer."""
+    query = result['query']
+    scope = f" ({'; '.join(result['filters'])})" if result['filters'] else ""
+    value = result['value']
+    if value is None:
+        return f"No timesheet rows match that question{scope}."
+
+    measure = query['measure']
+    metric = query['metric']
+    if metric == 'count':
+        subject = f"distinct {query['distinct']} values" if query['distinct'] is not None else "matching rows"
+        return f"There are {value} {subject}{scope}."
+    if query['group_by'] is None:
+        label = 'Average' if metric == 'mean' else 'Total'
+        return f"{label} {measure}: {value:.2f}{scope}, across {result['rows']} rows."
+    if metric in ('max', 'min'):
+        name, amount = value
+        word = 'most' if metric == 'max' else 'least'
+        return f"{name} has the {word} {measure} with {amount:.2f}{scope}."
+
+    label = 'Average' if metric == 'mean' else 'Total'
+    header = f"{label} {measure} by {query['group_by']}{scope}:"
+    if query.get('limit'):
+        header = f"Top {len(value)} {query['group_by']} by total {measure}{scope}:"
+    lines = [header]
+    lines += [f"- {name}: {amount:.2f}" for name, amount in value[:25]]
+    if len(value) > 25:
+        lines.append(f"...and {len(value) - 25} more.")
+    return "\n".join(lines)
+
+def answer_locally(df, question, rollups=None):
+    """
+    Answers plain aggregate questions straight from the DataFrame, reading
+    unfiltered group totals from the precomputed rollups when available.
+    Returns {'answer': str, 'result': dict} or None when the LLM is needed.
+    """
+    if df.empty:
+        return None
+    query = parse_query(question, df)
+    if query is None:
+        return None
+    result = run_query(df, query, rollups)
+    return {'answer': format_result(result), 'result': result}
@@ -1,18 +1,25 @@
 import os
+import atexit
 import logging
 import pandas as pd
-from flask import Flask, request, jsonify
+import hmac
+import shutil
+import multiprocessing
+from uuid import uuid4
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 from datetime import datetime
-from uuid import uuid4
 
 # CRITICAL: Import all necessary functions from the service file
 try:
     from backend.llm_service import (
         upload_timesheet_to_db, 
+        rollback_timesheet_upload,
         get_timesheet_data_from_db, 
+        get_dataset_scope,
         get_llm_response,
+        stream_llm_response,
+        answer_questions,
         # MongoDB Auth Functions
         create_user,
         verify_user,
@@ -21,21 +28,45 @@ try:
         get_user_data_by_email,  # Add this import
         update_password,
         update_password_by_email,  # Add this import
+        invalidate_session_token,
+        get_password_hashing_stats,
+        get_session_token_stats,
+        PasswordHashingBusyError,
+        get_auth_cache_stats,
+        get_response_cache_stats,
+        get_llm_gateway_stats,
+        get_llm_model_stats,
         # Chat History Functions
         create_chat_session,
         add_message_to_chat,
+        touch_chat_session,
+        load_conversation_history,
+        save_chat_turn,
+        flush_chat_writes,
+        get_chat_write_stats,
         get_user_chat_sessions,
         get_chat_messages,
+        get_chat_messages_page,
         delete_chat_session,
-        # MongoDB client function
-        get_mongo_client
+        delete_chat_sessions,
+        parse_bulk_delete_request,
+        start_retention_sweeper,
+        get_retention_stats,
+        # MongoDB client functions
+        get_mongo_client,
+        get_database,
+        close_mongo_client
     )
 except ImportError as e:
     logging.error(f"FATAL: Failed to import llm_service.py or its functions. Error: {e}")
     # Define placeholder functions to prevent server crash
-    def upload_timesheet_to_db(df): raise RuntimeError("LLM service module not found.")
-    def get_timesheet_data_from_db(): return pd.DataFrame()
-    def get_llm_response(user_query): return "LLM service unavailable."
+    def upload_timesheet_to_db(df, scope=None): raise RuntimeError("LLM service module not found.")
+    def rollback_timesheet_upload(scope=None): return None
+    def get_timesheet_data_from_db(scope=None): return pd.DataFrame()
+    def get_dataset_scope(username): return None
+    def get_llm_response(user_query, scope=None, history=None): return "LLM service unavailable."
+    def stream_llm_response(user_query, scope=None, history=None): yield "LLM service unavailable."
+    def answer_questions(queries, scope=None): return [{'query': q, 'error': "LLM service unavailable."} for q in queries]
     # Define placeholder auth functions
     def create_user(*args, **kwargs): raise RuntimeError("Auth service unavailable.")
     def verify_user(*args, **kwargs): return None, None
@@ -44,27 +75,122 @@ except ImportError as e:
     def get_user_data_by_email(*args, **kwargs): return None  # Add placeholder
     def update_password(*args, **kwargs): return False
     def update_password_by_email(*args, **kwargs): return False  # Add placeholder
+    def invalidate_session_token(*args, **kwargs): return None
+    def get_password_hashing_stats(*args, **kwargs): return {}
+    def get_session_token_stats(*args, **kwargs): return {}
+    class PasswordHashingBusyError(RuntimeError): pass
+    def get_auth_cache_stats(*args, **kwargs): return {}
+    def get_response_cache_stats(*args, **kwargs): return {}
+    def get_llm_gateway_stats(*args, **kwargs): return {}
+    def get_llm_model_stats(*args, **kwargs): return {}
     # Define placeholder chat functions
     def create_chat_session(*args, **kwargs): return None
     def add_message_to_chat(*args, **kwargs): return False
-    def get_user_chat_sessions(*args, **kwargs): return []
+    def touch_chat_session(*args, **kwargs): return None
+    def load_conversation_history(*args, **kwargs): return []
+    def save_chat_turn(*args, **kwargs): return False
+    def flush_chat_writes(*args, **kwargs): return None
+    def get_chat_write_stats(*args, **kwargs): return {}
+    def get_user_chat_sessions(*args, **kwargs): return {'sessions': [], 'has_more': False, 'next_before': None}
     def get_chat_messages(*args, **kwargs): return []
+    def get_chat_messages_page(*args, **kwargs): return None
     def delete_chat_session(*args, **kwargs): return False
+    def delete_chat_sessions(*args, **kwargs): return 0
+    def parse_bulk_delete_request(*args, **kwargs): return None, "Chat service unavailable."
+    def start_retention_sweeper(*args, **kwargs): return None
+    def get_retention_stats(*args, **kwargs): return {}
     def get_mongo_client(*args, **kwargs): return None
+    def get_database(*args, **kwargs): return None
+    def close_mongo_client(*args, **kwargs): return None
+
+from backend.chat_api import (
+    CHAT_NOT_FOUND,
+    CHAT_ACCESS_DENIED,
+    INVALID_CURSOR,
+    SSE_HEADERS,
+    parse_include_stats,
+    parse_chat_request,
+    parse_chat_batch_request,
+    parse_session_name,
+    session_created_payload,
+    session_validation_payload,
+    bulk_delete_payload,
+    batch_turn_messages,
+    sse_event,
+    internal_error_payload,
+)
+
+try:
+    from backend.upload_jobs import submit_upload_job, get_upload_job, start_upload_workers, get_upload_job_stats
+except ImportError as e:
+    logging.error(f"Failed to import upload job queue. Error: {e}")
+    def submit_upload_job(*args, **kwargs): raise RuntimeError("Upload job queue unavailable.")
+    def get_upload_job(*args, **kwargs): return None
+    def start_upload_workers(*args, **kwargs): return None
+    def get_upload_job_stats(*args, **kwargs): return {}
+
+try:
+    from backend.schema import bootstrap_schema, register_schema_commands
+except ImportError as e:
+    logging.error(f"Failed to import schema manager. Error: {e}")
+    def bootstrap_schema(): return None
+    def register_schema_commands(app): return None
 
 logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 CORS(app) 
 
+# Create all MongoDB indexes once per process instead of on every query,
+# and expose `flask db-indexes verify|migrate`
+register_schema_commands(app)
+
+# Password hashing processes (forkserver/spawn) re-import the main module;
+# only the server process itself bootstraps and runs background work
+IS_SERVER_PROCESS = multiprocessing.parent_process() is None
+
+if IS_SERVER_PROCESS and os.getenv("SCHEMA_BOOTSTRAP", "1") == "1":
+    bootstrap_schema()
+
+if IS_SERVER_PROCESS:
+    # Deletes chat sessions past CHAT_RETENTION_DAYS when an in-process sweep interval is configured
+    start_retention_sweeper()
+
+# Release the shared MongoClient pool when the worker process exits
+atexit.register(close_mongo_client)
+# Runs before close_mongo_client (atexit is LIFO) so queued chat turns are written first
+atexit.register(flush_chat_writes)
+
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+# Copy buffer when spooling an upload to disk
+UPLOAD_SPOOL_BUFFER_BYTES = 1024 * 1024
+
+# /metrics is operational data. It is only served when METRICS_TOKEN is set,
+# to callers sending "Authorization: Bearer <METRICS_TOKEN>"; client addresses
+# prove nothing behind a same-host reverse proxy.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+@app.before_request
+def ensure_upload_workers():
+    """
+    Starts this worker's upload job threads on its first request (and again if
+    one died), so they run in the serving process even under a preloading
+    server, and pick up jobs left queued or interrupted by a previous run.
+    """
+    start_upload_workers()
+
 # --- AUTHENTICATION ROUTES (MIGRATED TO MONGODB) ---
 
+@app.errorhandler(PasswordHashingBusyError)
+def password_hashing_busy(e):
+    """Login storms are shed with a retryable 503 instead of queuing without bound."""
+    return jsonify({"error": "The server is busy, please try again in a few seconds."}), 503, {'Retry-After': '2'}
+
 @app.route('/login', methods=['POST'])
 def login():
     data = request.json
@@ -211,6 +337,17 @@ def reset_password_with_email():
 # --- AUTHENTICATION/API HELPER FUNCTIONS (Updated to use MongoDB) ---
 # -------------------------------------------------------------
 
+def authorize_metrics_request():
+    """Returns an (error response, status) pair when the caller may not read /metrics, else (None, None)."""
+    if not METRICS_TOKEN:
+        # Disabled endpoint: indistinguishable from a missing route
+        return jsonify({"error": "Not found"}), 404
+    auth_header = request.headers.get('Authorization', '')
+    supplied = auth_header[len('Bearer '):] if auth_header.startswith('Bearer ') else ''
+    if not hmac.compare_digest(supplied.encode('utf-8'), METRICS_TOKEN.encode('utf-8')):
+        return jsonify({"error": "Metrics token required."}), 401
+    return None, None
+
 def authenticate_request():
     """Validates the Bearer token against MongoDB."""
     auth_header = request.headers.get('Authorization')
@@ -233,17 +370,24 @@ def authenticate_request():
 
 @app.route('/chat/sessions', methods=['GET'])
 def get_chat_sessions():
-    """Get all chat sessions for the authenticated user"""
+    """
+    Get one page of the authenticated user's chat sessions, most recently
+    updated first. Query params: limit (default 50), before (next_before of
+    the previous page) and include_stats=1 for message counts and previews.
+    """
     username, error_response, status_code = authenticate_request()
     if error_response:
         return error_response, status_code
     
     try:
-        sessions = get_user_chat_sessions(username)
-        return jsonify({"sessions": sessions}), 200
+        include_stats = parse_include_stats(request.args)
+        page = get_user_chat_sessions(username, request.args.get('limit'), request.args.get('before'), include_stats)
+        return jsonify(page), 200
+    except ValueError:
+        return jsonify({"error": INVALID_CURSOR}), 400
     except Exception as e:
         logging.error(f"Error fetching chat sessions: {e}")
-        return jsonify({"error": f"Error fetching chat sessions: {str(e)}"}), 500
+        return jsonify(internal_error_payload("fetching chat sessions", e)), 500
 
 @app.route('/chat/sessions', methods=['POST'])
 def create_new_chat_session():
@@ -253,38 +397,38 @@ def create_new_chat_session():
         return error_response, status_code
     
     try:
-        session_name = request.json.get('session_name', f"Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-        chat_id = create_chat_session(username, session_name)
+        chat_session = create_chat_session(username, parse_session_name(request.get_json(silent=True)))
         
-        if chat_id:
-            return jsonify({
-                "chat_id": chat_id,
-                "session_name": session_name,
-                "created_at": datetime.now().isoformat(),
-                "message": "Chat session created successfully"
-            }), 201
+        if chat_session:
+            return jsonify(session_created_payload(chat_session)), 201
         else:
             return jsonify({"error": "Failed to create chat session"}), 500
             
     except Exception as e:
         logging.error(f"Error creating chat session: {e}")
-        return jsonify({"error": f"Error creating chat session: {str(e)}"}), 500
+        return jsonify(internal_error_payload("creating chat session", e)), 500
 
 @app.route('/chat/sessions/<chat_id>', methods=['GET'])
 def get_chat_session(chat_id):
-    """Get all messages for a specific chat session"""
+    """
+    Get one page of messages for a chat session, newest page first.
+    Query params: limit (default 50, max 200) and before (the next_before
+    cursor of the previous page) to fetch older messages.
+    """
     username, error_response, status_code = authenticate_request()
     if error_response:
         return error_response, status_code
     
     try:
-        messages = get_chat_messages(chat_id, username)
-        if messages is None:  # Session doesn't exist
-            return jsonify({"error": "Chat session not found"}), 404
-        return jsonify({"messages": messages}), 200
+        page = get_chat_messages_page(chat_id, username, request.args.get('limit'), request.args.get('before'))
+        if page is None:  # Session doesn't exist
+            return jsonify({"error": CHAT_NOT_FOUND}), 404
+        return jsonify(page), 200
+    except ValueError:
+        return jsonify({"error": INVALID_CURSOR}), 400
     except Exception as e:
         logging.error(f"Error fetching chat messages: {e}")
-        return jsonify({"error": f"Error fetching chat messages: {str(e)}"}), 500
+        return jsonify(internal_error_payload("fetching chat messages", e)), 500
 
 @app.route('/chat/sessions/<chat_id>/validate', methods=['GET'])
 def validate_chat_session(chat_id):
@@ -294,34 +438,19 @@ def validate_chat_session(chat_id):
         return error_response, status_code
     
     try:
-        temp_client = get_mongo_client()
-        db = temp_client["data_analysis_app_db"]
-        chats_collection = db['chat_sessions']
+        chats_collection = get_database()['chat_sessions']
         
         chat = chats_collection.find_one({
             'chat_id': chat_id,
             'username': username
         })
         
-        if chat:
-            return jsonify({
-                "valid": True,
-                "chat_id": chat_id,
-                "session_name": chat.get('session_name', 'Unknown Session'),
-                "username": username
-            }), 200
-        else:
-            return jsonify({
-                "valid": False,
-                "error": "Chat session not found or access denied"
-            }), 404
+        payload, status = session_validation_payload(chat_id, username, chat)
+        return jsonify(payload), status
             
     except Exception as e:
         logging.error(f"Error validating chat session: {e}")
-        return jsonify({"error": f"Error validating chat session: {str(e)}"}), 500
-    finally:
-        if 'temp_client' in locals():
-            temp_client.close()
+        return jsonify(internal_error_payload("validating chat session", e)), 500
 
 @app.route('/chat/sessions/<chat_id>', methods=['DELETE'])
 def delete_chat_session_route(chat_id):
@@ -336,11 +465,32 @@ def delete_chat_session_route(chat_id):
         if success:
             return jsonify({"message": "Chat session deleted successfully"}), 200
         else:
-            return jsonify({"error": "Chat session not found or access denied"}), 404
+            return jsonify({"error": CHAT_ACCESS_DENIED}), 404
             
     except Exception as e:
         logging.error(f"Error deleting chat session: {e}")
-        return jsonify({"error": f"Error deleting chat session: {str(e)}"}), 500
+        return jsonify(internal_error_payload("deleting chat session", e)), 500
+
+@app.route('/chat/sessions/bulk-delete', methods=['POST'])
+def bulk_delete_chat_sessions():
+    """
+    Delete several chat sessions of the authenticated user at once. Body:
+    {"chat_ids": [...]}, {"older_than_days": N} or {"all": true}.
+    """
+    username, error_response, status_code = authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    criteria, error = parse_bulk_delete_request(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        deleted = delete_chat_sessions(username, **criteria)
+        return jsonify(bulk_delete_payload(deleted)), 200
+    except Exception as e:
+        logging.error(f"Error bulk deleting chat sessions: {e}")
+        return jsonify(internal_error_payload("deleting chat sessions", e)), 500
 
 # -------------------------------------------------------------
 # --- MAIN CHAT AND UPLOAD ROUTES ---
@@ -348,37 +498,77 @@ def delete_chat_session_route(chat_id):
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    """
+    Spools a CSV upload to disk and queues it for background ingestion.
+    Accepts a multipart 'file' field or a raw text/csv request body. Returns
+    202 with a job id to poll at /upload/jobs/<job_id>.
+    """
     username, error_response, status_code = authenticate_request()
     if error_response:
         return error_response, status_code
     
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
-    
-    if file:
-        filename = secure_filename(f"{username}_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv")
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+    if request.mimetype in ('text/csv', 'application/octet-stream'):
+        stream = request.stream
+        filename = None
+    else:
+        if 'file' not in request.files:
+            return jsonify({"error": "No file part"}), 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({"error": "No selected file"}), 400
+        stream = file.stream
+        filename = file.filename
 
-        try:
-            df = pd.read_csv(file_path)
-            # The service function handles MongoDB insertion
-            upload_timesheet_to_db(df) 
-            
-            os.remove(file_path) 
-            
-            return jsonify({"message": "File uploaded and processed successfully."}), 200
-        except Exception as e:
-            logging.error(f"Error processing CSV file for {username}: {e}")
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            return jsonify({"error": f"Error processing file: {str(e)}"}), 500
+    path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid4().hex}.csv")
+    try:
+        with open(path, 'wb') as spool:
+            shutil.copyfileobj(stream, spool, UPLOAD_SPOOL_BUFFER_BYTES)
+        job_id = submit_upload_job(username, get_dataset_scope(username), path, filename)
+        return jsonify({
+            "message": "File received; processing has started.",
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/upload/jobs/{job_id}"
+        }), 202
+    except Exception as e:
+        logging.error(f"Error queueing CSV file for {username}: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+        return jsonify({"error": f"Error processing file: {str(e)}"}), 500
+
+@app.route('/upload/jobs/<job_id>', methods=['GET'])
+def get_upload_job_status(job_id):
+    """Reports an upload job's status (queued, running, succeeded, failed) and rows processed so far"""
+    username, error_response, status_code = authenticate_request()
+    if error_response:
+        return error_response, status_code
 
-    return jsonify({"error": "File upload failed due to unknown error."}), 500
+    try:
+        job = get_upload_job(job_id, username)
+        if not job:
+            return jsonify({"error": "Upload job not found"}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        logging.error(f"Error reading upload job {job_id}: {e}")
+        return jsonify({"error": f"Error reading upload job: {str(e)}"}), 500
+
+@app.route('/upload/rollback', methods=['POST'])
+def rollback_upload():
+    """Re-activates the previous timesheet upload"""
+    username, error_response, status_code = authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    try:
+        generation = rollback_timesheet_upload(get_dataset_scope(username))
+        if generation is None:
+            return jsonify({"error": "No previous upload to roll back to."}), 409
+        logging.info(f"User {username} rolled back timesheet data to generation {generation}.")
+        return jsonify({"message": "Timesheet data rolled back to the previous upload.", "generation": generation}), 200
+    except Exception as e:
+        logging.error(f"Error rolling back timesheet upload: {e}")
+        return jsonify({"error": f"Error rolling back upload: {str(e)}"}), 500
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -387,43 +577,94 @@ def chat():
     if error_response:
         return error_response, status_code
     
-    data = request.json
-    user_query = data.get('query')
-    chat_id = data.get('chat_id')  # Required: specify which chat session
-    
-    if not user_query:
-        return jsonify({"error": "Query is required."}), 400
-    if not chat_id:
-        return jsonify({"error": "Chat ID is required."}), 400
+    parsed, error = parse_chat_request(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+    user_query, chat_id = parsed
 
     try:
-        # First validate the chat session exists
-        temp_client = get_mongo_client()
-        db = temp_client["data_analysis_app_db"]
-        chats_collection = db['chat_sessions']
-        
-        chat = chats_collection.find_one({
-            'chat_id': chat_id,
-            'username': username
-        })
-        
-        if not chat:
-            return jsonify({"error": "Chat session not found"}), 404
+        # Validate the chat session belongs to the user (and bump updated_at) in one write
+        session = touch_chat_session(chat_id, username)
+        if not session:
+            return jsonify({"error": CHAT_NOT_FOUND}), 404
             
-        # Get LLM response
-        llm_answer = get_llm_response(user_query)
+        # Get LLM response, with the conversation so far as context
+        history = load_conversation_history(chat_id, session)
+        llm_answer = get_llm_response(user_query, get_dataset_scope(username), history)
         
-        # Store both messages in the database
-        add_message_to_chat(chat_id, 'user', user_query)
-        add_message_to_chat(chat_id, 'bot', llm_answer)
+        # Store the question and answer with a single insert
+        save_chat_turn(chat_id, [('user', user_query), ('bot', llm_answer)])
         
         return jsonify({"answer": llm_answer}), 200
     except Exception as e:
         logging.error(f"An internal server error occurred during chat: {e}")
         return jsonify({"error": f"An internal server error occurred during chat: {str(e)}"}), 500
-    finally:
-        if 'temp_client' in locals():
-            temp_client.close()
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat: forwards answer deltas as Server-Sent Events
+    and persists the assembled bot message once the stream finishes.
+    """
+    username, error_response, status_code = authenticate_request()
+    if error_response:
+        return error_response, status_code
+    
+    parsed, error = parse_chat_request(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+    user_query, chat_id = parsed
+
+    try:
+        session = touch_chat_session(chat_id, username)
+        if not session:
+            return jsonify({"error": CHAT_NOT_FOUND}), 404
+        scope = get_dataset_scope(username)
+        history = load_conversation_history(chat_id, session)
+    except Exception as e:
+        logging.error(f"An internal server error occurred during chat: {e}")
+        return jsonify({"error": f"An internal server error occurred during chat: {str(e)}"}), 500
+
+    def generate():
+        parts = []
+        try:
+            for delta in stream_llm_response(user_query, scope, history):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            yield sse_event({"answer": "".join(parts)}, event="done")
+        finally:
+            # Runs on normal completion and on client disconnect alike
+            save_chat_turn(chat_id, [('user', user_query), ('bot', "".join(parts))])
+
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Answers a list of questions for one chat session concurrently and
+    persists every user/bot pair with a single write. Results are returned
+    in request order; failed items carry an 'error' instead of an 'answer'.
+    """
+    username, error_response, status_code = authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    parsed, error = parse_chat_batch_request(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+    queries, chat_id = parsed
+
+    try:
+        if not touch_chat_session(chat_id, username):
+            return jsonify({"error": CHAT_NOT_FOUND}), 404
+
+        results = answer_questions(queries, get_dataset_scope(username))
+        save_chat_turn(chat_id, batch_turn_messages(results))
+
+        return jsonify({"results": results}), 200
+    except Exception as e:
+        logging.error(f"An internal server error occurred during batch chat: {e}")
+        return jsonify({"error": f"An internal server error occurred during batch chat: {str(e)}"}), 500
 
 @app.route('/signout', methods=['POST'])
 def signout():
@@ -433,13 +674,8 @@ def signout():
         return jsonify({"message": "Signout successful."}), 200 # Treat as successful if no token provided
 
     session_token = auth_header.split(' ')[1] 
-    username = get_user_by_token(session_token)
-    
-    if username:
-        # Invalidate the token in MongoDB (by setting it to None)
-        # We use uuid4() to generate a unique, dummy password just for the update call
-        # which clears the session token in the DB.
-        update_password(username, str(uuid4())) 
+    # Clears the token in MongoDB and in every worker's auth cache
+    invalidate_session_token(session_token)
         
     return jsonify({"message": "Signout successful."}), 200
 
@@ -452,5 +688,24 @@ def health_check():
     """Simple health check endpoint"""
     return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Process-local cache and pool counters for this worker (requires METRICS_TOKEN)"""
+    error_response, status_code = authorize_metrics_request()
+    if error_response:
+        return error_response, status_code
+
+    return jsonify({
+        "auth_cache": get_auth_cache_stats(),
+        "response_cache": get_response_cache_stats(),
+        "llm_gateway": get_llm_gateway_stats(),
+        "llm_models": get_llm_model_stats(),
+        "chat_writes": get_chat_write_stats(),
+        "password_hashing": get_password_hashing_stats(),
+        "session_tokens": get_session_token_stats(),
+        "chat_retention": get_retention_stats(),
+        "upload_jobs": get_upload_job_stats()
+    }), 200
+
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
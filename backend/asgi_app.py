@@ -0,0 +1,485 @@
+"""
+Asyncio serving mode for the chat routes.
+
+The /chat and /chat/sessions* routes are served by a Quart app backed by
+Motor and AsyncOpenAI, so a slow LLM call only parks a coroutine instead of
+holding a worker thread. Every other route is forwarded to the existing
+Flask app, so one ASGI process serves the whole API:
+
+    pip install -r requirements-asgi.txt
+    hypercorn backend.asgi_app:app --bind 127.0.0.1:5000
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+import pymongo
+from asgiref.wsgi import WsgiToAsgi
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+
+from .app import app as flask_app
+from .auth_cache import token_cache
+from .session_tokens import is_signed_token
+from .chat_api import (
+    CHAT_NOT_FOUND,
+    CHAT_ACCESS_DENIED,
+    INVALID_CURSOR,
+    SSE_HEADERS,
+    parse_include_stats,
+    parse_chat_request,
+    parse_chat_batch_request,
+    parse_session_name,
+    session_created_payload,
+    session_validation_payload,
+    bulk_delete_payload,
+    batch_turn_messages,
+    sse_event,
+    internal_error_payload,
+)
+from .conversation import history_messages, memory_fetch_limit, needs_summary, split_window
+from .llm_gateway import AsyncLLMGateway, build_async_openai_client
+from .llm_service import (
+    MONGO_URI,
+    MONGO_DATABASE_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    OPENROUTER_API_KEY,
+    OPENROUTER_BASE_URL,
+    LLM_ERROR_MESSAGE,
+    BATCH_CONCURRENCY,
+    CHAT_MESSAGES_COLLECTION,
+    llm_gateway,
+    session_signer,
+    session_revocations,
+    signed_token_username,
+    llm_router,
+    plan_llm_request,
+    store_llm_response,
+    get_dataset_scope,
+    new_chat_session_document,
+    new_chat_message,
+    chat_write_queue,
+    unsummarized_filter,
+    schedule_summary_update,
+    CHAT_SESSIONS_PAGE_DEFAULT_LIMIT,
+    session_page_filter,
+    session_list_projection,
+    session_stats_updates,
+    split_retried_documents,
+    refresh_session_stats,
+    build_session_page,
+    delete_chat_sessions,
+    parse_bulk_delete_request,
+    message_page_filter,
+    build_message_page,
+    clamp_page_limit,
+    migrate_session_messages,
+)
+
+chat_app = cors(Quart(__name__))
+
+# Created per process inside the event loop in before_serving
+_motor_client = None
+client_openai_async = None
+llm_gateway_async = None
+
+# --- LIFECYCLE ---
+
+@chat_app.before_serving
+async def startup():
+    global _motor_client, client_openai_async, llm_gateway_async
+    _motor_client = AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS
+    )
+    client_openai_async = build_async_openai_client(OPENROUTER_BASE_URL, OPENROUTER_API_KEY)
+    # Shares the circuit breaker with the Flask routes of this process; the
+    # Quart routes are capped by LLM_ASYNC_MAX_CONCURRENCY instead of LLM_MAX_CONCURRENCY
+    llm_gateway_async = AsyncLLMGateway(client_openai_async, breaker=llm_gateway.breaker)
+    llm_router.providers['openrouter'].async_gateway = llm_gateway_async
+
+@chat_app.after_serving
+async def shutdown():
+    if _motor_client is not None:
+        _motor_client.close()
+    if client_openai_async is not None:
+        await client_openai_async.close()
+
+def get_chats_collection():
+    return _motor_client[MONGO_DATABASE_NAME]['chat_sessions']
+
+def get_messages_collection():
+    return _motor_client[MONGO_DATABASE_NAME][CHAT_MESSAGES_COLLECTION]
+
+def get_users_collection():
+    return _motor_client[MONGO_DATABASE_NAME]['users']
+
+# --- ASYNC SERVICE FUNCTIONS ---
+
+async def get_user_by_token(session_token):
+    """Async counterpart of llm_service.get_user_by_token sharing the same token cache."""
+    if not session_token:
+        return None
+    if session_signer is not None and is_signed_token(session_token):
+        if session_revocations.refresh_due():
+            await asyncio.to_thread(session_revocations.refresh)
+        return signed_token_username(session_token)
+    cached_username = token_cache.get(session_token)
+    if cached_username:
+        return cached_username
+    epoch = token_cache.epoch()
+    try:
+        user_doc = await get_users_collection().find_one(
+            {'session_token': session_token},
+            {'username': 1, '_id': 0}
+        )
+        if user_doc:
+            username = user_doc.get('username')
+            token_cache.put(session_token, username, epoch)
+            return username
+        return None
+    except Exception as e:
+        logging.error(f"Error retrieving user by token: {e}")
+        return None
+
+async def authenticate_request():
+    """Validates the Bearer token. Same contract as app.authenticate_request."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None, jsonify({"error": "Authorization token required."}), 401
+
+    username = await get_user_by_token(auth_header.split(' ')[1])
+    if not username:
+        return None, jsonify({"error": "Invalid or expired session token."}), 401
+    return username, None, None
+
+async def touch_chat_session(chat_id, username):
+    """Async counterpart of llm_service.touch_chat_session (ownership check + updated_at in one write)."""
+    return await get_chats_collection().find_one_and_update(
+        {'chat_id': chat_id, 'username': username},
+        {'$set': {'updated_at': datetime.now()}},
+        projection={'chat_id': 1, 'summary': 1, 'summarized_until': 1, '_id': 0}
+    )
+
+async def load_conversation_history(chat_id, session):
+    """Async counterpart of llm_service.load_conversation_history; summaries still update in a worker thread."""
+    try:
+        cursor = (
+            get_messages_collection()
+            .find(unsummarized_filter(chat_id, session), {'sender': 1, 'text': 1})
+            .sort([('timestamp', -1), ('_id', -1)])
+            .limit(memory_fetch_limit())
+        )
+        newest_first = [msg async for msg in cursor]
+    except Exception as e:
+        logging.error(f"Error loading conversation history: {e}")
+        return []
+    overflow, window = split_window(newest_first[::-1])
+    if needs_summary(overflow):
+        schedule_summary_update(chat_id)
+    return history_messages(session.get('summary'), window)
+
+async def save_chat_turn(chat_id, messages):
+    """Async counterpart of llm_service.save_chat_turn; shares its write-behind queue when enabled."""
+    documents = [new_chat_message(chat_id, sender, text) for sender, text in messages]
+    if chat_write_queue is not None and chat_write_queue.put(documents):
+        return True
+    try:
+        try:
+            await get_messages_collection().insert_many(documents, ordered=False)
+            fresh, retried_chat_ids = documents, set()
+        except pymongo.errors.BulkWriteError as e:
+            fresh, retried_chat_ids = split_retried_documents(documents, e)
+        if fresh:
+            await get_chats_collection().bulk_write(session_stats_updates(fresh), ordered=False)
+        for chat_id in retried_chat_ids:
+            await asyncio.to_thread(refresh_session_stats, chat_id)
+        return True
+    except Exception as e:
+        logging.error(f"Error saving chat turn: {e}")
+        return False
+
+async def plan_request_for_user(user_query, username, history=None):
+    """Resolves the user's dataset scope and plans the request off the event loop."""
+    def plan():
+        return plan_llm_request(user_query, get_dataset_scope(username), history)
+    # Local analytics and prompt building are CPU-bound pandas work (plus a possible team lookup)
+    return await asyncio.to_thread(plan)
+
+async def request_llm_answer(user_query, username, history=None):
+    """Answers one question (locally, from the cache or via the LLM). Raises on failure."""
+    answer, llm_request, cache_entry = await plan_request_for_user(user_query, username, history)
+    if answer is not None:
+        return answer
+
+    answer = await llm_router.acomplete(llm_request)
+    await asyncio.to_thread(store_llm_response, cache_entry, answer)
+    return answer
+
+async def get_llm_response(user_query, username, history=None):
+    try:
+        return await request_llm_answer(user_query, username, history)
+    except Exception as e:
+        logging.error(f"An error occurred while getting LLM response: {e}")
+        return LLM_ERROR_MESSAGE
+
+async def answer_questions(queries, username, concurrency=BATCH_CONCURRENCY):
+    """Async counterpart of llm_service.answer_questions bounded by a semaphore."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer_one(user_query):
+        async with semaphore:
+            try:
+                return {'query': user_query, 'answer': await request_llm_answer(user_query, username)}
+            except Exception as e:
+                logging.error(f"An error occurred while answering batch question: {e}")
+                return {'query': user_query, 'error': LLM_ERROR_MESSAGE}
+
+    return await asyncio.gather(*(answer_one(query) for query in queries))
+
+async def stream_llm_response(user_query, username, history=None):
+    try:
+        answer, llm_request, cache_entry = await plan_request_for_user(user_query, username, history)
+        if answer is not None:
+            yield answer
+            return
+
+        parts = []
+        async for delta in llm_router.astream(llm_request):
+            parts.append(delta)
+            yield delta
+        await asyncio.to_thread(store_llm_response, cache_entry, "".join(parts))
+
+    except Exception as e:
+        logging.error(f"An error occurred while streaming LLM response: {e}")
+        yield LLM_ERROR_MESSAGE
+
+# --- CHAT HISTORY ROUTES ---
+
+@chat_app.route('/chat/sessions', methods=['GET'])
+async def get_chat_sessions():
+    """Get one page of the user's chat sessions (limit / before / include_stats, as in app.get_chat_sessions)"""
+    username, error_response, status_code = await authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    try:
+        include_stats = parse_include_stats(request.args)
+        limit = clamp_page_limit(request.args.get('limit'), CHAT_SESSIONS_PAGE_DEFAULT_LIMIT)
+        cursor = (
+            get_chats_collection()
+            .find(session_page_filter(username, request.args.get('before')), session_list_projection(include_stats))
+            .sort([('updated_at', -1), ('_id', -1)])
+            .limit(limit + 1)
+        )
+        return jsonify(build_session_page([session async for session in cursor], limit, include_stats)), 200
+    except ValueError:
+        return jsonify({"error": INVALID_CURSOR}), 400
+    except Exception as e:
+        logging.error(f"Error fetching chat sessions: {e}")
+        return jsonify(internal_error_payload("fetching chat sessions", e)), 500
+
+@chat_app.route('/chat/sessions', methods=['POST'])
+async def create_new_chat_session():
+    """Create a new chat session for the authenticated user"""
+    username, error_response, status_code = await authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    try:
+        chat_session = new_chat_session_document(username, parse_session_name(await request.get_json(silent=True)))
+        await get_chats_collection().insert_one(chat_session)
+        return jsonify(session_created_payload(chat_session)), 201
+    except Exception as e:
+        logging.error(f"Error creating chat session: {e}")
+        return jsonify(internal_error_payload("creating chat session", e)), 500
+
+@chat_app.route('/chat/sessions/<chat_id>', methods=['GET'])
+async def get_chat_session(chat_id):
+    """Get one page of messages for a chat session (limit / before, as in app.get_chat_session)"""
+    username, error_response, status_code = await authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    try:
+        chat = await get_chats_collection().find_one(
+            {'chat_id': chat_id, 'username': username},
+            {'messages': {'$slice': 1}, 'chat_id': 1}
+        )
+        if not chat:
+            return jsonify({"error": CHAT_NOT_FOUND}), 404
+        if chat.get('messages'):
+            # Legacy session with embedded history: move it over once (sync driver, off the loop)
+            await asyncio.to_thread(migrate_session_messages, chat_id)
+
+        limit = clamp_page_limit(request.args.get('limit'))
+        cursor = (
+            get_messages_collection()
+            .find(message_page_filter(chat_id, request.args.get('before')))
+            .sort([('timestamp', -1), ('_id', -1)])
+            .limit(limit + 1)
+        )
+        return jsonify(build_message_page([msg async for msg in cursor], limit)), 200
+    except ValueError:
+        return jsonify({"error": INVALID_CURSOR}), 400
+    except Exception as e:
+        logging.error(f"Error fetching chat messages: {e}")
+        return jsonify(internal_error_payload("fetching chat messages", e)), 500
+
+@chat_app.route('/chat/sessions/<chat_id>/validate', methods=['GET'])
+async def validate_chat_session(chat_id):
+    """Validate if a chat session exists and belongs to the user"""
+    username, error_response, status_code = await authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    try:
+        chat = await get_chats_collection().find_one(
+            {'chat_id': chat_id, 'username': username},
+            {'session_name': 1}
+        )
+        payload, status = session_validation_payload(chat_id, username, chat)
+        return jsonify(payload), status
+    except Exception as e:
+        logging.error(f"Error validating chat session: {e}")
+        return jsonify(internal_error_payload("validating chat session", e)), 500
+
+@chat_app.route('/chat/sessions/<chat_id>', methods=['DELETE'])
+async def delete_chat_session_route(chat_id):
+    """Delete a specific chat session"""
+    username, error_response, status_code = await authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    try:
+        result = await get_chats_collection().delete_one({'chat_id': chat_id, 'username': username})
+        if result.deleted_count > 0:
+            await get_messages_collection().delete_many({'chat_id': chat_id})
+            return jsonify({"message": "Chat session deleted successfully"}), 200
+        return jsonify({"error": CHAT_ACCESS_DENIED}), 404
+    except Exception as e:
+        logging.error(f"Error deleting chat session: {e}")
+        return jsonify(internal_error_payload("deleting chat session", e)), 500
+
+@chat_app.route('/chat/sessions/bulk-delete', methods=['POST'])
+async def bulk_delete_chat_sessions():
+    """Delete several chat sessions at once (same contract as the Flask route)"""
+    username, error_response, status_code = await authenticate_request()
+    if error_response:
+        return error_response, status_code
+
+    criteria, error = parse_bulk_delete_request(await request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        # Batched, throttled deletes run on the sync driver off the event loop
+        deleted = await asyncio.to_thread(delete_chat_sessions, username, **criteria)
+        return jsonify(bulk_delete_payload(deleted)), 200
+    except Exception as e:
+        logging.error(f"Error bulk deleting chat sessions: {e}")
+        return jsonify(internal_error_payload("deleting chat sessions", e)), 500
+
+# --- MAIN CHAT ROUTES ---
+
+async def _parse_chat_request():
+    """Returns (username, query, chat_id, history, error_response, status_code)."""
+    username, error_response, status_code = await authenticate_request()
+    if error_response:
+        return None, None, None, None, error_response, status_code
+
+    parsed, error = parse_chat_request(await request.get_json(silent=True))
+    if error:
+        return None, None, None, None, jsonify({"error": error}), 400
+    user_query, chat_id = parsed
+
+    session = await touch_chat_session(chat_id, username)
+    if not session:
+        return None, None, None, None, jsonify({"error": CHAT_NOT_FOUND}), 404
+    history = await load_conversation_history(chat_id, session)
+    return username, user_query, chat_id, history, None, None
+
+@chat_app.route('/chat', methods=['POST'])
+async def chat():
+    """Main chat endpoint with persistent chat history"""
+    try:
+        username, user_query, chat_id, history, error_response, status_code = await _parse_chat_request()
+        if error_response:
+            return error_response, status_code
+
+        llm_answer = await get_llm_response(user_query, username, history)
+
+        await save_chat_turn(chat_id, [('user', user_query), ('bot', llm_answer)])
+
+        return jsonify({"answer": llm_answer}), 200
+    except Exception as e:
+        logging.error(f"An internal server error occurred during chat: {e}")
+        return jsonify({"error": f"An internal server error occurred during chat: {str(e)}"}), 500
+
+@chat_app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Streaming variant of /chat using Server-Sent Events"""
+    try:
+        username, user_query, chat_id, history, error_response, status_code = await _parse_chat_request()
+        if error_response:
+            return error_response, status_code
+    except Exception as e:
+        logging.error(f"An internal server error occurred during chat: {e}")
+        return jsonify({"error": f"An internal server error occurred during chat: {str(e)}"}), 500
+
+    async def generate():
+        parts = []
+        try:
+            async for delta in stream_llm_response(user_query, username, history):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            yield sse_event({"answer": "".join(parts)}, event="done")
+        finally:
+            await save_chat_turn(chat_id, [('user', user_query), ('bot', "".join(parts))])
+
+    response = Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.timeout = None  # Streams may outlive Quart's default response timeout
+    return response
+
+@chat_app.route('/chat/batch', methods=['POST'])
+async def chat_batch():
+    """Answers a list of questions concurrently; same contract as the Flask /chat/batch route"""
+    try:
+        username, error_response, status_code = await authenticate_request()
+        if error_response:
+            return error_response, status_code
+
+        parsed, error = parse_chat_batch_request(await request.get_json(silent=True))
+        if error:
+            return jsonify({"error": error}), 400
+        queries, chat_id = parsed
+
+        if not await touch_chat_session(chat_id, username):
+            return jsonify({"error": CHAT_NOT_FOUND}), 404
+
+        results = await answer_questions(queries, username)
+        await save_chat_turn(chat_id, batch_turn_messages(results))
+
+        return jsonify({"results": results}), 200
+    except Exception as e:
+        logging.error(f"An internal server error occurred during batch chat: {e}")
+        return jsonify({"error": f"An internal server error occurred during batch chat: {str(e)}"}), 500
+
+# --- ASGI ENTRYPOINT ---
+
+_flask_asgi = WsgiToAsgi(flask_app)
+
+async def app(scope, receive, send):
+    """Routes /chat* to the async app and everything else to the Flask app."""
+    path = scope.get('path', '') if scope['type'] in ('http', 'websocket') else ''
+    if scope['type'] == 'lifespan' or path == '/chat' or path.startswith('/chat/'):
+        await chat_app(scope, receive, send)
+    else:
+        await _flask_asgi(scope, receive, send)
@@ -0,0 +1,223 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+# Optional SQLite file shared by all workers on a host so revocations made in
+# one gunicorn worker evict the token everywhere. Empty = process-local only.
+AUTH_CACHE_SHARED_DB = os.getenv("AUTH_CACHE_SHARED_DB", "")
+# Without the shared log, other workers learn about a signout or password
+# reset only when their cached entry expires, so that window is kept short
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300" if AUTH_CACHE_SHARED_DB else "30"))
+AUTH_CACHE_POLL_SECONDS = float(os.getenv("AUTH_CACHE_POLL_SECONDS", "1.0"))
+
+# --- SHARED REVOCATION LOG ---
+
+class SQLiteRevocationLog:
+    """Append-only revocation log in a SQLite file that every worker polls."""
+
+    def __init__(self, path, retention_seconds=3600):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS revocations ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+            "value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connect(self):
+        # One connection per thread and per process; never reuse one across fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def latest_id(self):
+        row = self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM revocations").fetchone()
+        return row[0]
+
+    def publish(self, kind, value):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO revocations (kind, value, created_at) VALUES (?, ?, ?)",
+            (kind, value, now)
+        )
+        # Entries older than the retention window can no longer matter to any cache
+        conn.execute("DELETE FROM revocations WHERE created_at < ?", (now - self.retention_seconds,))
+
+    def since(self, last_id):
+        return self._connect().execute(
+            "SELECT id, kind, value FROM revocations WHERE id > ? ORDER BY id", (last_id,)
+        ).fetchall()
+
+# --- TOKEN CACHE ---
+
+class TokenCache:
+    """
+    Bounded LRU + TTL cache mapping session token -> username.
+    A hit costs a dict lookup; revocations from other workers are picked up
+    by polling the shared revocation log at most every poll_seconds.
+    Callers take epoch() before reading a token from the database and pass
+    it to put(), which skips the entry if any revocation landed in between.
+    """
+
+    def __init__(self, max_entries=AUTH_CACHE_MAX_ENTRIES, ttl_seconds=AUTH_CACHE_TTL_SECONDS,
+                 revocation_log=None, poll_seconds=AUTH_CACHE_POLL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.revocation_log = revocation_log
+        self.poll_seconds = poll_seconds
+        self._entries = OrderedDict()  # token -> (username, expires_at)
+        self._tokens_by_user = {}      # username -> set of cached tokens
+        self._lock = threading.Lock()
+        self._last_revocation_id = revocation_log.latest_id() if revocation_log else 0
+        self._next_poll_at = 0.0
+        self._epoch = 0                # bumped by every revocation
+        self.hits = 0
+        self.misses = 0
+        self.stale_puts = 0
+
+    def epoch(self):
+        return self._epoch
+
+    def get(self, token):
+        """Returns the cached username for a token, or None on a miss."""
+        now = time.monotonic()
+        if self.revocation_log and now >= self._next_poll_at:
+            self._apply_remote_revocations(now)
+
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._evict(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token, username, epoch=None):
+        """Caches a token; with `epoch`, only if nothing was revoked since that epoch() was read."""
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                self.stale_puts += 1
+                return
+            if token in self._entries:
+                self._evict(token)
+            self._entries[token] = (username, time.monotonic() + self.ttl_seconds)
+            self._tokens_by_user.setdefault(username, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._evict(oldest)
+
+    def invalidate_token(self, token):
+        """Drops a single token locally and in every worker sharing the log."""
+        with self._lock:
+            self._epoch += 1
+            self._evict(token)
+        self._publish('token', token)
+
+    def invalidate_user(self, username):
+        """Drops every token cached for a user (logout, password change, re-login)."""
+        with self._lock:
+            self._epoch += 1
+            self._evict_user(username)
+        self._publish('user', username)
+
+    def reset_after_fork(self):
+        """Gives a forked child its own lock and an empty cache."""
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_puts = 0
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'stale_puts': self.stale_puts,
+            'shared_backend': 'sqlite' if self.revocation_log else None,
+        }
+
+    # Callers must hold self._lock for the helpers below
+
+    def _evict(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry[0])
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry[0]]
+
+    def _evict_user(self, username):
+        for token in self._tokens_by_user.pop(username, set()):
+            self._entries.pop(token, None)
+
+    def _publish(self, kind, value):
+        if not self.revocation_log:
+            return
+        try:
+            self.revocation_log.publish(kind, value)
+        except Exception as e:
+            logging.error(f"Failed to publish token revocation: {e}")
+
+    def _apply_remote_revocations(self, now):
+        self._next_poll_at = now + self.poll_seconds
+        try:
+            rows = self.revocation_log.since(self._last_revocation_id)
+        except Exception as e:
+            logging.error(f"Failed to poll token revocations: {e}")
+            return
+        if not rows:
+            return
+        with self._lock:
+            self._epoch += 1
+            for row_id, kind, value in rows:
+                if kind == 'token':
+                    self._evict(value)
+                else:
+                    self._evict_user(value)
+                self._last_revocation_id = max(self._last_revocation_id, row_id)
+
+def _build_token_cache():
+    revocation_log = None
+    if AUTH_CACHE_SHARED_DB:
+        try:
+            revocation_log = SQLiteRevocationLog(AUTH_CACHE_SHARED_DB)
+        except Exception as e:
+            logging.error(f"Shared auth cache backend unavailable, using process-local cache: {e}")
+    return TokenCache(revocation_log=revocation_log)
+
+# Process-wide cache used by llm_service's auth functions
+token_cache = _build_token_cache()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=token_cache.reset_after_fork)
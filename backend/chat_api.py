@@ -0,0 +1,115 @@
+"""
+Request parsing and response shaping shared by the Flask routes (app.py)
+and the asyncio chat routes (asgi_app.py), so both front ends keep the
+same contract. Parsers return (value, error message); payload builders
+return plain dicts for the caller's jsonify.
+"""
+import json
+import os
+
+# --- CONFIGURATION ---
+
+# Upper bound on questions per /chat/batch request
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+
+# --- RESPONSE MESSAGES ---
+
+CHAT_NOT_FOUND = "Chat session not found"
+CHAT_ACCESS_DENIED = "Chat session not found or access denied"
+INVALID_CURSOR = "Invalid 'before' cursor"
+
+# Keeps Server-Sent Events flowing through caches and proxy buffers
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Disable proxy buffering so deltas flush immediately
+}
+
+# --- REQUEST PARSING ---
+
+def parse_include_stats(args):
+    """Reads the include_stats=1 / true query flag of the session list."""
+    return args.get('include_stats', '').lower() in ('1', 'true')
+
+def parse_chat_request(data):
+    """
+    Validates a /chat or /chat/stream body: {"query": ..., "chat_id": ...}.
+    Returns ((query, chat_id), error message).
+    """
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return None, "Request body must be a JSON object."
+    user_query = data.get('query')
+    chat_id = data.get('chat_id')
+    if not user_query:
+        return None, "Query is required."
+    if not chat_id:
+        return None, "Chat ID is required."
+    return (user_query, chat_id), None
+
+def parse_chat_batch_request(data):
+    """
+    Validates a /chat/batch body: {"queries": [...], "chat_id": ...}.
+    Returns ((queries, chat_id), error message).
+    """
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return None, "Request body must be a JSON object."
+    queries = data.get('queries')
+    chat_id = data.get('chat_id')
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return None, "Queries must be a non-empty list of questions."
+    if len(queries) > BATCH_MAX_QUERIES:
+        return None, f"At most {BATCH_MAX_QUERIES} queries are allowed per batch."
+    if not chat_id:
+        return None, "Chat ID is required."
+    return (queries, chat_id), None
+
+def parse_session_name(data):
+    """The optional session_name of a new chat session (None picks the dated default)."""
+    if not isinstance(data, dict):
+        return None
+    return data.get('session_name') or None
+
+# --- RESPONSE SHAPING ---
+
+def session_created_payload(chat_session):
+    """Body of the 201 response for a new chat session document."""
+    return {
+        "chat_id": chat_session['chat_id'],
+        "session_name": chat_session['session_name'],
+        "created_at": chat_session['created_at'].isoformat(),
+        "message": "Chat session created successfully"
+    }
+
+def session_validation_payload(chat_id, username, chat):
+    """Returns (body, status code) for /chat/sessions/<chat_id>/validate given the session found, if any."""
+    if not chat:
+        return {"valid": False, "error": CHAT_ACCESS_DENIED}, 404
+    return {
+        "valid": True,
+        "chat_id": chat_id,
+        "session_name": chat.get('session_name', 'Unknown Session'),
+        "username": username
+    }, 200
+
+def bulk_delete_payload(deleted):
+    return {"message": f"Deleted {deleted} chat sessions.", "deleted": deleted}
+
+def batch_turn_messages(results):
+    """Flattens answer_questions results into the (sender, text) pairs to persist, in order."""
+    messages = []
+    for item in results:
+        messages.append(('user', item['query']))
+        messages.append(('bot', item.get('answer', item.get('error'))))
+    return messages
+
+def sse_event(payload, event=None):
+    """Formats one Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(payload)}\n\n"
+
+def internal_error_payload(action, error):
+    """Body of a 500 response, e.g. internal_error_payload("fetching chat sessions", e)."""
+    return {"error": f"Error {action}: {str(error)}"}
@@ -0,0 +1,343 @@
+import os
+import re
+import calendar
+
+import pandas as pd
+
+from .tokens import count_tokens, truncate_to_tokens
+
+# --- CONFIGURATION ---
+
+# Upper bound on the size of the data context sent with each question
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Groups listed per precomputed aggregate
+CONTEXT_TOP_GROUPS = 15
+
+# Column-name hints used to recognise the role of each timesheet column
+ROLE_PATTERNS = {
+    'employee': re.compile(r'employee|emp\b|name|staff|worker|resource|user', re.I),
+    'project': re.compile(r'project|client|task|activity|job', re.I),
+    'date': re.compile(r'date|day|week|period', re.I),
+    'hours': re.compile(r'hour|hrs|duration|time\s*spent|effort|overtime', re.I),
+}
+
+MONTHS = {name.lower(): index for index, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): index for index, name in enumerate(calendar.month_abbr) if name})
+MONTH_PATTERN = re.compile(r'\b(' + '|'.join(sorted(MONTHS, key=len, reverse=True)) + r')\b(?:\s+(\d{4}))?', re.I)
+ISO_DATE_PATTERN = re.compile(r'\b(\d{4}-\d{2}-\d{2})\b')
+YEAR_PATTERN = re.compile(r'\b(20\d{2})\b')
+
+def estimate_tokens(text):
+    """Token count used for budgeting (see tokens.py)."""
+    return count_tokens(text)
+
+# --- COLUMN ROLES ---
+
+def detect_column_roles(df):
+    """Returns {'employee': col, 'project': col, 'date': col, 'hours': [cols]} for the columns present."""
+    roles = {'hours': []}
+    for column in df.columns:
+        name = str(column)
+        series = df[column]
+        if pd.api.types.is_numeric_dtype(series) and ROLE_PATTERNS['hours'].search(name):
+            roles['hours'].append(column)
+        elif 'date' not in roles and (
+            pd.api.types.is_datetime64_any_dtype(series)
+            or (ROLE_PATTERNS['date'].search(name) and not pd.api.types.is_numeric_dtype(series))
+        ):
+            roles['date'] = column
+        elif 'project' not in roles and ROLE_PATTERNS['project'].search(name) and not pd.api.types.is_numeric_dtype(series):
+            roles['project'] = column
+        elif 'employee' not in roles and ROLE_PATTERNS['employee'].search(name) and not pd.api.types.is_numeric_dtype(series):
+            roles['employee'] = column
+    return roles
+
+# --- QUESTION FILTERS ---
+
+def _text_columns(df):
+    return [
+        column for column in df.columns
+        if isinstance(df[column].dtype, pd.CategoricalDtype)
+        or df[column].dtype == object
+        or pd.api.types.is_string_dtype(df[column])
+    ]
+
+def _column_values(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return [str(value) for value in series.cat.categories]
+    return [str(value) for value in series.dropna().unique()]
+
+def find_value_filters(question, df, person_column=None, max_unique=5000):
+    """
+    Finds values of text columns (employees, projects, ...) mentioned in the
+    question. Whole values match case-insensitively; in the person column a
+    unique first-name match also counts. Returns {column: [values]}.
+    """
+    lowered = question.lower()
+    filters = {}
+    for column in _text_columns(df):
+        values = _column_values(df[column])
+        if len(values) > max_unique:
+            continue
+        matches = [
+            value for value in values
+            if len(value) > 2 and re.search(r'\b' + re.escape(value.lower()) + r'\b', lowered)
+        ]
+        if not matches and column == person_column:
+            first_names = {}
+            for value in values:
+                first = value.split()[0].lower() if value.split() else ''
+                if len(first) > 2:
+                    first_names.setdefault(first, []).append(value)
+            matches = [
+                candidates[0] for first, candidates in first_names.items()
+                if len(candidates) == 1 and re.search(r'\b' + re.escape(first) + r'\b', lowered)
+            ]
+        if matches:
+            filters[column] = matches
+    return filters
+
+def _is_modal_may(question, match):
+    """True when 'may' is the verb ("may I see...") rather than the month."""
+    if match.group(1).lower() != 'may' or match.group(2):
+        return False
+    preceding = question[:match.start()].split()
+    return not (preceding and preceding[-1].lower() in ('in', 'of', 'during', 'for', 'since', 'until'))
+
+def find_date_range(question):
+    """Returns (start, end) timestamps implied by the question, or None."""
+    iso_dates = ISO_DATE_PATTERN.findall(question)
+    if len(iso_dates) >= 2:
+        start, end = sorted(pd.Timestamp(d) for d in iso_dates[:2])
+        return start, end + pd.Timedelta(days=1)
+    if len(iso_dates) == 1:
+        day = pd.Timestamp(iso_dates[0])
+        return day, day + pd.Timedelta(days=1)
+
+    month_match = next(
+        (match for match in MONTH_PATTERN.finditer(question) if not _is_modal_may(question, match)),
+        None
+    )
+    if month_match:
+        month = MONTHS[month_match.group(1).lower()]
+        year_text = month_match.group(2) or (YEAR_PATTERN.search(question).group(1) if YEAR_PATTERN.search(question) else None)
+        year = int(year_text) if year_text else None
+        if year is None:
+            return ('month', month)  # Resolved against the data's own years by the caller
+        start = pd.Timestamp(year=year, month=month, day=1)
+        return start, start + pd.offsets.MonthBegin(1)
+
+    year_match = YEAR_PATTERN.search(question)
+    if year_match:
+        year = int(year_match.group(1))
+        return pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year + 1, month=1, day=1)
+    return None
+
+def apply_filters(df, value_filters, date_range, date_column):
+    """Applies the detected filters and returns (filtered_df, [descriptions])."""
+    mask = pd.Series(True, index=df.index)
+    descriptions = []
+    for column, values in value_filters.items():
+        mask &= df[column].astype(str).isin(values)
+        descriptions.append(f"{column} in {values}")
+
+    if date_range and date_column is not None:
+        dates = df[date_column]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, errors='coerce')
+        if date_range[0] == 'month':
+            mask &= dates.dt.month == date_range[1]
+            descriptions.append(f"{date_column} in month {calendar.month_name[date_range[1]]}")
+        else:
+            start, end = date_range
+            mask &= (dates >= start) & (dates < end)
+            descriptions.append(f"{start.date()} <= {date_column} < {end.date()}")
+    return df[mask], descriptions
+
+# --- COMPACT SERIALIZATION ---
+
+# Text columns are dictionary-encoded when values repeat and are long enough to be worth a code
+DICTIONARY_MIN_VALUE_LENGTH = 5
+
+def format_number(value):
+    """Numbers rounded to 2 decimals without trailing zeros ('8.0' -> '8')."""
+    return f"{value:.2f}".rstrip('0').rstrip('.')
+
+def compact_column(series):
+    """Renders one column as short strings: rounded numbers, bare dates, '' for missing."""
+    if pd.api.types.is_bool_dtype(series):
+        return series.map(lambda v: '' if pd.isna(v) else str(v))
+    if pd.api.types.is_numeric_dtype(series):
+        return series.map(lambda v: '' if pd.isna(v) else format_number(v))
+    if pd.api.types.is_datetime64_any_dtype(series):
+        has_time = (series.dropna().dt.normalize() != series.dropna()).any()
+        return series.dt.strftime('%Y-%m-%d %H:%M' if has_time else '%Y-%m-%d').fillna('')
+    return series.astype(object).where(series.notna(), '').astype(str)
+
+def _csv_field(value):
+    return f'"{value}"' if ',' in value or '"' in value else value
+
+def _dictionary_prefixes(columns):
+    """Short, unique code prefixes per column ('Employee Name' -> 'E', 'Project' -> 'P')."""
+    prefixes = {}
+    for column in columns:
+        letters = ''.join(ch for ch in str(column).title() if ch.isalpha()) or 'V'
+        prefix = letters[0]
+        length = 1
+        while prefix in prefixes.values() and length < len(letters):
+            length += 1
+            prefix = letters[:length]
+        if prefix in prefixes.values():
+            prefix = f"{letters}{len(prefixes)}"
+        prefixes[column] = prefix
+    return prefixes
+
+def compact_rows(df, token_budget):
+    """
+    Serializes as many rows of df as fit in token_budget, compactly: columns
+    constant across df are stated once, repeated long text values are replaced
+    by short codes with a legend, numbers are rounded.
+    Returns (lines, rows_shown).
+    """
+    if df.empty or token_budget <= 0:
+        return [], 0
+
+    lines = []
+    columns = list(df.columns)
+    if len(df) > 1:
+        constant = [c for c in columns if df[c].nunique(dropna=False) == 1]
+        if constant and len(constant) < len(columns):
+            parts = [f"{c}={compact_column(df[c].iloc[:1]).iloc[0]}" for c in constant]
+            lines.append(f"Same for every matching row: {', '.join(parts)}")
+            columns = [c for c in columns if c not in constant]
+
+    # Never serialize more rows than could possibly fit (every row costs at least a token)
+    candidates = df[columns].head(token_budget)
+    rendered = {column: compact_column(candidates[column]) for column in columns}
+
+    encoded = [
+        column for column in columns
+        if not pd.api.types.is_numeric_dtype(candidates[column])
+        and not pd.api.types.is_datetime64_any_dtype(candidates[column])
+        and rendered[column].str.len().mean() >= DICTIONARY_MIN_VALUE_LENGTH
+        and rendered[column].nunique() <= len(candidates) / 2
+    ]
+    prefixes = _dictionary_prefixes(encoded)
+    codes = {column: {} for column in encoded}
+
+    header = ",".join(_csv_field(str(column)) for column in columns)
+    used = count_tokens("\n".join(lines)) + count_tokens(header)
+    if used > token_budget:
+        return [], 0
+
+    rows = []
+    legend_cost = {column: count_tokens(f"Codes for {column}: ") for column in encoded}
+    for position in range(len(candidates)):
+        fields = []
+        new_codes = []
+        cost = 0
+        for column in columns:
+            value = rendered[column].iloc[position]
+            if column in codes and value:
+                code = codes[column].get(value)
+                if code is None:
+                    code = f"{prefixes[column]}{len(codes[column]) + 1}"
+                    new_codes.append((column, value, code))
+                    cost += count_tokens(f"{code}={value}; ")
+                    if not codes[column]:
+                        cost += legend_cost[column]
+                value = code
+            fields.append(_csv_field(value))
+        line = ",".join(fields)
+        cost += count_tokens(line)
+        if used + cost > token_budget:
+            break
+        for column, value, code in new_codes:
+            codes[column][value] = code
+        rows.append(line)
+        used += cost
+
+    for column in encoded:
+        if codes[column]:
+            legend = "; ".join(f"{code}={value}" for value, code in codes[column].items())
+            lines.append(f"Codes for {column}: {legend}")
+    return lines + [header] + rows, len(rows)
+
+# --- CONTEXT ASSEMBLY ---
+
+def build_aggregates(df, roles):
+    """Precomputed totals so the model never has to add up raw rows itself."""
+    lines = []
+    for hours_column in roles['hours']:
+        lines.append(f"Total {hours_column}: {df[hours_column].sum():.2f} over {len(df)} rows")
+        for role in ('employee', 'project'):
+            column = roles.get(role)
+            if column is None:
+                continue
+            grouped = (
+                df.groupby(column, observed=True)[hours_column].sum()
+                .sort_values(ascending=False)
+                .head(CONTEXT_TOP_GROUPS)
+            )
+            if not grouped.empty:
+                parts = ", ".join(f"{name}={value:.2f}" for name, value in grouped.items())
+                lines.append(f"{hours_column} by {column}: {parts}")
+    return lines
+
+def select_columns(question, df, roles, value_filters):
+    """Keeps columns named in the question, role columns and filtered columns."""
+    lowered = question.lower()
+    wanted = [column for column in df.columns if str(column).lower() in lowered]
+    wanted += [roles[role] for role in ('employee', 'project', 'date') if role in roles]
+    wanted += roles['hours'] + list(value_filters)
+    selected = [column for column in df.columns if column in set(wanted)]
+    return selected or list(df.columns)
+
+def build_timesheet_context(df, question, token_budget=CONTEXT_TOKEN_BUDGET, rollup_lines=None):
+    """
+    Builds the smallest accurate data context for a question: the rows and
+    columns it refers to plus precomputed aggregates, trimmed to token_budget.
+    rollup_lines (materialized upload-time aggregates) replace the per-question
+    group-bys when the question does not filter the data.
+    """
+    if df.empty:
+        return "The timesheet data is currently empty."
+
+    roles = detect_column_roles(df)
+    value_filters = find_value_filters(question, df, roles.get('employee'))
+    date_range = find_date_range(question)
+    filtered, descriptions = apply_filters(df, value_filters, date_range, roles.get('date'))
+    columns = select_columns(question, df, roles, value_filters)
+
+    header = [
+        f"Timesheet columns: {', '.join(map(str, df.columns))}",
+        f"Filters applied: {'; '.join(descriptions) if descriptions else 'none'}",
+        f"Matching rows: {len(filtered)} of {len(df)}",
+    ]
+    if rollup_lines and not descriptions:
+        aggregates = [f"Total {column}: {df[column].sum():.2f} over {len(df)} rows" for column in roles['hours']]
+        # The cube can be large; keep at most half the budget for it so some rows still fit
+        used = sum(estimate_tokens(line) for line in aggregates)
+        for line in rollup_lines:
+            used += estimate_tokens(line)
+            if used > token_budget // 2:
+                break
+            aggregates.append(line)
+    else:
+        aggregates = build_aggregates(filtered, roles)
+    if aggregates:
+        header += ["", "Precomputed aggregates (for the matching rows):"] + aggregates
+
+    # The header alone may not exceed the budget (very wide files, huge rollups)
+    text = truncate_to_tokens("\n".join(header), token_budget)
+    # Reserve room for the rows label
+    remaining = token_budget - estimate_tokens(text) - 20
+    if remaining <= 0 or filtered.empty:
+        return text
+
+    # Add as many matching rows as the remaining budget allows, compactly encoded
+    lines, shown = compact_rows(filtered[columns], remaining)
+    if not shown:
+        return text
+    label = f"Rows ({shown} of {len(filtered)} matching rows shown):" if shown < len(filtered) else "Rows:"
+    return text + "\n\n" + label + "\n" + "\n".join(lines)
@@ -0,0 +1,83 @@
+import os
+
+from .tokens import LLM_MAX_PROMPT_TOKENS, count_message_tokens, count_tokens, truncate_to_tokens
+
+# --- CONFIGURATION ---
+
+# Recent turns (question + answer) sent verbatim with every chat question
+CHAT_MEMORY_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", "3"))
+# Token ceiling for summary + recent turns together; the data context gets the rest
+CHAT_MEMORY_TOKEN_BUDGET = min(int(os.getenv("CHAT_MEMORY_TOKEN_BUDGET", "800")), LLM_MAX_PROMPT_TOKENS // 4)
+# A single remembered message never takes more than this
+CHAT_MEMORY_MESSAGE_MAX_TOKENS = 250
+# Older turns are folded into the session's rolling summary once this many
+# have left the window, so the summarizer runs once per few turns, not per turn
+CHAT_SUMMARY_TRIGGER_TURNS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TURNS", "2"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "250"))
+# Most messages folded into the summary by one summarizer call
+CHAT_SUMMARY_MAX_FOLD_MESSAGES = 40
+
+SUMMARY_SYSTEM_PROMPT = "You keep concise, factual summaries of conversations."
+SUMMARY_PROMPT_TEMPLATE = """
+Update the running summary of a conversation between a user and a timesheet data analyst bot.
+Keep the names, projects, dates, filters and figures the user may refer back to; drop small talk.
+Reply with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}
+"""
+
+# --- MEMORY ---
+
+def memory_fetch_limit(turns=CHAT_MEMORY_TURNS):
+    """Newest unsummarized messages to read per question: the window plus enough to notice overflow."""
+    return 2 * (turns + CHAT_SUMMARY_TRIGGER_TURNS)
+
+def split_window(messages, turns=CHAT_MEMORY_TURNS):
+    """Splits chronological unsummarized messages into (overflow, window); the window is the last `turns` turns."""
+    cut = max(0, len(messages) - 2 * turns)
+    return messages[:cut], messages[cut:]
+
+def needs_summary(overflow):
+    return len(overflow) >= 2 * CHAT_SUMMARY_TRIGGER_TURNS
+
+def history_messages(summary, window, token_budget=CHAT_MEMORY_TOKEN_BUDGET):
+    """
+    Chat-completion messages carrying the conversation so far: the rolling
+    summary, then the recent messages. Oldest messages are dropped first
+    when the budget is exceeded.
+    """
+    history = []
+    for msg in window:
+        role = 'user' if msg['sender'] == 'user' else 'assistant'
+        history.append({"role": role, "content": truncate_to_tokens(msg['text'], CHAT_MEMORY_MESSAGE_MAX_TOKENS)})
+    if summary:
+        summary = truncate_to_tokens(summary, min(CHAT_SUMMARY_MAX_TOKENS, token_budget // 2))
+        history.insert(0, {"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+
+    start = 1 if summary else 0
+    while len(history) > start and count_message_tokens(history) > token_budget:
+        history.pop(start)
+    # The window must not open with a dangling answer
+    if len(history) > start and history[start]['role'] == 'assistant':
+        history.pop(start)
+    return history
+
+def build_summary_messages(summary, overflow):
+    """Messages asking the model to fold the overflowing messages into the summary."""
+    transcript = "\n".join(
+        f"{'User' if msg['sender'] == 'user' else 'Bot'}: {truncate_to_tokens(msg['text'], CHAT_MEMORY_MESSAGE_MAX_TOKENS)}"
+        for msg in overflow
+    )
+    prompt = SUMMARY_PROMPT_TEMPLATE.format(
+        max_words=CHAT_SUMMARY_MAX_TOKENS * 3 // 4,
+        summary=summary or "(none yet)",
+        transcript=truncate_to_tokens(transcript, LLM_MAX_PROMPT_TOKENS - count_tokens(SUMMARY_SYSTEM_PROMPT) - CHAT_SUMMARY_MAX_TOKENS - 200)
+    )
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
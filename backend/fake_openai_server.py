@@ -0,0 +1,116 @@
+"""
+Minimal OpenAI-compatible chat-completions server for local testing.
+
+Run it and point the backend at it:
+
+    python -m backend.fake_openai_server --port 8001
+    OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1 flask --app backend.app run
+
+Supports both stream=False and stream=True (SSE) requests. The answer echoes
+the last user message so responses are deterministic.
+"""
+import json
+import time
+import argparse
+from uuid import uuid4
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def build_answer(messages):
+    """Deterministic answer derived from the final user message."""
+    user_messages = [m.get('content', '') for m in messages if m.get('role') == 'user']
+    last = user_messages[-1] if user_messages else ''
+    query = last.rsplit("User Query:", 1)[-1].strip()
+    return f"Fake answer for: {query}"
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    token_delay = 0.0  # Seconds between streamed tokens, to simulate generation speed
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        answer = build_answer(body.get('messages', []))
+        model = body.get('model', 'fake-model')
+        completion_id = f"chatcmpl-{uuid4().hex}"
+
+        if body.get('stream'):
+            self._stream(completion_id, model, answer)
+        else:
+            self._respond(completion_id, model, answer)
+
+    def _respond(self, completion_id, model, answer):
+        payload = {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': answer},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': len(answer.split()), 'total_tokens': len(answer.split())}
+        }
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, completion_id, model, answer):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        tokens = [word + ' ' for word in answer.split(' ')]
+        tokens[-1] = tokens[-1].rstrip()
+        for index, token in enumerate(tokens):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'role': 'assistant', 'content': token} if index == 0 else {'content': token},
+                    'finish_reason': None
+                }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            if self.token_delay:
+                time.sleep(self.token_delay)
+
+        final = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server for local testing.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.token_delay = args.token_delay
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    print(f"Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import os
+import time
+import logging
+
+import pandas as pd
+
+from .llm_service import (
+    UPLOAD_BATCH_SIZE,
+    abort_timesheet_upload,
+    begin_timesheet_upload,
+    finish_timesheet_upload,
+    insert_timesheet_batches,
+    save_timesheet_rollups,
+)
+from .rollups import RollupAccumulator
+
+# --- CONFIGURATION ---
+
+# Rows parsed per chunk; peak memory is bounded by this, not by the file size
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+# Column types are fixed by the first chunk; later values that do not parse
+# as numbers become NaN. An upload is rejected when more than this share of
+# a numeric column's values had to be dropped that way.
+INGEST_MAX_COERCED_RATIO = float(os.getenv("INGEST_MAX_COERCED_RATIO", "0.01"))
+
+# --- STREAMING CSV INGESTION ---
+
+def infer_column_types(chunk):
+    """Returns {column: 'numeric' | 'text'} from the first parsed chunk."""
+    return {
+        column: 'numeric' if pd.api.types.is_numeric_dtype(dtype) else 'text'
+        for column, dtype in chunk.dtypes.items()
+    }
+
+def coerce_chunk(chunk, column_types, coerced=None):
+    """
+    Applies the types inferred from the first chunk so every batch is stored
+    consistently. Values lost to a numeric conversion are counted per column
+    into `coerced`.
+    """
+    for column, kind in column_types.items():
+        if column not in chunk.columns:
+            continue
+        series = chunk[column]
+        if kind == 'numeric':
+            if not pd.api.types.is_numeric_dtype(series):
+                converted = pd.to_numeric(series, errors='coerce')
+                lost = int((converted.isna() & series.notna()).sum())
+                if lost and coerced is not None:
+                    coerced[column] = coerced.get(column, 0) + lost
+                chunk[column] = converted
+        elif pd.api.types.is_numeric_dtype(series):
+            # Keep missing values as NaN, stringify the rest
+            series = series.astype(object)
+            mask = series.notna()
+            series[mask] = series[mask].astype(str)
+            chunk[column] = series
+    return chunk
+
+def check_coerced_cells(coerced, rows, max_ratio=INGEST_MAX_COERCED_RATIO):
+    """Raises ValueError when a column lost more than max_ratio of its values to numeric coercion."""
+    for column, count in coerced.items():
+        if rows and count / rows > max_ratio:
+            raise ValueError(
+                f"Column '{column}' has {count} of {rows} values that are not numbers "
+                f"(more than {max_ratio:.0%}); fix the file or the column's first rows and upload again."
+            )
+    if coerced:
+        logging.warning(f"Ingestion dropped non-numeric values: {coerced}")
+
+def ingest_timesheet_csv(stream, scope=None, chunk_rows=INGEST_CHUNK_ROWS, batch_size=UPLOAD_BATCH_SIZE, progress_callback=None,
+                         max_coerced_ratio=INGEST_MAX_COERCED_RATIO, generation_callback=None):
+    """
+    Parses a CSV from a file-like stream in chunks and writes it to the
+    scope's dataset in MongoDB with unordered batched insert_many calls, folding
+    each chunk into the upload's rollups. Never holds more than one chunk
+    in memory. generation_callback(generation) is called once the upload's
+    generation is allocated; progress_callback(rows_processed, elapsed_seconds,
+    coerced_cells) after every chunk.
+
+    Returns {'rows': int, 'chunks': int, 'seconds': float, 'rows_per_sec': float,
+    'coerced_cells': {column: count}}.
+    """
+    started = time.monotonic()
+    rows = 0
+    chunks = 0
+    coerced = {}
+    column_types = None
+    upload = None
+    rollups = RollupAccumulator()
+
+    try:
+        for chunk in pd.read_csv(stream, chunksize=chunk_rows):
+            if chunk.empty:
+                continue
+            if column_types is None:
+                column_types = infer_column_types(chunk)
+                upload = begin_timesheet_upload(scope)
+                if generation_callback:
+                    generation_callback(upload['generation'])
+            else:
+                chunk = coerce_chunk(chunk, column_types, coerced)
+
+            rows += insert_timesheet_batches(upload, chunk, batch_size)
+            rollups.add(chunk)
+            chunks += 1
+
+            elapsed = time.monotonic() - started
+            logging.info(f"Ingested {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/sec).")
+            if progress_callback:
+                progress_callback(rows, elapsed, dict(coerced))
+
+        if column_types is None:
+            raise ValueError("The uploaded CSV file contains no data rows.")
+        check_coerced_cells(coerced, rows, max_coerced_ratio)
+
+        # Readers switch to the new rows (and their rollups) only here, atomically
+        save_timesheet_rollups(upload, rollups.result())
+        finish_timesheet_upload(upload, rows)
+    except Exception:
+        # A bad upload never touches the active dataset; just reclaim its rows
+        if upload:
+            abort_timesheet_upload(upload)
+        raise
+
+    elapsed = time.monotonic() - started
+    stats = {
+        'rows': rows,
+        'chunks': chunks,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed else float(rows),
+        'coerced_cells': coerced,
+    }
+    logging.info(f"Timesheet ingestion finished: {stats}")
+    return stats
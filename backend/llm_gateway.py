@@ -0,0 +1,394 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+# --- CONFIGURATION ---
+
+# HTTP pool shared by every LLM call of a process (keep-alive avoids a TLS handshake per question)
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "50"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+# Total time budget for one question, retries included
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "90"))
+
+# Retries on 429 / 5xx / timeouts / connection errors, with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+
+# Consecutive failed calls that open the circuit, and how long it stays open
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Bulkhead: LLM calls in flight per process from threads (the Flask routes),
+# and how long a caller waits for a slot
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_BULKHEAD_WAIT_SECONDS = float(os.getenv("LLM_BULKHEAD_WAIT_SECONDS", "2"))
+# The same for coroutines (the Quart routes of asgi_app). Waiting costs no
+# thread there, so the cap is much higher and waiters queue in FIFO order;
+# an ASGI process can have both caps' worth of calls in flight.
+LLM_ASYNC_MAX_CONCURRENCY = int(os.getenv("LLM_ASYNC_MAX_CONCURRENCY", "256"))
+LLM_ASYNC_BULKHEAD_WAIT_SECONDS = float(os.getenv("LLM_ASYNC_BULKHEAD_WAIT_SECONDS", "30"))
+
+class LLMUnavailableError(Exception):
+    """Raised without calling upstream: circuit open, no bulkhead slot, or deadline spent."""
+
+# --- RETRY POLICY ---
+
+def is_retryable(error):
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def retry_delay(attempt, error=None):
+    """Full-jitter backoff; an upstream Retry-After header wins when present."""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+def call_timeout(deadline):
+    """Per-attempt timeout: the read timeout, capped by what is left of the deadline."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise LLMUnavailableError("LLM deadline exceeded")
+    return httpx.Timeout(min(LLM_READ_TIMEOUT, remaining), connect=min(LLM_CONNECT_TIMEOUT, remaining))
+
+# --- CIRCUIT BREAKER ---
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures; open -> half-open
+    after reset_seconds, letting a single trial call through; the trial's outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD, reset_seconds=LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logging.error(f"LLM circuit opened after {self.failures} consecutive failures.")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {'state': self.state, 'consecutive_failures': self.failures, 'rejected': self.rejected}
+
+# --- BULKHEAD ---
+
+class Bulkhead:
+    """
+    Cap on LLM calls in flight from threads. Callers that find no free slot
+    within wait_seconds are rejected.
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, wait_seconds=LLM_BULKHEAD_WAIT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.wait_seconds = wait_seconds
+        self.rejected = 0
+        self.reset_after_fork()
+
+    def acquire(self):
+        """Blocks the calling thread for a slot; raises LLMUnavailableError after wait_seconds."""
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            self._reject()
+        self._acquired()
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def reset_after_fork(self):
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def _acquired(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+        raise LLMUnavailableError("Too many LLM calls in flight")
+
+class AsyncBulkhead:
+    """
+    Cap on LLM calls in flight from coroutines, on an asyncio.Semaphore:
+    waiters are served in arrival order and rejected only after wait_seconds.
+    Use from a single event loop.
+    """
+
+    def __init__(self, max_concurrency=LLM_ASYNC_MAX_CONCURRENCY, wait_seconds=LLM_ASYNC_BULKHEAD_WAIT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.wait_seconds = wait_seconds
+        self.rejected = 0
+        self.reset_after_fork()
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.wait_seconds)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LLMUnavailableError("Too many LLM calls in flight")
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def reset_after_fork(self):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+
+# --- GATEWAYS ---
+
+def build_http_client():
+    return openai.DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    )
+
+def build_async_http_client():
+    return openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    )
+
+def build_openai_client(base_url, api_key):
+    """OpenAI client on the tuned pool; retries are done by the gateway, not the SDK."""
+    return OpenAI(base_url=base_url, api_key=api_key, http_client=build_http_client(), max_retries=0)
+
+def build_async_openai_client(base_url, api_key):
+    return AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=build_async_http_client(), max_retries=0)
+
+class LLMGateway:
+    """
+    Wraps chat-completion calls with a per-question deadline, jittered retries,
+    a circuit breaker and a bulkhead. Failures surface as exceptions that the
+    callers turn into the usual apology message.
+    """
+
+    def __init__(self, client, breaker=None, bulkhead=None, max_retries=LLM_MAX_RETRIES):
+        self.client = client
+        self.breaker = breaker or CircuitBreaker()
+        self.bulkhead = bulkhead or Bulkhead()
+        self.max_retries = max_retries
+        self.retries = 0
+
+    def complete(self, **request):
+        """Non-streaming chat completion; returns the answer text."""
+        with self._bulkhead():
+            deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+            for attempt in range(self.max_retries + 1):
+                if attempt == 0:
+                    self._check_breaker()
+                client = self.client.with_options(timeout=call_timeout(deadline))
+                try:
+                    response = client.chat.completions.create(stream=False, **request)
+                except Exception as e:
+                    self._handle_error(e, attempt, deadline)
+                    continue
+                self.breaker.record_success()
+                return response.choices[0].message.content
+
+    def stream(self, **request):
+        """Streaming chat completion yielding text deltas. Retries only until the first delta arrives."""
+        with self._bulkhead():
+            deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+            for attempt in range(self.max_retries + 1):
+                if attempt == 0:
+                    self._check_breaker()
+                client = self.client.with_options(timeout=call_timeout(deadline))
+                started = False
+                try:
+                    stream = client.chat.completions.create(stream=True, **request)
+                    try:
+                        for chunk in stream:
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                started = True
+                                yield delta
+                    finally:
+                        stream.close()
+                except GeneratorExit:
+                    # The caller went away mid-answer; upstream itself was healthy
+                    self.breaker.record_success()
+                    raise
+                except Exception as e:
+                    if started:
+                        self.breaker.record_failure()
+                        raise
+                    self._handle_error(e, attempt, deadline)
+                    continue
+                self.breaker.record_success()
+                return
+
+    def reset_after_fork(self):
+        self.bulkhead.reset_after_fork()
+        self.breaker.reset_after_fork()
+
+    def stats(self):
+        return {
+            'circuit': self.breaker.stats(),
+            'in_flight': self.bulkhead.in_flight,
+            'max_concurrency': self.bulkhead.max_concurrency,
+            'bulkhead_rejected': self.bulkhead.rejected,
+            'retries': self.retries,
+        }
+
+    @contextmanager
+    def _bulkhead(self):
+        self.bulkhead.acquire()
+        try:
+            yield
+        finally:
+            self.bulkhead.release()
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise LLMUnavailableError("LLM circuit is open")
+
+    def _handle_error(self, error, attempt, deadline):
+        """Re-raises unless the error is retryable and there is time left; otherwise sleeps before the retry."""
+        time.sleep(self._next_delay(error, attempt, deadline))
+
+    def _next_delay(self, error, attempt, deadline):
+        if not is_retryable(error):
+            # A 4xx means upstream answered; it says nothing about its health
+            self.breaker.record_success()
+            raise error
+        delay = retry_delay(attempt, error)
+        # A failed half-open trial (or a circuit opened meanwhile) fails fast instead of retrying
+        if attempt >= self.max_retries or time.monotonic() + delay >= deadline or self.breaker.state != 'closed':
+            self.breaker.record_failure()
+            raise error
+        self.retries += 1
+        logging.warning(f"LLM call failed ({error.__class__.__name__}), retry {attempt + 1} in {delay:.2f}s.")
+        return delay
+
+class AsyncLLMGateway(LLMGateway):
+    """
+    Asyncio variant for the ASGI app; shares the policy (and optionally the
+    breaker) of LLMGateway, with its own AsyncBulkhead.
+    """
+
+    def __init__(self, client, breaker=None, bulkhead=None, max_retries=LLM_MAX_RETRIES):
+        super().__init__(client, breaker, bulkhead or AsyncBulkhead(), max_retries)
+
+    async def complete(self, **request):
+        await self._acquire()
+        try:
+            deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+            for attempt in range(self.max_retries + 1):
+                if attempt == 0:
+                    self._check_breaker()
+                client = self.client.with_options(timeout=call_timeout(deadline))
+                try:
+                    response = await client.chat.completions.create(stream=False, **request)
+                except Exception as e:
+                    await self._handle_error_async(e, attempt, deadline)
+                    continue
+                self.breaker.record_success()
+                return response.choices[0].message.content
+        finally:
+            self._release()
+
+    async def stream(self, **request):
+        await self._acquire()
+        try:
+            deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+            for attempt in range(self.max_retries + 1):
+                if attempt == 0:
+                    self._check_breaker()
+                client = self.client.with_options(timeout=call_timeout(deadline))
+                started = False
+                try:
+                    stream = await client.chat.completions.create(stream=True, **request)
+                    try:
+                        async for chunk in stream:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                started = True
+                                yield chunk.choices[0].delta.content
+                    finally:
+                        await stream.close()
+                except GeneratorExit:
+                    self.breaker.record_success()
+                    raise
+                except Exception as e:
+                    if started:
+                        self.breaker.record_failure()
+                        raise
+                    await self._handle_error_async(e, attempt, deadline)
+                    continue
+                self.breaker.record_success()
+                return
+        finally:
+            self._release()
+
+    async def _acquire(self):
+        await self.bulkhead.acquire()
+
+    def _release(self):
+        self.bulkhead.release()
+
+    async def _handle_error_async(self, error, attempt, deadline):
+        await asyncio.sleep(self._next_delay(error, attempt, deadline))
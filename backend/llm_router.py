@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from .tokens import count_message_tokens, count_tokens
+
+# --- CONFIGURATION ---
+
+# 'openrouter' sends requests to OPENROUTER_BASE_URL through the gateway;
+# 'local' answers deterministically in-process (no network) for load tests and benchmarks.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter")
+LLM_LARGE_MODEL = os.getenv("LLM_MODEL", "openai/gpt-4o")
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "openai/gpt-4o-mini")
+# Prompts above this many (estimated) tokens always go to the large model
+LLM_ROUTE_SMALL_MAX_PROMPT_TOKENS = int(os.getenv("LLM_ROUTE_SMALL_MAX_PROMPT_TOKENS", "800"))
+# Questions asking for judgement rather than lookups need the large model
+ANALYSIS_PATTERN = re.compile(r'\b(why|explain|trend|pattern|insight|summar|anomal|unusual|suggest|recommend|compare|review|analy[sz]e|forecast|predict)\w*', re.I)
+
+# USD per million (prompt, completion) tokens, for the cost counters
+MODEL_PRICES = {
+    'openai/gpt-4o': (2.50, 10.00),
+    'openai/gpt-4o-mini': (0.15, 0.60),
+}
+
+# Simulated latency of the local backend
+LOCAL_LLM_LATENCY_MS = float(os.getenv("LOCAL_LLM_LATENCY_MS", "0"))
+LOCAL_LLM_TOKEN_DELAY_MS = float(os.getenv("LOCAL_LLM_TOKEN_DELAY_MS", "0"))
+
+LATENCY_SAMPLES = 500  # Recent latencies kept per model for percentiles
+
+# --- PROVIDERS ---
+
+class OpenAICompatibleProvider:
+    """Any OpenAI-compatible endpoint, called through an LLMGateway (and its async twin under ASGI)."""
+
+    def __init__(self, name, gateway, extra_headers=None):
+        self.name = name
+        self.gateway = gateway
+        self.async_gateway = None
+        self.extra_headers = extra_headers or {}
+
+    def complete(self, model, messages, max_tokens):
+        return self.gateway.complete(extra_headers=self.extra_headers, model=model, messages=messages, max_tokens=max_tokens)
+
+    def stream(self, model, messages, max_tokens):
+        return self.gateway.stream(extra_headers=self.extra_headers, model=model, messages=messages, max_tokens=max_tokens)
+
+    async def acomplete(self, model, messages, max_tokens):
+        return await self.async_gateway.complete(extra_headers=self.extra_headers, model=model, messages=messages, max_tokens=max_tokens)
+
+    async def astream(self, model, messages, max_tokens):
+        async for delta in self.async_gateway.stream(extra_headers=self.extra_headers, model=model, messages=messages, max_tokens=max_tokens):
+            yield delta
+
+class LocalProvider:
+    """
+    Deterministic offline stand-in. Phrasing requests return the computed
+    result verbatim; data questions return the query and the context headline,
+    so answers depend only on the prompt.
+    """
+
+    name = 'local'
+
+    def answer(self, model, messages):
+        prompt = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        query = prompt.rsplit("User Query:", 1)[-1].strip()
+        if "Computed result:" in prompt:
+            return prompt.split("Computed result:", 1)[1].split("User Query:", 1)[0].strip()
+        headline = [line for line in prompt.splitlines() if line.startswith(("Filters applied:", "Matching rows:"))]
+        return " ".join([f"[{model}] {query}"] + headline)
+
+    def complete(self, model, messages, max_tokens):
+        time.sleep(LOCAL_LLM_LATENCY_MS / 1000)
+        return self.answer(model, messages)
+
+    def stream(self, model, messages, max_tokens):
+        time.sleep(LOCAL_LLM_LATENCY_MS / 1000)
+        for word in re.findall(r'\S+\s*', self.answer(model, messages)):
+            time.sleep(LOCAL_LLM_TOKEN_DELAY_MS / 1000)
+            yield word
+
+    async def acomplete(self, model, messages, max_tokens):
+        await asyncio.sleep(LOCAL_LLM_LATENCY_MS / 1000)
+        return self.answer(model, messages)
+
+    async def astream(self, model, messages, max_tokens):
+        await asyncio.sleep(LOCAL_LLM_LATENCY_MS / 1000)
+        for word in re.findall(r'\S+\s*', self.answer(model, messages)):
+            await asyncio.sleep(LOCAL_LLM_TOKEN_DELAY_MS / 1000)
+            yield word
+
+# --- ROUTER ---
+
+class ModelStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latencies_ms = deque(maxlen=LATENCY_SAMPLES)
+
+class LLMRouter:
+    """
+    Picks a provider and model per request (small model for lookups and
+    phrasing, large model for analysis and big prompts) and records latency,
+    tokens and estimated cost per model so the thresholds can be tuned.
+    """
+
+    def __init__(self, providers, default_provider=LLM_PROVIDER, small_model=LLM_SMALL_MODEL,
+                 large_model=LLM_LARGE_MODEL, small_max_prompt_tokens=LLM_ROUTE_SMALL_MAX_PROMPT_TOKENS):
+        self.providers = providers
+        self.default_provider = default_provider if default_provider in providers else next(iter(providers))
+        self.small_model = small_model
+        self.large_model = large_model
+        self.small_max_prompt_tokens = small_max_prompt_tokens
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def policy_key(self):
+        """Identifies the routing policy; cached answers are only shared under the same policy."""
+        return f"{self.default_provider}:{self.small_model}|{self.large_model}|{self.small_max_prompt_tokens}"
+
+    def route(self, user_query, messages, max_tokens, phrasing=False):
+        """Builds the request for one question: {'provider', 'model', 'messages', 'max_tokens'}."""
+        prompt_tokens = count_message_tokens(messages)
+        if phrasing:
+            model = self.small_model
+        elif ANALYSIS_PATTERN.search(user_query) or prompt_tokens > self.small_max_prompt_tokens:
+            model = self.large_model
+        else:
+            model = self.small_model
+        return {'provider': self.default_provider, 'model': model, 'messages': messages, 'max_tokens': max_tokens}
+
+    def complete(self, request):
+        provider = self.providers[request['provider']]
+        started = time.monotonic()
+        try:
+            answer = provider.complete(request['model'], request['messages'], request['max_tokens'])
+        except Exception:
+            self._record(request, started, None)
+            raise
+        self._record(request, started, answer)
+        return answer
+
+    def stream(self, request):
+        provider = self.providers[request['provider']]
+        started = time.monotonic()
+        parts = []
+        try:
+            for delta in provider.stream(request['model'], request['messages'], request['max_tokens']):
+                parts.append(delta)
+                yield delta
+        except Exception:
+            self._record(request, started, None)
+            raise
+        self._record(request, started, "".join(parts))
+
+    async def acomplete(self, request):
+        provider = self.providers[request['provider']]
+        started = time.monotonic()
+        try:
+            answer = await provider.acomplete(request['model'], request['messages'], request['max_tokens'])
+        except Exception:
+            self._record(request, started, None)
+            raise
+        self._record(request, started, answer)
+        return answer
+
+    async def astream(self, request):
+        provider = self.providers[request['provider']]
+        started = time.monotonic()
+        parts = []
+        try:
+            async for delta in provider.astream(request['model'], request['messages'], request['max_tokens']):
+                parts.append(delta)
+                yield delta
+        except Exception:
+            self._record(request, started, None)
+            raise
+        self._record(request, started, "".join(parts))
+
+    def stats(self):
+        report = {}
+        with self._lock:
+            for key, stats in self._stats.items():
+                latencies = sorted(stats.latencies_ms)
+                report[key] = {
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'p50_latency_ms': round(latencies[len(latencies) // 2], 1) if latencies else None,
+                    'p95_latency_ms': round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None,
+                    'prompt_tokens': stats.prompt_tokens,
+                    'completion_tokens': stats.completion_tokens,
+                    'cost_usd': round(stats.cost_usd, 6),
+                }
+        return report
+
+    def _record(self, request, started, answer):
+        """Token counts come from tokens.py; cost uses MODEL_PRICES (the local provider is free)."""
+        elapsed_ms = (time.monotonic() - started) * 1000
+        key = f"{request['provider']}:{request['model']}"
+        prompt_tokens = count_message_tokens(request['messages'])
+        completion_tokens = count_tokens(answer) if answer else 0
+        prices = MODEL_PRICES.get(request['model'], (0.0, 0.0)) if request['provider'] != 'local' else (0.0, 0.0)
+        with self._lock:
+            stats = self._stats.setdefault(key, ModelStats())
+            stats.calls += 1
+            stats.latencies_ms.append(elapsed_ms)
+            if answer is None:
+                stats.errors += 1
+                return
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cost_usd += (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+        logging.debug(f"LLM call {key}: {elapsed_ms:.0f} ms, ~{prompt_tokens}+{completion_tokens} tokens.")
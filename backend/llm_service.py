@@ -1,11 +1,43 @@
 import pandas as pd
 import pymongo
-from openai import OpenAI
 import os
 import logging
-from bcrypt import hashpw, gensalt, checkpw 
-from uuid import uuid4
-from datetime import datetime
+import threading
+import time
+from uuid import uuid4, uuid5, NAMESPACE_URL
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .auth_cache import token_cache
+from .session_tokens import SESSION_REVOCATIONS_COLLECTION, RevocationSet, build_session_signer, is_signed_token
+from .password_hashing import PasswordHashingBusyError, check_password, hash_password, needs_rehash, password_hasher
+from .write_behind import WriteBehindQueue
+from .llm_gateway import LLMGateway, build_openai_client
+from .llm_router import LLM_LARGE_MODEL, LLMRouter, LocalProvider, OpenAICompatibleProvider
+from .analytics import answer_locally
+from .context_builder import CONTEXT_TOKEN_BUDGET, build_timesheet_context
+from .rollups import compute_rollups, format_rollups
+from .conversation import (
+    CHAT_MEMORY_TURNS,
+    CHAT_SUMMARY_MAX_FOLD_MESSAGES,
+    CHAT_SUMMARY_MAX_TOKENS,
+    build_summary_messages,
+    history_messages,
+    memory_fetch_limit,
+    needs_summary,
+    split_window,
+)
+from .tokens import LLM_MAX_PROMPT_TOKENS, count_message_tokens, truncate_to_tokens
+from .response_cache import (
+    RESPONSE_CACHE_COLLECTION,
+    RESPONSE_CACHE_EMBEDDING_MODEL,
+    build_response_cache,
+    cache_namespace,
+    prompt_hash,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -15,52 +47,136 @@ MONGO_URI = "mongodb://localhost:27017/"
 MONGO_DATABASE_NAME = "data_analysis_app_db" 
 
 # Placeholder for OpenRouter key (replace with actual key or env var)
-OPENROUTER_API_KEY = "YOUR_API_Key" 
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "YOUR_API_Key")
+# Point at any OpenAI-compatible server, e.g. backend/fake_openai_server.py for local testing
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 
-client_openai = OpenAI(
-    base_url="https://openrouter.ai/api/v1", 
-    api_key=OPENROUTER_API_KEY,
-)
+# Keep-alive pool, deadlines, retries, circuit breaker and bulkhead live in llm_gateway.py
+client_openai = build_openai_client(OPENROUTER_BASE_URL, OPENROUTER_API_KEY)
+llm_gateway = LLMGateway(client_openai)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=llm_gateway.reset_after_fork)
+
+# Connection pool tuning for the shared per-process MongoClient
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
 
 # --- DATABASE UTILITIES ---
 
+_mongo_client = None
+_mongo_client_pid = None
+_mongo_client_lock = threading.Lock()
+
 def get_mongo_client():
-    """Returns a MongoClient instance with timeout handling."""
-    return pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    """
+    Returns the process-wide pooled MongoClient, creating it on first use.
+    The client is rebuilt after a fork so worker processes never share sockets.
+    Callers must NOT close it; use close_mongo_client() on shutdown instead.
+    """
+    global _mongo_client, _mongo_client_pid
+    pid = os.getpid()
+    if _mongo_client is not None and _mongo_client_pid == pid:
+        return _mongo_client
+
+    with _mongo_client_lock:
+        if _mongo_client is None or _mongo_client_pid != pid:
+            _mongo_client = pymongo.MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connect=False  # Defer connecting until the first operation
+            )
+            _mongo_client_pid = pid
+            logging.info(f"Created pooled MongoClient for process {pid} (maxPoolSize={MONGO_MAX_POOL_SIZE}).")
+    return _mongo_client
+
+def close_mongo_client():
+    """Closes the shared MongoClient. Safe to call more than once (e.g. from atexit)."""
+    global _mongo_client, _mongo_client_pid
+    with _mongo_client_lock:
+        if _mongo_client is not None and _mongo_client_pid == os.getpid():
+            _mongo_client.close()
+            logging.info("Closed pooled MongoClient.")
+        _mongo_client = None
+        _mongo_client_pid = None
+
+def _reset_mongo_client_after_fork():
+    """Drops the parent's client reference in a forked child without closing the parent's sockets."""
+    global _mongo_client, _mongo_client_pid, _mongo_client_lock
+    _mongo_client = None
+    _mongo_client_pid = None
+    _mongo_client_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_mongo_client_after_fork)
+
+def get_database():
+    """Returns the application database handle on the shared client."""
+    return get_mongo_client()[MONGO_DATABASE_NAME]
 
 def get_users_collection(client):
     """Helper to get the 'users' collection for authentication."""
-    db = client[MONGO_DATABASE_NAME] 
-    # CRITICAL: Ensures unique index on username for quick checks
-    db['users'].create_index([('username', pymongo.ASCENDING)], unique=True)
-    return db['users']
+    # Indexes are created once at startup by backend.schema, not per call
+    return client[MONGO_DATABASE_NAME]['users']
+
+def get_messages_collection(client):
+    """Returns the chat messages collection (one document per message)."""
+    db = client[MONGO_DATABASE_NAME]
+    return db[CHAT_MESSAGES_COLLECTION]
 
 def get_chats_collection(client):
     """Helper to get the 'chat_sessions' collection."""
-    db = client[MONGO_DATABASE_NAME]
-    # Create indexes for better performance
-    db['chat_sessions'].create_index([('username', pymongo.ASCENDING)])
-    db['chat_sessions'].create_index([('chat_id', pymongo.ASCENDING)], unique=True)
-    return db['chat_sessions']
+    # Indexes are created once at startup by backend.schema, not per call
+    return client[MONGO_DATABASE_NAME]['chat_sessions']
 
 # --- MONGODB AUTHENTICATION FUNCTIONS ---
 
+# With SESSION_TOKEN_MODE=signed, tokens are verified in-process against the
+# signing key and the revocation set; users.session_token is no longer used.
+session_signer = build_session_signer()
+session_revocations = RevocationSet(lambda: get_database()[SESSION_REVOCATIONS_COLLECTION])
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=session_revocations.reset_after_fork)
+
+def signed_token_username(session_token):
+    """Username of a valid, unrevoked signed token, else None. No I/O."""
+    claims = session_signer.decode(session_token)
+    if claims is None or session_revocations.is_revoked(claims):
+        return None
+    return claims['u']
+
+def revoke_user_sessions(username):
+    """Ends every session of a user (opaque and signed) in every worker."""
+    user_doc = get_users_collection(get_mongo_client()).find_one_and_update(
+        {'username': username},
+        {'$inc': {'token_generation': 1}, '$set': {'session_token': None}},
+        projection={'token_generation': 1},
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    token_cache.invalidate_user(username)
+    if user_doc:
+        session_revocations.revoke_user(username, user_doc['token_generation'])
+
 def create_user(username, password, full_name, email, phone_number, country):
     """
     Creates a new user, hashes the password, and stores all user details in MongoDB.
     Returns True on success, False if user already exists.
     """
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        users_collection = get_users_collection(temp_client)
+        client = get_mongo_client()
+        users_collection = get_users_collection(client)
 
         # 1. Check if user already exists
         if users_collection.find_one({'username': username}):
             return False 
 
-        # 2. Hash the password securely
-        hashed_password = hashpw(password.encode('utf-8'), gensalt()).decode('utf-8')
+        # 2. Hash the password securely (in the hashing pool, off the request thread)
+        hashed_password = hash_password(password)
 
         # 3. Store all required fields
         users_collection.insert_one({
@@ -75,21 +191,19 @@ def create_user(username, password, full_name, email, phone_number, country):
         logging.info(f"User {username} created successfully.")
         return True
     
+    except PasswordHashingBusyError:
+        raise
     except Exception as e:
         logging.error(f"Database error during user creation: {e}")
         return False
-    finally:
-        if temp_client:
-            temp_client.close()
 
             # Add these functions to your existing llm_service.py
 
 def get_user_data_by_email(email):
     """Retrieves user data by email address."""
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        users_collection = get_users_collection(temp_client)
+        client = get_mongo_client()
+        users_collection = get_users_collection(client)
         
         user_doc = users_collection.find_one({'email': email})
         
@@ -103,16 +217,12 @@ def get_user_data_by_email(email):
     except Exception as e:
         logging.error(f"Error retrieving user by email: {e}")
         return None
-    finally:
-        if temp_client:
-            temp_client.close()
 
 def update_password_by_email(email, new_password):
     """Updates the user's password hash using email and invalidates session token."""
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        users_collection = get_users_collection(temp_client)
+        client = get_mongo_client()
+        users_collection = get_users_collection(client)
 
         # Check if user exists with this email
         user_doc = users_collection.find_one({'email': email})
@@ -124,7 +234,7 @@ def update_password_by_email(email, new_password):
         username = user_doc.get('username')
 
         # Generate new hash
-        new_hashed_password = hashpw(new_password.encode('utf-8'), gensalt()).decode('utf-8')
+        new_hashed_password = hash_password(new_password)
         
         # Update password hash and clear session token
         result = users_collection.update_one(
@@ -136,81 +246,111 @@ def update_password_by_email(email, new_password):
         )
         
         if result.modified_count > 0:
+            revoke_user_sessions(username)
             logging.info(f"Password reset successful for user {username} (email: {email})")
             return True
         else:
             logging.warning(f"No documents were modified for email: {email}")
             return False
     
+    except PasswordHashingBusyError:
+        raise
     except Exception as e:
         logging.error(f"Database error during password update by email: {e}")
         return False
-    finally:
-        if temp_client:
-            temp_client.close()
 
 def verify_user(username, password):
     """
     Verifies user credentials.
     Returns a new session token and username on success, or (None, None) on failure.
     """
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        users_collection = get_users_collection(temp_client)
+        client = get_mongo_client()
+        users_collection = get_users_collection(client)
 
         user_doc = users_collection.find_one({'username': username})
         
         if not user_doc:
             return None, None # User not found
 
-        stored_hash = user_doc['password_hash'].encode('utf-8')
+        stored_hash = user_doc['password_hash']
         
-        if checkpw(password.encode('utf-8'), stored_hash):
+        if check_password(password, stored_hash):
+            update = {}
+            if needs_rehash(stored_hash):
+                # BCRYPT_ROUNDS changed since this hash was made; upgrade it while we have the password
+                update['password_hash'] = hash_password(password)
+                logging.info(f"Rehashed password of {username} at the current cost factor.")
+
+            if session_signer is not None:
+                # Signed tokens live only on the client; other devices stay signed in
+                session_token = session_signer.issue(username, user_doc.get('token_generation', 0))
+                if update:
+                    users_collection.update_one({'username': username}, {'$set': update})
+                logging.info(f"User {username} logged in with a signed token.")
+                return session_token, username
+
             # Generate and save new session token on successful login
             session_token = str(uuid4())
+            update['session_token'] = session_token
             users_collection.update_one(
                 {'username': username},
-                {'$set': {'session_token': session_token}}
+                {'$set': update}
             )
+            # The previous token was overwritten, so drop it from every worker's cache
+            token_cache.invalidate_user(username)
+            token_cache.put(session_token, username)
             logging.info(f"User {username} logged in with new token.")
             return session_token, username
         else:
             return None, None # Password mismatch
 
+    except PasswordHashingBusyError:
+        raise
     except Exception as e:
         logging.error(f"Error during user verification: {e}")
         return None, None 
-    finally:
-        if temp_client:
-            temp_client.close()
 
 def get_user_by_token(session_token):
-    """Retrieves user data by session token."""
-    temp_client = None
+    """Retrieves user data by session token, served from the token cache when possible."""
+    if not session_token:
+        return None
+
+    if session_signer is not None and is_signed_token(session_token):
+        if session_revocations.refresh_due():
+            session_revocations.refresh()
+        return signed_token_username(session_token)
+
+    cached_username = token_cache.get(session_token)
+    if cached_username:
+        return cached_username
+
+    # A signout landing between the read and the put must not be cached over
+    epoch = token_cache.epoch()
     try:
-        temp_client = get_mongo_client()
-        users_collection = get_users_collection(temp_client)
+        client = get_mongo_client()
+        users_collection = get_users_collection(client)
         
-        user_doc = users_collection.find_one({'session_token': session_token})
+        user_doc = users_collection.find_one(
+            {'session_token': session_token},
+            {'username': 1, '_id': 0}
+        )
         
         if user_doc:
             # We only need the username for authentication checks
-            return user_doc.get('username')
+            username = user_doc.get('username')
+            token_cache.put(session_token, username, epoch)
+            return username
         return None
     except Exception as e:
         logging.error(f"Error retrieving user by token: {e}")
         return None 
-    finally:
-        if temp_client:
-            temp_client.close()
             
 def get_user_data_by_username(username):
     """Retrieves all user data by username."""
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        users_collection = get_users_collection(temp_client)
+        client = get_mongo_client()
+        users_collection = get_users_collection(client)
         
         user_doc = users_collection.find_one({'username': username})
         
@@ -224,23 +364,19 @@ def get_user_data_by_username(username):
     except Exception as e:
         logging.error(f"Error retrieving user data by username: {e}")
         return None 
-    finally:
-        if temp_client:
-            temp_client.close()
 
 def update_password(username, new_password):
     """Updates the user's password hash and invalidates the current session token."""
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        users_collection = get_users_collection(temp_client)
+        client = get_mongo_client()
+        users_collection = get_users_collection(client)
 
         # Check if user exists before attempting update
         if not users_collection.find_one({'username': username}):
             return False 
 
         # Generate new hash
-        new_hashed_password = hashpw(new_password.encode('utf-8'), gensalt()).decode('utf-8')
+        new_hashed_password = hash_password(new_password)
         
         # Update password hash and clear session token
         users_collection.update_one(
@@ -250,156 +386,659 @@ def update_password(username, new_password):
                 'session_token': None # Invalidate token
             }}
         )
+        revoke_user_sessions(username)
         logging.info(f"Password reset successful for {username}.")
         return True
     
+    except PasswordHashingBusyError:
+        raise
     except Exception as e:
         logging.error(f"Database error during password update: {e}")
         return False
-    finally:
-        if temp_client:
-            temp_client.close()
+
+def invalidate_session_token(session_token):
+    """
+    Ends a session on signout: clears the token in MongoDB (a single update,
+    no password hashing) and evicts it from the auth cache in every worker.
+    """
+    if session_signer is not None and is_signed_token(session_token):
+        claims = session_signer.decode(session_token)
+        if claims is None:
+            return False
+        try:
+            session_revocations.revoke_token(claims)
+            return True
+        except Exception as e:
+            logging.error(f"Error revoking signed session token: {e}")
+            return False
+
+    token_cache.invalidate_token(session_token)
+    if not session_token:
+        return False
+    try:
+        result = get_users_collection(get_mongo_client()).update_one(
+            {'session_token': session_token},
+            {'$set': {'session_token': None}}
+        )
+        return result.modified_count > 0
+    except Exception as e:
+        logging.error(f"Error invalidating session token: {e}")
+        return False
+
+def get_session_token_stats():
+    return {'mode': 'signed' if session_signer is not None else 'opaque', **session_revocations.stats()}
+
+def get_password_hashing_stats():
+    """Queue depth and timings of the password hashing pool."""
+    return password_hasher.stats()
+
+def get_auth_cache_stats():
+    """Returns hit/miss counters for the session-token cache."""
+    return token_cache.stats()
 
 # --- CHAT HISTORY FUNCTIONS ---
 
+# Messages live in their own collection, keyed by (chat_id, timestamp), so an
+# append is a single small insert and history is read one page at a time.
+# Sessions created by earlier versions kept them in an embedded 'messages'
+# array; those are moved over by migrate_embedded_messages (or lazily on read).
+CHAT_MESSAGES_COLLECTION = 'chat_messages'
+CHAT_PAGE_DEFAULT_LIMIT = int(os.getenv("CHAT_PAGE_DEFAULT_LIMIT", "50"))
+CHAT_PAGE_MAX_LIMIT = 200
+# The sidebar lists sessions a page at a time, optionally with per-session
+# message counts and a preview of the last message (kept up to date on write)
+CHAT_SESSIONS_PAGE_DEFAULT_LIMIT = int(os.getenv("CHAT_SESSIONS_PAGE_DEFAULT_LIMIT", "50"))
+CHAT_PREVIEW_CHARS = 120
+SESSION_LIST_FIELDS = {'chat_id': 1, 'session_name': 1, 'created_at': 1, 'updated_at': 1}
+SESSION_STATS_FIELDS = {'message_count': 1, 'last_message': 1}
+
+# Sessions untouched for this many days are deleted with their messages
+# (0 = keep forever). The sweep runs from `flask db-retention sweep` (cron) or,
+# with CHAT_RETENTION_SWEEP_INTERVAL_SECONDS > 0, from a thread in this process.
+CHAT_RETENTION_DAYS = float(os.getenv("CHAT_RETENTION_DAYS", "0"))
+CHAT_RETENTION_SWEEP_INTERVAL_SECONDS = float(os.getenv("CHAT_RETENTION_SWEEP_INTERVAL_SECONDS", "0"))
+# Deletes run batch by batch with a pause in between so they never saturate the primary
+CHAT_DELETE_BATCH_SIZE = int(os.getenv("CHAT_DELETE_BATCH_SIZE", "200"))
+CHAT_RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("CHAT_RETENTION_BATCH_PAUSE_SECONDS", "0.5"))
+BULK_DELETE_MAX_IDS = 500
+# Older than this is every session (and keeps the cutoff date representable)
+BULK_DELETE_MAX_DAYS = 36500
+# Persist chat turns from a background writer instead of inside the request.
+# Faster responses, but a turn can take a moment to show up in its history.
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "0") == "1"
+
+def new_chat_session_document(username, session_name=None):
+    """Builds a new chat session document (shared by the sync and async services)."""
+    now = datetime.now()
+    return {
+        'chat_id': str(uuid4()),
+        'username': username,
+        'session_name': session_name or f"Chat {now.strftime('%Y-%m-%d %H:%M')}",
+        'created_at': now,
+        'updated_at': now,
+        'message_count': 0,
+        'last_message': None
+    }
+
+def new_chat_message(chat_id, sender, text):
+    """Builds a chat_messages document."""
+    return {
+        '_id': ObjectId(),
+        'message_id': str(uuid4()),
+        'chat_id': chat_id,
+        'sender': sender,
+        'text': text,
+        'timestamp': datetime.now()
+    }
+
+def encode_cursor(timestamp, object_id):
+    """Opaque 'before' cursor pointing just past a document (the _id breaks timestamp ties)."""
+    return f"{timestamp.isoformat()}|{object_id}"
+
+def older_than_cursor(field, before):
+    """Filter clause for documents sorted (field, _id) descending that come after the cursor (or a bare ISO timestamp)."""
+    if not before:
+        return {}
+    timestamp_text, _, object_id = before.partition('|')
+    timestamp = datetime.fromisoformat(timestamp_text)
+    if not object_id:
+        return {field: {'$lt': timestamp}}
+    try:
+        object_id = ObjectId(object_id)
+    except InvalidId as e:
+        # Callers map ValueError to a 400 for a malformed cursor
+        raise ValueError(f"Invalid cursor: {e}") from e
+    return {'$or': [
+        {field: {'$lt': timestamp}},
+        {field: timestamp, '_id': {'$lt': object_id}}
+    ]}
+
+def newer_than_position(field, timestamp, object_id):
+    """Filter clause for documents sorted (field, _id) ascending that come after the given document."""
+    return {'$or': [
+        {field: {'$gt': timestamp}},
+        {field: timestamp, '_id': {'$gt': object_id}}
+    ]}
+
+def message_page_filter(chat_id, before=None):
+    """Query for the messages of a chat older than the 'before' cursor."""
+    return {'chat_id': chat_id, **older_than_cursor('timestamp', before)}
+
+def build_message_page(newest_first, limit):
+    """Turns up to limit + 1 newest-first messages into a chronological page with a cursor for older ones."""
+    has_more = len(newest_first) > limit
+    page = newest_first[:limit]
+    return {
+        'messages': [format_chat_message(msg) for msg in reversed(page)],
+        'has_more': has_more,
+        'next_before': encode_cursor(page[-1]['timestamp'], page[-1]['_id']) if has_more else None
+    }
+
+def clamp_page_limit(limit, default=CHAT_PAGE_DEFAULT_LIMIT):
+    try:
+        limit = int(limit) if limit is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, CHAT_PAGE_MAX_LIMIT))
+
+def session_list_projection(include_stats=False):
+    return {**SESSION_LIST_FIELDS, **SESSION_STATS_FIELDS} if include_stats else SESSION_LIST_FIELDS
+
+def session_page_filter(username, before=None):
+    """A user's sessions updated before the 'before' cursor (most recently updated first)."""
+    return {'username': username, **older_than_cursor('updated_at', before)}
+
+def build_session_page(newest_first, limit, include_stats=False):
+    """Turns up to limit + 1 sessions, most recently updated first, into a page with a cursor for the next one."""
+    has_more = len(newest_first) > limit
+    page = newest_first[:limit]
+    next_before = encode_cursor(page[-1]['updated_at'], page[-1]['_id']) if has_more else None
+    return {
+        'sessions': [format_chat_session(session, include_stats) for session in page],
+        'has_more': has_more,
+        'next_before': next_before
+    }
+
+def format_chat_session(session, include_stats=False):
+    """Converts ObjectId and dates of a session document for JSON serialization."""
+    formatted = {
+        '_id': str(session['_id']),
+        'chat_id': session['chat_id'],
+        'session_name': session.get('session_name'),
+        'created_at': session['created_at'].isoformat(),
+        'updated_at': session['updated_at'].isoformat()
+    }
+    if include_stats:
+        last_message = session.get('last_message')
+        formatted['message_count'] = session.get('message_count', 0)
+        formatted['last_message'] = {**last_message, 'timestamp': last_message['timestamp'].isoformat()} if last_message else None
+    return formatted
+
+def message_preview(message):
+    """The last_message summary stored on a session document."""
+    return {'sender': message['sender'], 'text': message['text'][:CHAT_PREVIEW_CHARS], 'timestamp': message['timestamp']}
+
+def session_stats_updates(documents):
+    """One update per chat bumping message_count and last_message for newly inserted messages."""
+    counts = {}
+    latest = {}
+    for doc in documents:
+        counts[doc['chat_id']] = counts.get(doc['chat_id'], 0) + 1
+        latest[doc['chat_id']] = doc
+    return [
+        pymongo.UpdateOne(
+            {'chat_id': chat_id},
+            {'$inc': {'message_count': count}, '$set': {'last_message': message_preview(latest[chat_id])}}
+        )
+        for chat_id, count in counts.items()
+    ]
+
+def format_chat_message(msg):
+    """Formats a stored message for the frontend."""
+    return {
+        'message_id': msg.get('message_id'),
+        'sender': msg['sender'],
+        'text': msg['text'],
+        'timestamp': msg['timestamp'].isoformat()
+    }
+
 def create_chat_session(username, session_name=None):
-    """Creates a new chat session and returns the chat_id"""
-    temp_client = None
+    """Creates a new chat session and returns its document"""
     try:
-        temp_client = get_mongo_client()
-        chats_collection = get_chats_collection(temp_client)
+        client = get_mongo_client()
+        chats_collection = get_chats_collection(client)
         
-        chat_id = str(uuid4())
-        session_name = session_name or f"Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-        
-        chat_session = {
-            'chat_id': chat_id,
-            'username': username,
-            'session_name': session_name,
-            'created_at': datetime.now(),
-            'updated_at': datetime.now(),
-            'messages': []
-        }
+        chat_session = new_chat_session_document(username, session_name)
+        chat_id = chat_session['chat_id']
         
         chats_collection.insert_one(chat_session)
         logging.info(f"Created new chat session {chat_id} for user {username}")
-        return chat_id
+        return chat_session
         
     except Exception as e:
         logging.error(f"Error creating chat session: {e}")
         return None
-    finally:
-        if temp_client:
-            temp_client.close()
 
 def add_message_to_chat(chat_id, sender, text):
     """Adds a message to an existing chat session"""
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        chats_collection = get_chats_collection(temp_client)
-        
-        message = {
-            'message_id': str(uuid4()),
-            'sender': sender,
-            'text': text,
-            'timestamp': datetime.now()
-        }
+        client = get_mongo_client()
+        message = new_chat_message(chat_id, sender, text)
         
-        chats_collection.update_one(
+        insert_chat_messages([message])
+        get_chats_collection(client).update_one(
             {'chat_id': chat_id},
-            {
-                '$push': {'messages': message},
-                '$set': {'updated_at': datetime.now()}
-            }
+            {'$set': {'updated_at': message['timestamp']}}
         )
         return True
         
     except Exception as e:
         logging.error(f"Error adding message to chat: {e}")
         return False
-    finally:
-        if temp_client:
-            temp_client.close()
 
-def get_user_chat_sessions(username):
-    """Gets all chat sessions for a user"""
-    temp_client = None
+def touch_chat_session(chat_id, username):
+    """
+    Validates that the session belongs to the user and bumps its updated_at,
+    in one write. Returns the session's memory fields (for
+    load_conversation_history), or None if there is no such session for this user.
+    """
+    return get_chats_collection(get_mongo_client()).find_one_and_update(
+        {'chat_id': chat_id, 'username': username},
+        {'$set': {'updated_at': datetime.now()}},
+        projection={'chat_id': 1, 'summary': 1, 'summarized_until': 1, '_id': 0}
+    )
+
+def insert_chat_messages(documents):
+    """
+    Single insert for any number of messages (of any chats), then a single
+    bulk update of the sessions' counters and previews. Ids already present
+    mean an earlier attempt got at least as far as the insert, so a failed
+    batch can be retried: those chats' stats are recomputed, not bumped.
+    """
+    client = get_mongo_client()
     try:
-        temp_client = get_mongo_client()
-        chats_collection = get_chats_collection(temp_client)
-        
-        sessions = list(chats_collection.find(
-            {'username': username},
-            {'messages': 0}  # Exclude messages for listing
-        ).sort('updated_at', -1))
-        
-        # Convert ObjectId to string and format dates for JSON serialization
-        for session in sessions:
-            session['_id'] = str(session['_id'])
-            session['created_at'] = session['created_at'].isoformat()
-            session['updated_at'] = session['updated_at'].isoformat()
-            
-        return sessions
-        
+        get_messages_collection(client).insert_many(documents, ordered=False)
+        fresh, retried_chat_ids = documents, set()
+    except pymongo.errors.BulkWriteError as e:
+        fresh, retried_chat_ids = split_retried_documents(documents, e)
+    if fresh:
+        get_chats_collection(client).bulk_write(session_stats_updates(fresh), ordered=False)
+    for chat_id in retried_chat_ids:
+        refresh_session_stats(chat_id)
+
+def split_retried_documents(documents, error):
+    """
+    Splits an unordered insert_many's documents, given its BulkWriteError,
+    into (documents of chats whose counters can simply be bumped, ids of
+    chats with duplicate messages). An earlier attempt wrote those
+    duplicates, but may or may not have updated the session stats
+    afterwards, so those chats need a recount instead. Any write error
+    other than a duplicate key is re-raised.
+    """
+    write_errors = error.details.get('writeErrors', [])
+    if any(write_error.get('code') != 11000 for write_error in write_errors):
+        raise error
+    retried_chat_ids = {documents[write_error['index']]['chat_id'] for write_error in write_errors}
+    return [doc for doc in documents if doc['chat_id'] not in retried_chat_ids], retried_chat_ids
+
+chat_write_queue = WriteBehindQueue(insert_chat_messages) if CHAT_WRITE_BEHIND else None
+if chat_write_queue is not None and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=chat_write_queue.reset_after_fork)
+
+def save_chat_turn(chat_id, messages):
+    """
+    Persists the (sender, text) messages of one turn (a question and its
+    answer, or a whole batch) with a single insert, or hands them to the
+    write-behind queue when CHAT_WRITE_BEHIND is on. Ownership is checked
+    beforehand by touch_chat_session.
+    """
+    documents = [new_chat_message(chat_id, sender, text) for sender, text in messages]
+    if chat_write_queue is not None and chat_write_queue.put(documents):
+        return True
+    try:
+        insert_chat_messages(documents)
+        return True
     except Exception as e:
-        logging.error(f"Error getting user chat sessions: {e}")
+        logging.error(f"Error saving chat turn: {e}")
+        return False
+
+def flush_chat_writes():
+    """Writes out any queued chat turns (called at shutdown)."""
+    if chat_write_queue is not None:
+        chat_write_queue.close()
+
+def get_chat_write_stats():
+    return chat_write_queue.stats() if chat_write_queue is not None else {'enabled': False}
+
+# --- CONVERSATION MEMORY ---
+
+# Each question is sent with the last CHAT_MEMORY_TURNS turns plus a rolling
+# summary of everything before them, stored on the session document as
+# 'summary' and 'summarized_until' ({'timestamp', '_id'} of the last folded
+# message; the _id breaks ties between messages saved in the same
+# millisecond), so the prompt stays the same size however long the session runs.
+_summaries_pending = set()
+_summaries_lock = threading.Lock()
+
+def _reset_summaries_after_fork():
+    global _summaries_lock
+    _summaries_lock = threading.Lock()
+    _summaries_pending.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_summaries_after_fork)
+
+def unsummarized_filter(chat_id, session):
+    """Messages of a chat not yet folded into its summary."""
+    query = {'chat_id': chat_id}
+    until = session.get('summarized_until') if session else None
+    if isinstance(until, dict):
+        query.update(newer_than_position('timestamp', until['timestamp'], until['_id']))
+    elif until:
+        # Sessions summarized before the _id tie-break was stored
+        query['timestamp'] = {'$gt': until}
+    return query
+
+def load_conversation_history(chat_id, session):
+    """
+    Memory for the next question of a chat (session as returned by
+    touch_chat_session), as chat-completion messages. Costs one query;
+    schedules a summary update once enough turns have left the window.
+    """
+    try:
+        newest_first = list(
+            get_messages_collection(get_mongo_client())
+            .find(unsummarized_filter(chat_id, session), {'sender': 1, 'text': 1})
+            .sort([('timestamp', -1), ('_id', -1)])
+            .limit(memory_fetch_limit())
+        )
+    except Exception as e:
+        logging.error(f"Error loading conversation history: {e}")
         return []
+    overflow, window = split_window(newest_first[::-1])
+    if needs_summary(overflow):
+        schedule_summary_update(chat_id)
+    return history_messages(session.get('summary'), window)
+
+def update_conversation_summary(chat_id):
+    """
+    Folds the messages that have left the window into the session summary
+    with one small-model call. Returns True if the summary was updated.
+    """
+    client = get_mongo_client()
+    chats_collection = get_chats_collection(client)
+    session = chats_collection.find_one({'chat_id': chat_id}, {'summary': 1, 'summarized_until': 1})
+    if not session:
+        return False
+    oldest_first = list(
+        get_messages_collection(client)
+        .find(unsummarized_filter(chat_id, session), {'sender': 1, 'text': 1, 'timestamp': 1})
+        .sort([('timestamp', 1), ('_id', 1)])
+        .limit(CHAT_SUMMARY_MAX_FOLD_MESSAGES + 2 * CHAT_MEMORY_TURNS)
+    )
+    overflow, _ = split_window(oldest_first)
+    if not needs_summary(overflow):
+        return False
+
+    llm_request = llm_router.route("", build_summary_messages(session.get('summary'), overflow), CHAT_SUMMARY_MAX_TOKENS, phrasing=True)
+    summary = truncate_to_tokens(llm_router.complete(llm_request).strip(), CHAT_SUMMARY_MAX_TOKENS)
+    # Only applies if no other worker has moved the summary on meanwhile
+    result = chats_collection.update_one(
+        {'chat_id': chat_id, 'summarized_until': session.get('summarized_until')},
+        {'$set': {'summary': summary, 'summarized_until': {'timestamp': overflow[-1]['timestamp'], '_id': overflow[-1]['_id']}}}
+    )
+    return result.modified_count > 0
+
+def schedule_summary_update(chat_id):
+    """Runs update_conversation_summary in the background, at most once at a time per chat."""
+    with _summaries_lock:
+        if chat_id in _summaries_pending:
+            return
+        _summaries_pending.add(chat_id)
+    threading.Thread(target=_run_summary_update, args=(chat_id,), name='chat-summary', daemon=True).start()
+
+def _run_summary_update(chat_id):
+    try:
+        update_conversation_summary(chat_id)
+    except Exception as e:
+        logging.error(f"Error updating conversation summary: {e}")
     finally:
-        if temp_client:
-            temp_client.close()
+        with _summaries_lock:
+            _summaries_pending.discard(chat_id)
+
+def get_user_chat_sessions(username, limit=None, before=None, include_stats=False):
+    """
+    Gets one page of a user's chat sessions, most recently updated first:
+    {'sessions', 'has_more', 'next_before'}. Served by the
+    (username, updated_at, _id) index; only the listed fields are read.
+    """
+    limit = clamp_page_limit(limit, CHAT_SESSIONS_PAGE_DEFAULT_LIMIT)
+    newest_first = list(
+        get_chats_collection(get_mongo_client())
+        .find(session_page_filter(username, before), session_list_projection(include_stats))
+        .sort([('updated_at', -1), ('_id', -1)])
+        .limit(limit + 1)
+    )
+    return build_session_page(newest_first, limit, include_stats)
+
+def refresh_session_stats(chat_id):
+    """Recomputes message_count and last_message of a session from chat_messages."""
+    client = get_mongo_client()
+    messages_collection = get_messages_collection(client)
+    last = messages_collection.find_one({'chat_id': chat_id}, sort=[('timestamp', -1), ('_id', -1)])
+    get_chats_collection(client).update_one(
+        {'chat_id': chat_id},
+        {'$set': {
+            'message_count': messages_collection.count_documents({'chat_id': chat_id}),
+            'last_message': message_preview(last) if last else None
+        }}
+    )
+
+def backfill_session_stats():
+    """Fills in counters for sessions created before they were maintained. Returns the number updated."""
+    updated = 0
+    for chat in get_chats_collection(get_mongo_client()).find({'message_count': {'$exists': False}}, {'chat_id': 1}):
+        refresh_session_stats(chat['chat_id'])
+        updated += 1
+    return updated
+
+def find_user_chat(chat_id, username):
+    """
+    Returns the session document (without history) if it belongs to the user,
+    moving any legacy embedded messages into chat_messages first.
+    """
+    client = get_mongo_client()
+    chat = get_chats_collection(client).find_one(
+        {'chat_id': chat_id, 'username': username},  # Security: user can only access their own chats
+        {'messages': {'$slice': 1}, 'session_name': 1, 'chat_id': 1}
+    )
+    if chat and chat.get('messages'):
+        migrate_session_messages(chat_id)
+    return chat
+
+def get_chat_messages_page(chat_id, username, limit=None, before=None):
+    """
+    Returns {'messages', 'has_more', 'next_before'} for the newest `limit`
+    messages older than the `before` cursor, or None if the session does not exist.
+    """
+    if not find_user_chat(chat_id, username):
+        return None
+    limit = clamp_page_limit(limit)
+    newest_first = list(
+        get_messages_collection(get_mongo_client())
+        .find(message_page_filter(chat_id, before))
+        .sort([('timestamp', -1), ('_id', -1)])
+        .limit(limit + 1)
+    )
+    return build_message_page(newest_first, limit)
 
 def get_chat_messages(chat_id, username):
-    """Gets all messages for a specific chat session"""
-    temp_client = None
+    """Gets all messages for a specific chat session (oldest first)"""
     try:
-        temp_client = get_mongo_client()
-        chats_collection = get_chats_collection(temp_client)
-        
-        chat = chats_collection.find_one({
-            'chat_id': chat_id,
-            'username': username  # Security: user can only access their own chats
-        })
-        
-        if chat:
-            # Format messages for frontend
-            messages = []
-            for msg in chat.get('messages', []):
-                messages.append({
-                    'sender': msg['sender'],
-                    'text': msg['text'],
-                    'timestamp': msg['timestamp'].isoformat()
-                })
-            return messages
-        return []
+        if not find_user_chat(chat_id, username):
+            return []
+        cursor = get_messages_collection(get_mongo_client()).find({'chat_id': chat_id}).sort([('timestamp', 1), ('_id', 1)])
+        return [format_chat_message(msg) for msg in cursor]
         
     except Exception as e:
         logging.error(f"Error getting chat messages: {e}")
         return []
-    finally:
-        if temp_client:
-            temp_client.close()
+
+def migrate_session_messages(chat_id):
+    """
+    Moves one session's embedded messages into chat_messages. Idempotent:
+    messages are upserted by message_id, and the array is only removed afterwards.
+    """
+    client = get_mongo_client()
+    chats_collection = get_chats_collection(client)
+    chat = chats_collection.find_one({'chat_id': chat_id}, {'messages': 1})
+    embedded = (chat or {}).get('messages') or []
+    if embedded:
+        operations = []
+        for index, msg in enumerate(embedded):
+            # Messages saved without an id get a stable one so re-runs do not duplicate them
+            message_id = msg.get('message_id') or str(uuid5(NAMESPACE_URL, f"{chat_id}/{index}"))
+            document = {
+                'message_id': message_id,
+                'chat_id': chat_id,
+                'sender': msg['sender'],
+                'text': msg['text'],
+                'timestamp': msg['timestamp']
+            }
+            operations.append(pymongo.UpdateOne({'message_id': message_id}, {'$setOnInsert': document}, upsert=True))
+        get_messages_collection(client).bulk_write(operations, ordered=True)
+    chats_collection.update_one({'chat_id': chat_id}, {'$unset': {'messages': ''}})
+    if embedded:
+        refresh_session_stats(chat_id)
+    return len(embedded)
+
+def migrate_embedded_messages():
+    """Migrates every session still holding an embedded messages array. Returns (sessions, messages)."""
+    chats_collection = get_chats_collection(get_mongo_client())
+    sessions = 0
+    moved = 0
+    for chat in chats_collection.find({'messages': {'$exists': True}}, {'chat_id': 1}):
+        moved += migrate_session_messages(chat['chat_id'])
+        sessions += 1
+    logging.info(f"Migrated {moved} embedded messages from {sessions} chat sessions.")
+    return sessions, moved
 
 def delete_chat_session(chat_id, username):
     """Deletes a chat session"""
-    temp_client = None
     try:
-        temp_client = get_mongo_client()
-        chats_collection = get_chats_collection(temp_client)
+        client = get_mongo_client()
+        chats_collection = get_chats_collection(client)
         
         result = chats_collection.delete_one({
             'chat_id': chat_id,
             'username': username
         })
+        if result.deleted_count > 0:
+            get_messages_collection(client).delete_many({'chat_id': chat_id})
         
         return result.deleted_count > 0
         
     except Exception as e:
         logging.error(f"Error deleting chat session: {e}")
         return False
-    finally:
-        if temp_client:
-            temp_client.close()
+
+# --- BULK DELETION AND RETENTION ---
+
+def purge_chat_sessions(query, batch_size=CHAT_DELETE_BATCH_SIZE, pause_seconds=0.0):
+    """
+    Deletes the sessions matching query and all their messages, batch_size
+    sessions at a time. Messages go first, so an interrupted purge never
+    leaves orphaned messages behind. Returns the number of sessions deleted.
+    """
+    client = get_mongo_client()
+    chats_collection = get_chats_collection(client)
+    messages_collection = get_messages_collection(client)
+    deleted = 0
+    while True:
+        chat_ids = [chat['chat_id'] for chat in chats_collection.find(query, {'chat_id': 1, '_id': 0}).limit(batch_size)]
+        if not chat_ids:
+            break
+        messages_collection.delete_many({'chat_id': {'$in': chat_ids}})
+        deleted += chats_collection.delete_many({'chat_id': {'$in': chat_ids}}).deleted_count
+        if len(chat_ids) < batch_size:
+            break
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return deleted
+
+def parse_bulk_delete_request(data):
+    """
+    Validates a bulk delete body: exactly one of chat_ids (list), older_than_days
+    (number) or all (true). Returns (delete_chat_sessions kwargs, error message).
+    """
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return None, "Request body must be a JSON object."
+    modes = [key for key in ('chat_ids', 'older_than_days', 'all') if data.get(key) not in (None, False)]
+    if len(modes) != 1:
+        return None, "Specify exactly one of 'chat_ids', 'older_than_days' or 'all'."
+    if modes[0] == 'chat_ids':
+        chat_ids = data['chat_ids']
+        if not isinstance(chat_ids, list) or not chat_ids or not all(isinstance(i, str) and i for i in chat_ids):
+            return None, "'chat_ids' must be a non-empty list of chat IDs."
+        if len(chat_ids) > BULK_DELETE_MAX_IDS:
+            return None, f"At most {BULK_DELETE_MAX_IDS} chat IDs can be deleted per request."
+        return {'chat_ids': chat_ids}, None
+    if modes[0] == 'older_than_days':
+        days = data['older_than_days']
+        # The chained comparison also rejects NaN
+        if isinstance(days, bool) or not isinstance(days, (int, float)) or not 0 <= days <= BULK_DELETE_MAX_DAYS:
+            return None, f"'older_than_days' must be a number between 0 and {BULK_DELETE_MAX_DAYS}."
+        return {'older_than': datetime.now() - timedelta(days=days)}, None
+    if data['all'] is not True:
+        return None, "'all' must be true."
+    return {}, None
+
+def delete_chat_sessions(username, chat_ids=None, older_than=None):
+    """Deletes a user's sessions by id, by last activity before older_than, or all of them. Returns the count."""
+    query = {'username': username}  # Security: users can only delete their own chats
+    if chat_ids is not None:
+        query['chat_id'] = {'$in': list(chat_ids)}
+    if older_than is not None:
+        query['updated_at'] = {'$lt': older_than}
+    return purge_chat_sessions(query)
+
+_retention_stats = {'runs': 0, 'deleted': 0, 'last_run_at': None, 'last_error': None}
+
+def sweep_expired_chat_sessions(retention_days=CHAT_RETENTION_DAYS):
+    """Deletes every session (of any user) idle for longer than retention_days, in throttled batches."""
+    if retention_days <= 0:
+        return 0
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    deleted = purge_chat_sessions({'updated_at': {'$lt': cutoff}}, pause_seconds=CHAT_RETENTION_BATCH_PAUSE_SECONDS)
+    _retention_stats['runs'] += 1
+    _retention_stats['deleted'] += deleted
+    _retention_stats['last_run_at'] = datetime.now().isoformat()
+    if deleted:
+        logging.info(f"Retention sweep deleted {deleted} chat sessions idle since before {cutoff:%Y-%m-%d}.")
+    return deleted
+
+def _run_retention_sweeper():
+    while True:
+        time.sleep(CHAT_RETENTION_SWEEP_INTERVAL_SECONDS)
+        try:
+            sweep_expired_chat_sessions()
+            _retention_stats['last_error'] = None
+        except Exception as e:
+            _retention_stats['last_error'] = str(e)
+            logging.error(f"Chat retention sweep failed: {e}")
+
+def start_retention_sweeper():
+    """Starts the in-process sweeper when retention and a sweep interval are configured."""
+    if CHAT_RETENTION_DAYS <= 0 or CHAT_RETENTION_SWEEP_INTERVAL_SECONDS <= 0:
+        return None
+    sweeper = threading.Thread(target=_run_retention_sweeper, name='chat-retention', daemon=True)
+    sweeper.start()
+    return sweeper
+
+def get_retention_stats():
+    return {'retention_days': CHAT_RETENTION_DAYS, 'sweep_interval_seconds': CHAT_RETENTION_SWEEP_INTERVAL_SECONDS, **_retention_stats}
 
 # --- TIMESHEET DATA FUNCTIONS ---
 
@@ -410,60 +1049,412 @@ def summarize_timesheet_data(df):
     columns = ", ".join(df.columns)
     return f"Timesheet columns: {columns}\n\nFirst 10 rows of timesheet data:\n{summary}"
 
-def upload_timesheet_to_db(df):
-    temp_client = None
+# How often a worker re-checks the shared dataset version before serving its cached copy
+DATASET_VERSION_CHECK_SECONDS = float(os.getenv("DATASET_VERSION_CHECK_SECONDS", "2.0"))
+# Number of per-scope datasets a worker keeps in memory (LRU)
+DATASET_CACHE_MAX_SCOPES = int(os.getenv("DATASET_CACHE_MAX_SCOPES", "32"))
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+# Rows per insert_many call when writing uploads
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "5000"))
+
+# Completed upload generations kept around for rollback; older ones are garbage-collected
+TIMESHEET_KEEP_GENERATIONS = int(os.getenv("TIMESHEET_KEEP_GENERATIONS", "2"))
+# Rows deleted per batch (and pause between batches) by the background collector
+TIMESHEET_GC_BATCH_SIZE = int(os.getenv("TIMESHEET_GC_BATCH_SIZE", "5000"))
+TIMESHEET_GC_PAUSE_SECONDS = float(os.getenv("TIMESHEET_GC_PAUSE_SECONDS", "0.05"))
+
+# Who shares a timesheet dataset: 'user' (each user has their own), 'team'
+# (users with the same 'team' field share one) or 'global' (single dataset).
+# 'global' is the default because rows uploaded before scopes existed belong
+# to it; with 'user' or 'team' they stay invisible until re-uploaded per scope.
+TIMESHEET_SCOPE = os.getenv("TIMESHEET_SCOPE", "global")
+TEAM_LOOKUP_TTL_SECONDS = 300
+
+# Every timesheet row carries the dataset scope and upload generation it
+# belongs to. One dataset_meta pointer document per scope names the active
+# generation. Rows written before scopes/generations existed have neither
+# field and form generation 0 of the global scope (None).
+SCOPE_FIELD = '_scope'
+GENERATION_FIELD = '_gen'
+DATASET_META_COLLECTION = 'dataset_meta'
+TIMESHEET_DATASET_ID = 'timesheets'
+# Upload-time aggregates (see rollups.py), one document per scope, generation and rollup
+ROLLUPS_COLLECTION = 'timesheet_rollups'
+
+_dataset_cache = OrderedDict()  # scope -> {'version', 'df', 'rollups', 'checked_at'}
+_dataset_cache_lock = threading.Lock()
+_dataset_load_locks = {}        # scope -> Lock serialising reloads of that scope
+_timesheet_gc_locks = {}        # scope -> Lock allowing one collector per scope
+_team_cache = {}                # username -> (team, expires_at)
+
+def get_dataset_scope(username):
+    """Returns the dataset scope key for an authenticated user according to TIMESHEET_SCOPE."""
+    if TIMESHEET_SCOPE == 'global' or not username:
+        return None
+    if TIMESHEET_SCOPE == 'team':
+        team, expires_at = _team_cache.get(username, (None, 0.0))
+        if expires_at <= time.monotonic():
+            user_doc = get_users_collection(get_mongo_client()).find_one({'username': username}, {'team': 1})
+            team = (user_doc or {}).get('team')
+            _team_cache[username] = (team, time.monotonic() + TEAM_LOOKUP_TTL_SECONDS)
+        if team:
+            return f"team:{team}"
+    return f"user:{username}"
+
+def dataset_meta_id(scope):
+    """_id of the pointer document for a scope (the global scope keeps the original id)."""
+    return TIMESHEET_DATASET_ID if scope is None else f"{TIMESHEET_DATASET_ID}:{scope}"
+
+def get_timesheet_version(scope=None):
+    """Returns the active upload generation of a scope (0 before its first versioned upload)."""
+    meta = get_database()[DATASET_META_COLLECTION].find_one(
+        {'_id': dataset_meta_id(scope)}, {'active_generation': 1}
+    )
+    return meta.get('active_generation', 0) if meta else 0
+
+def generation_filter(scope, generation):
+    """Query selecting the rows of one generation of a scope (served by the (_scope, _gen) index)."""
+    return {SCOPE_FIELD: scope, GENERATION_FIELD: generation if generation else None}
+
+def to_columnar(df):
+    """
+    Converts a raw records DataFrame into compact typed columns:
+    numeric text becomes numeric dtypes, 'date' columns become datetimes and
+    repetitive text (names, projects) becomes categoricals.
+    """
+    df = df.copy()
+    for column in df.columns:
+        series = df[column]
+        if not (series.dtype == object or pd.api.types.is_string_dtype(series)):
+            if pd.api.types.is_float_dtype(series):
+                df[column] = pd.to_numeric(series, downcast='float')
+            elif pd.api.types.is_integer_dtype(series):
+                df[column] = pd.to_numeric(series, downcast='integer')
+            continue
+
+        numeric = pd.to_numeric(series, errors='coerce')
+        if numeric.notna().sum() == series.notna().sum():
+            df[column] = numeric
+            continue
+
+        if 'date' in str(column).lower():
+            parsed = pd.to_datetime(series, errors='coerce')
+            if parsed.notna().sum() == series.notna().sum():
+                df[column] = parsed
+                continue
+
+        if len(series) and series.nunique(dropna=True) / len(series) <= CATEGORICAL_MAX_UNIQUE_RATIO:
+            df[column] = series.astype('category')
+    return df
+
+def invalidate_timesheet_cache(scope=None):
+    """Drops this process's cached dataset for a scope so the next read reloads it."""
+    with _dataset_cache_lock:
+        _dataset_cache.pop(scope, None)
+
+def begin_timesheet_upload(scope=None):
+    """
+    Allocates a fresh generation for a new upload into a scope. Rows are
+    written alongside the active generation, so readers keep seeing the old
+    data until finish_timesheet_upload switches the pointer.
+    Returns an upload handle for insert_timesheet_batches / finish / abort.
+    """
+    meta = get_database()[DATASET_META_COLLECTION].find_one_and_update(
+        {'_id': dataset_meta_id(scope)},
+        {'$inc': {'next_generation': 1}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    generation = meta['next_generation']
+    logging.info(f"Started timesheet upload generation {generation} for scope {scope}.")
+    return {'collection': get_database()['timesheets'], 'scope': scope, 'generation': generation}
+
+def finish_timesheet_upload(upload, row_count):
+    """
+    Atomically makes the upload's generation the active one, then garbage-collects
+    superseded generations in the background. A slower upload never replaces a
+    newer one that finished first.
+    """
+    scope = upload['scope']
+    generation = upload['generation']
+    result = get_database()[DATASET_META_COLLECTION].update_one(
+        {
+            '_id': dataset_meta_id(scope),
+            '$or': [
+                {'active_generation': {'$exists': False}},
+                {'active_generation': {'$lt': generation}}
+            ]
+        },
+        {
+            '$set': {
+                'active_generation': generation,
+                'row_count': row_count,
+                'updated_at': datetime.now()
+            },
+            '$push': {
+                'history': {
+                    '$each': [{'generation': generation, 'row_count': row_count, 'created_at': datetime.now()}],
+                    '$slice': -TIMESHEET_KEEP_GENERATIONS
+                }
+            }
+        }
+    )
+    if result.modified_count == 0:
+        logging.warning(f"Upload generation {generation} for scope {scope} was superseded by a newer upload; discarding it.")
+        discard_timesheet_generation(scope, generation)
+        return False
+
+    invalidate_timesheet_cache(scope)
+    start_timesheet_gc(scope)
+    return True
+
+def discard_timesheet_generation(scope, generation):
+    """Marks a generation's rows for deletion by the background collector."""
+    get_database()[DATASET_META_COLLECTION].update_one(
+        {'_id': dataset_meta_id(scope)},
+        {'$addToSet': {'discarded': generation}},
+        upsert=True
+    )
+    start_timesheet_gc(scope)
+
+def abort_timesheet_upload(upload):
+    """Discards a failed upload's partial rows; the active generation is untouched."""
+    logging.warning(f"Aborting timesheet upload generation {upload['generation']} for scope {upload['scope']}.")
     try:
-        temp_client = get_mongo_client()
-        temp_db = temp_client[MONGO_DATABASE_NAME]
-        temp_collection = temp_db['timesheets']
-        
-        temp_collection.delete_many({})
-        records = df.to_dict('records')
-        temp_collection.insert_many(records)
-        logging.info(f"Uploaded {len(records)} records.")
-        return True
+        discard_timesheet_generation(upload['scope'], upload['generation'])
     except Exception as e:
-        logging.error(f"FATAL: Database operation failed during upload: {e}")
-        raise RuntimeError(f"Database upload failed. Error: {e}") 
-    finally:
-        if temp_client:
-            temp_client.close()
+        logging.error(f"Could not schedule cleanup of generation {upload['generation']}: {e}")
 
-def get_timesheet_data_from_db():
-    temp_client = None
+def insert_timesheet_batches(upload, df, batch_size=UPLOAD_BATCH_SIZE):
+    """Inserts a DataFrame in unordered insert_many batches tagged with the upload's scope and generation."""
+    tags = {SCOPE_FIELD: upload['scope'], GENERATION_FIELD: upload['generation']}
+    for start in range(0, len(df), batch_size):
+        records = df.iloc[start:start + batch_size].to_dict('records')
+        for record in records:
+            record.update(tags)
+        upload['collection'].insert_many(records, ordered=False)
+    return len(df)
+
+def save_timesheet_rollups(upload, rollups):
+    """Persists an upload's rollups under its scope and generation (before the upload is activated)."""
+    documents = [
+        dict(rollup, name=name, **{SCOPE_FIELD: upload['scope'], GENERATION_FIELD: upload['generation']})
+        for name, rollup in rollups.items()
+    ]
+    if documents:
+        get_database()[ROLLUPS_COLLECTION].insert_many(documents, ordered=False)
+    return len(documents)
+
+def load_timesheet_rollups(scope=None, generation=None):
+    """Returns {name: rollup} stored for a generation of a scope, or None when none were saved."""
+    if generation is None:
+        generation = get_timesheet_version(scope)
+    documents = get_database()[ROLLUPS_COLLECTION].find(
+        {SCOPE_FIELD: scope, GENERATION_FIELD: generation},
+        {'_id': 0, SCOPE_FIELD: 0, GENERATION_FIELD: 0}
+    )
+    rollups = {doc.pop('name'): doc for doc in documents}
+    return rollups or None
+
+def collect_timesheet_generations(scope=None):
+    """
+    Deletes a scope's rows from generations that are neither active nor kept
+    for rollback, in throttled batches so the delete never turns into a write
+    storm. Uploads still in progress (generation above the newest finished
+    one) are left alone unless they were explicitly discarded.
+    """
+    with _dataset_cache_lock:
+        gc_lock = _timesheet_gc_locks.setdefault(scope, threading.Lock())
+    if not gc_lock.acquire(blocking=False):
+        return 0  # Another collection pass for this scope is already running in this process
+
+    deleted = 0
     try:
-        temp_client = get_mongo_client()
-        temp_db = temp_client[MONGO_DATABASE_NAME]
-        temp_collection = temp_db['timesheets']
+        db = get_database()
+        meta = db[DATASET_META_COLLECTION].find_one({'_id': dataset_meta_id(scope)}) or {}
+        active = meta.get('active_generation', 0)
+        keep = {entry['generation'] for entry in meta.get('history', [])}
+        keep.add(active)
+        newest_finished = max(keep)
+        discarded = [g for g in meta.get('discarded', []) if g not in keep]
 
-        records = list(temp_collection.find({}))
-        
-        if not records:
-            return pd.DataFrame()
-        
-        df = pd.DataFrame(records)
-        if '_id' in df.columns:
-            df = df.drop(columns=['_id'])
-        return df
+        collection = db['timesheets']
+        stale_filter = {
+            '$and': [
+                {SCOPE_FIELD: scope},
+                {GENERATION_FIELD: {'$nin': [g for g in keep if g]}},
+                {'$or': [
+                    {GENERATION_FIELD: {'$lt': newest_finished}},
+                    {GENERATION_FIELD: {'$in': discarded}},
+                    {GENERATION_FIELD: None}
+                ]}
+            ]
+        }
+        if not active:
+            # Legacy (generation 0) rows are still the active dataset
+            stale_filter['$and'].append({GENERATION_FIELD: {'$ne': None}})
+
+        while True:
+            ids = [doc['_id'] for doc in collection.find(stale_filter, {'_id': 1}).limit(TIMESHEET_GC_BATCH_SIZE)]
+            if not ids:
+                break
+            deleted += collection.delete_many({'_id': {'$in': ids}}).deleted_count
+            time.sleep(TIMESHEET_GC_PAUSE_SECONDS)
+        # Rollups are a handful of documents per generation; one delete is enough
+        db[ROLLUPS_COLLECTION].delete_many(stale_filter)
 
+        if discarded:
+            db[DATASET_META_COLLECTION].update_one(
+                {'_id': dataset_meta_id(scope)},
+                {'$pullAll': {'discarded': discarded}}
+            )
+        if deleted:
+            logging.info(f"Garbage-collected {deleted} timesheet rows from old generations of scope {scope}.")
+        return deleted
     except Exception as e:
-        logging.error(f"Error during MongoDB retrieval: {e}")
-        return pd.DataFrame() 
+        logging.error(f"Timesheet generation cleanup failed for scope {scope}: {e}")
+        return deleted
     finally:
-        if temp_client:
-            temp_client.close()
+        gc_lock.release()
 
-# --- LLM FUNCTION ---
+def start_timesheet_gc(scope=None):
+    """Runs collect_timesheet_generations for a scope on a daemon thread."""
+    threading.Thread(target=collect_timesheet_generations, args=(scope,), name='timesheet-gc', daemon=True).start()
 
-def get_llm_response(user_query):
+def rollback_timesheet_upload(scope=None):
+    """
+    Re-activates the previous kept generation of a scope. Returns the
+    generation now active, or None when there is nothing to roll back to.
+    """
+    collection = get_database()[DATASET_META_COLLECTION]
+    meta = collection.find_one({'_id': dataset_meta_id(scope)}) or {}
+    history = meta.get('history', [])
+    active = meta.get('active_generation', 0)
+    previous = [entry for entry in history if entry['generation'] < active]
+    if not previous:
+        return None
+
+    target = previous[-1]
+    result = collection.update_one(
+        {'_id': dataset_meta_id(scope), 'active_generation': active},
+        {
+            '$set': {'active_generation': target['generation'], 'row_count': target['row_count'], 'updated_at': datetime.now()},
+            # Drop the rolled-back generation from history so the collector reclaims it
+            '$pull': {'history': {'generation': active}}
+        }
+    )
+    if result.modified_count == 0:
+        return None  # Another upload or rollback switched the pointer concurrently
+
+    discard_timesheet_generation(scope, active)
+    invalidate_timesheet_cache(scope)
+    logging.info(f"Rolled back timesheet data for scope {scope} from generation {active} to {target['generation']}.")
+    return target['generation']
+
+def upload_timesheet_to_db(df, scope=None):
+    upload = None
     try:
-        df_data = get_timesheet_data_from_db()
-        data_summary = summarize_timesheet_data(df_data)
+        upload = begin_timesheet_upload(scope)
+        row_count = insert_timesheet_batches(upload, df)
+        save_timesheet_rollups(upload, compute_rollups(df))
+        finish_timesheet_upload(upload, row_count)
+        logging.info(f"Uploaded {row_count} records.")
+        return True
+    except Exception as e:
+        if upload:
+            abort_timesheet_upload(upload)
+        logging.error(f"FATAL: Database operation failed during upload: {e}")
+        raise RuntimeError(f"Database upload failed. Error: {e}") 
 
-        if "data is currently empty" in data_summary:
-            return "I'm sorry, I don't have any timesheet data to analyze. Please upload a timesheet file first."
-            
-        prompt = f"""
+def load_timesheet_data_from_db(scope=None, generation=None):
+    """Reads one generation (default: the active one) of a scope from MongoDB, bypassing the cache. Raises on DB errors."""
+    client = get_mongo_client()
+    temp_collection = client[MONGO_DATABASE_NAME]['timesheets']
+
+    if generation is None:
+        generation = get_timesheet_version(scope)
+    records = list(temp_collection.find(
+        generation_filter(scope, generation),
+        {'_id': 0, SCOPE_FIELD: 0, GENERATION_FIELD: 0}
+    ))
+    
+    if not records:
+        return pd.DataFrame()
+    
+    return pd.DataFrame.from_records(records)
+
+def get_timesheet_dataset(scope=None):
+    """
+    Returns (version, DataFrame) for a scope's current upload, loading from
+    MongoDB only when the upload version changed. The DataFrame is shared
+    between requests and must be treated as read-only.
+    """
+    now = time.monotonic()
+    with _dataset_cache_lock:
+        entry = _dataset_cache.get(scope)
+        if entry is not None:
+            _dataset_cache.move_to_end(scope)
+            if now - entry['checked_at'] < DATASET_VERSION_CHECK_SECONDS:
+                return entry['version'], entry['df']
+        load_lock = _dataset_load_locks.setdefault(scope, threading.Lock())
+
+    # Per-scope lock: one user's reload never blocks another user's questions
+    with load_lock:
+        entry = _dataset_cache.get(scope)
+        try:
+            version = get_timesheet_version(scope)
+            if entry is not None and entry['version'] == version:
+                entry['checked_at'] = now
+                return version, entry['df']
+
+            df = to_columnar(load_timesheet_data_from_db(scope, version))
+            # Uploads from before rollups existed get theirs computed once per load
+            rollups = load_timesheet_rollups(scope, version) or compute_rollups(df)
+        except Exception as e:
+            # Serve the last good copy (if any) rather than caching a failed read
+            logging.error(f"Error during MongoDB retrieval: {e}")
+            if entry is not None:
+                return entry['version'], entry['df']
+            return None, pd.DataFrame()
+
+        with _dataset_cache_lock:
+            _dataset_cache[scope] = {'version': version, 'df': df, 'rollups': rollups, 'checked_at': now}
+            _dataset_cache.move_to_end(scope)
+            while len(_dataset_cache) > DATASET_CACHE_MAX_SCOPES:
+                _dataset_cache.popitem(last=False)
+        logging.info(f"Loaded timesheet dataset version {version} for scope {scope} ({len(df)} rows) into cache.")
+        return version, df
+
+def get_timesheet_data_from_db(scope=None):
+    """Returns the cached, typed timesheet DataFrame for a scope's current upload (read-only)."""
+    return get_timesheet_dataset(scope)[1]
+
+def get_timesheet_rollups(scope=None):
+    """Returns the cached rollups of a scope's current upload ({} when there is no data)."""
+    version, _ = get_timesheet_dataset(scope)
+    with _dataset_cache_lock:
+        entry = _dataset_cache.get(scope)
+    return entry['rollups'] if entry is not None and entry['version'] == version else {}
+
+# --- LLM FUNCTION ---
+
+# Model used for analysis questions; see llm_router.py for the small model and routing thresholds
+LLM_MODEL = LLM_LARGE_MODEL
+LLM_MAX_TOKENS = 500
+LLM_EXTRA_HEADERS = {"HTTP-Referer": "http://localhost:3000", "X-Title": "Timesheet Reviewer Bot"}
+LLM_SYSTEM_PROMPT = "You are a specialized Timesheet Data Analyst Bot. Analyze the provided timesheet data and answer the user's questions truthfully based *only* on the data. Be polite and concise."
+EMPTY_DATA_MESSAGE = "I'm sorry, I don't have any timesheet data to analyze. Please upload a timesheet file first."
+LLM_ERROR_MESSAGE = "An unexpected error occurred while contacting the AI service. Please try again later."
+
+# How aggregate questions the local analytics engine can answer are handled:
+# 'direct' answers without the LLM, 'phrase' sends only the computed result
+# to the LLM for wording, 'off' always sends the data context to the LLM.
+# 'phrase' is the default so a misread question still passes an LLM on its way out.
+LOCAL_ANSWER_MODE = os.getenv("LOCAL_ANSWER_MODE", "phrase")
+PHRASING_MAX_TOKENS = 200
+
+LLM_PROMPT_TEMPLATE = """
 You are a specialized Timesheet Data Analyst Bot. Your function is strictly limited to reviewing the provided timesheet data. 
 The data is provided below. Do NOT hallucinate data. If the answer requires calculation, show the summary calculation steps.
 
@@ -473,19 +1464,180 @@ The data is provided below. Do NOT hallucinate data. If the answer requires calc
 
 User Query: {user_query}
 """
-        response = client_openai.chat.completions.create(
-            extra_headers={"HTTP-Referer": "http://localhost:3000", "X-Title": "Timesheet Reviewer Bot"},
-            model="openai/gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a specialized Timesheet Data Analyst Bot. Analyze the provided timesheet data and answer the user's questions truthfully based *only* on the data. Be polite and concise."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500,  
-            stream=False
-        )
+PHRASING_PROMPT_TEMPLATE = """
+The following result was computed exactly from the timesheet data. Answer the user's question using it.
+Do NOT change or recompute any numbers.
+
+Computed result:
+{computed_answer}
+
+User Query: {user_query}
+"""
 
-        return response.choices[0].message.content
+llm_router = LLMRouter({
+    'openrouter': OpenAICompatibleProvider('openrouter', llm_gateway, extra_headers=LLM_EXTRA_HEADERS),
+    'local': LocalProvider(),
+})
 
+def _prompt_room(template, user_query, **fields):
+    """Tokens left under LLM_MAX_PROMPT_TOKENS once the system prompt, template and question are counted."""
+    skeleton = [
+        {"role": "system", "content": LLM_SYSTEM_PROMPT},
+        {"role": "user", "content": template.format(user_query=user_query, **fields)}
+    ]
+    return LLM_MAX_PROMPT_TOKENS - count_message_tokens(skeleton)
+
+def build_llm_messages(user_query, df_data, rollups=None, history=None):
+    """
+    Builds the chat-completion messages for a query against a timesheet
+    DataFrame, after the conversation history if any, never above LLM_MAX_PROMPT_TOKENS.
+    """
+    history = list(history or [])
+    # A pasted essay of a question must not crowd out the data
+    user_query = truncate_to_tokens(user_query, LLM_MAX_PROMPT_TOKENS // 4)
+    room = _prompt_room(LLM_PROMPT_TEMPLATE, user_query, data_summary="") - count_message_tokens(history)
+    budget = min(CONTEXT_TOKEN_BUDGET, room)
+    # Only the rows, columns and aggregates relevant to this question, within the token budget
+    data_summary = build_timesheet_context(df_data, user_query, token_budget=budget, rollup_lines=format_rollups(rollups))
+    prompt = LLM_PROMPT_TEMPLATE.format(data_summary=data_summary, user_query=user_query)
+    return [{"role": "system", "content": LLM_SYSTEM_PROMPT}] + history + [{"role": "user", "content": prompt}]
+
+def build_phrasing_messages(user_query, computed_answer):
+    """Messages asking the LLM only to word an already computed result."""
+    user_query = truncate_to_tokens(user_query, LLM_MAX_PROMPT_TOKENS // 4)
+    room = _prompt_room(PHRASING_PROMPT_TEMPLATE, user_query, computed_answer="")
+    prompt = PHRASING_PROMPT_TEMPLATE.format(computed_answer=truncate_to_tokens(computed_answer, room), user_query=user_query)
+    return [
+        {"role": "system", "content": LLM_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+# --- RESPONSE CACHE ---
+
+# Anything that changes what the model is asked is part of the template hash
+LLM_PROMPT_HASH = prompt_hash(LLM_SYSTEM_PROMPT, LLM_PROMPT_TEMPLATE, LLM_MAX_TOKENS, CONTEXT_TOKEN_BUDGET, LLM_MAX_PROMPT_TOKENS)
+PHRASING_PROMPT_HASH = prompt_hash(LLM_SYSTEM_PROMPT, PHRASING_PROMPT_TEMPLATE, PHRASING_MAX_TOKENS, LLM_MAX_PROMPT_TOKENS)
+
+def embed_query(text):
+    """Embedding used by the response cache's similarity tier."""
+    response = client_openai.embeddings.create(model=RESPONSE_CACHE_EMBEDDING_MODEL, input=text)
+    return response.data[0].embedding
+
+response_cache = build_response_cache(lambda: get_database()[RESPONSE_CACHE_COLLECTION], embed=embed_query)
+
+def lookup_cached_response(user_query, scope, version, template_hash):
+    """Returns (answer, cache_entry) for a question against one dataset version; answer is None on a miss."""
+    if response_cache is None or version is None:
+        return None, None
+    namespace = cache_namespace(f"{scope}@{version}", llm_router.policy_key(), template_hash)
+    return response_cache.lookup(namespace, user_query)
+
+def store_llm_response(cache_entry, answer):
+    """Caches a complete, successful LLM answer under the entry returned by plan_llm_request."""
+    if response_cache is not None and answer != LLM_ERROR_MESSAGE:
+        response_cache.store(cache_entry, answer)
+
+def get_llm_gateway_stats():
+    return llm_gateway.stats()
+
+def get_llm_model_stats():
+    return llm_router.stats()
+
+def get_response_cache_stats():
+    return response_cache.stats() if response_cache is not None else {'backend': 'off'}
+
+def plan_llm_request(user_query, scope=None, history=None):
+    """
+    Decides how a question is answered. Returns (answer, llm_request, cache_entry):
+    when answer is set no LLM call is needed, otherwise llm_request is the
+    routed request for llm_router and its answer should be passed to
+    store_llm_response together with cache_entry. history is the
+    conversation memory from load_conversation_history.
+    """
+    version, df_data = get_timesheet_dataset(scope)
+    if df_data.empty:
+        return EMPTY_DATA_MESSAGE, None, None
+    rollups = get_timesheet_rollups(scope)
+
+    local = None
+    if LOCAL_ANSWER_MODE != 'off':
+        try:
+            local = answer_locally(df_data, user_query, rollups)
+        except Exception as e:
+            logging.error(f"Local analytics failed, falling back to the LLM: {e}")
+        if local and LOCAL_ANSWER_MODE != 'phrase':
+            return local['answer'], None, None
+
+    template_hash = PHRASING_PROMPT_HASH if local else LLM_PROMPT_HASH
+    if history and not local:
+        # Follow-up questions depend on the conversation, so it is part of the key
+        template_hash = prompt_hash(template_hash, *(m['content'] for m in history))
+    cached, cache_entry = lookup_cached_response(user_query, scope, version, template_hash)
+    if cached is not None:
+        return cached, None, None
+
+    if local:
+        messages = build_phrasing_messages(user_query, local['answer'])
+        return None, llm_router.route(user_query, messages, PHRASING_MAX_TOKENS, phrasing=True), cache_entry
+    messages = build_llm_messages(user_query, df_data, rollups, history)
+    return None, llm_router.route(user_query, messages, LLM_MAX_TOKENS), cache_entry
+
+def request_llm_answer(user_query, scope=None, history=None):
+    """Answers one question (locally, from the cache or via the LLM). Raises on failure."""
+    answer, llm_request, cache_entry = plan_llm_request(user_query, scope, history)
+    if answer is not None:
+        return answer
+
+    answer = llm_router.complete(llm_request)
+    store_llm_response(cache_entry, answer)
+    return answer
+
+def get_llm_response(user_query, scope=None, history=None):
+    try:
+        return request_llm_answer(user_query, scope, history)
     except Exception as e:
         logging.error(f"An error occurred while getting LLM response: {e}")
-        return "An unexpected error occurred while contacting the AI service. Please try again later."
\ No newline at end of file
+        return LLM_ERROR_MESSAGE
+
+# Upper bound on LLM calls in flight per /chat/batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+def answer_questions(queries, scope=None, concurrency=BATCH_CONCURRENCY):
+    """
+    Answers a list of questions concurrently, at most `concurrency` at a time.
+    Returns one {'query', 'answer'} or {'query', 'error'} dict per question, in order.
+    """
+    def answer_one(user_query):
+        try:
+            return {'query': user_query, 'answer': request_llm_answer(user_query, scope)}
+        except Exception as e:
+            logging.error(f"An error occurred while answering batch question: {e}")
+            return {'query': user_query, 'error': LLM_ERROR_MESSAGE}
+
+    if not queries:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(queries))), thread_name_prefix='chat-batch') as pool:
+        return list(pool.map(answer_one, queries))
+
+def stream_llm_response(user_query, scope=None, history=None):
+    """
+    Yields the answer as text deltas as soon as the model produces them.
+    Errors are reported as a final apology delta so callers can always
+    persist whatever text was assembled.
+    """
+    try:
+        answer, llm_request, cache_entry = plan_llm_request(user_query, scope, history)
+        if answer is not None:
+            yield answer
+            return
+
+        parts = []
+        for delta in llm_router.stream(llm_request):
+            parts.append(delta)
+            yield delta
+        # Only answers that streamed to completion are cached
+        store_llm_response(cache_entry, "".join(parts))
+
+    except Exception as e:
+        logging.error(f"An error occurred while streaming LLM response: {e}")
+        yield LLM_ERROR_MESSAGE
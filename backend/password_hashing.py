@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bcrypt import hashpw, gensalt, checkpw
+
+# --- CONFIGURATION ---
+
+# bcrypt cost factor for new hashes; existing hashes with another cost are
+# upgraded transparently on the user's next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 'process' hashes in a pool of worker processes so request threads (and the
+# GIL) stay free; 'inline' hashes on the calling thread (scripts, tests)
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "process")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash jobs allowed in flight (running + queued) per web worker, and how long
+# a request waits for one of those slots before it is turned away with a 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PASSWORD_HASH_WAIT_SECONDS = float(os.getenv("PASSWORD_HASH_WAIT_SECONDS", "5"))
+# Pool processes are started lazily from a request thread while pymongo,
+# write-behind and upload threads are running; forking then can copy a held
+# lock into the child, so they come from a forkserver (spawn where unavailable)
+PASSWORD_HASH_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+BCRYPT_COST_PATTERN = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+class PasswordHashingBusyError(RuntimeError):
+    """Raised when the hashing pool stays saturated for longer than PASSWORD_HASH_WAIT_SECONDS."""
+
+# --- WORKER FUNCTIONS (run in the pool processes) ---
+
+def _hash(password, rounds):
+    return hashpw(password.encode('utf-8'), gensalt(rounds)).decode('utf-8')
+
+def _check(password, stored_hash):
+    return checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
+
+# --- HASHER ---
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a bounded process pool. At most max_pending jobs are in
+    flight; callers beyond that wait up to wait_seconds for a slot and then
+    get PasswordHashingBusyError instead of piling up behind the pool.
+    """
+
+    def __init__(self, mode=PASSWORD_HASH_POOL, workers=PASSWORD_HASH_WORKERS, rounds=BCRYPT_ROUNDS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING, wait_seconds=PASSWORD_HASH_WAIT_SECONDS):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.rounds = rounds
+        self.max_pending = max(1, max_pending)
+        self.wait_seconds = wait_seconds
+        self.reset_after_fork()
+
+    def hash_password(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check_password(self, password, stored_hash):
+        return self._run(_check, password, stored_hash)
+
+    def needs_rehash(self, stored_hash):
+        """True when a stored hash was made with a different cost factor than the current one."""
+        match = BCRYPT_COST_PATTERN.match(stored_hash or "")
+        return match is not None and int(match.group(1)) != self.rounds
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'mode': self.mode,
+                'workers': self.workers if self.mode == 'process' else 0,
+                'rounds': self.rounds,
+                'in_flight': self._in_flight,
+                'max_pending': self.max_pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avg_ms': round(self._total_ms / self._completed, 1) if self._completed else 0.0,
+                'max_wait_ms': round(self._max_wait_ms, 1),
+            }
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    def reset_after_fork(self):
+        # A forked child must not use its parent's pool processes
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_ms = 0.0
+        self._max_wait_ms = 0.0
+
+    def _get_pool(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(PASSWORD_HASH_START_METHOD)
+                    )
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _submit(self, fn, *args):
+        """Runs fn in the pool; a pool broken by a dead worker process is replaced and the call retried once."""
+        pool = self._get_pool()
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            logging.error("Password hashing pool broke (a worker process died); starting a new one.")
+            self._discard_pool(pool)
+            return self._get_pool().submit(fn, *args).result()
+
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            with self._stats_lock:
+                self._rejected += 1
+            raise PasswordHashingBusyError("Password hashing is saturated, try again shortly.")
+        waited_ms = (time.monotonic() - started) * 1000
+        with self._stats_lock:
+            self._in_flight += 1
+            self._max_wait_ms = max(self._max_wait_ms, waited_ms)
+        try:
+            if self.mode == 'process':
+                return self._submit(fn, *args)
+            return fn(*args)
+        finally:
+            self._slots.release()
+            with self._stats_lock:
+                self._in_flight -= 1
+                self._completed += 1
+                self._total_ms += (time.monotonic() - started) * 1000
+
+password_hasher = PasswordHasher()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=password_hasher.reset_after_fork)
+atexit.register(password_hasher.shutdown)
+
+def hash_password(password):
+    """bcrypt hash of a password at the configured cost factor."""
+    return password_hasher.hash_password(password)
+
+def check_password(password, stored_hash):
+    return password_hasher.check_password(password, stored_hash)
+
+def needs_rehash(stored_hash):
+    return password_hasher.needs_rehash(stored_hash)
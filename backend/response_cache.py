@@ -0,0 +1,298 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+import numpy as np
+
+# --- CONFIGURATION ---
+
+# Where cached answers live: 'memory' (per process), 'sqlite' (shared by the
+# workers on a host), 'mongo' (shared by every host) or 'off'.
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_SQLITE_PATH = os.getenv("RESPONSE_CACHE_SQLITE_PATH", "response_cache.db")
+RESPONSE_CACHE_COLLECTION = 'response_cache'
+# Optional similarity tier: questions whose embeddings are at least this
+# similar to a cached question reuse its answer. Empty model = exact match only.
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "")
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+# --- KEYS ---
+
+def normalize_query(query):
+    """Case, whitespace and trailing punctuation never change the answer."""
+    return re.sub(r'\s+', ' ', query).strip().lower().rstrip('?!. ')
+
+def prompt_hash(*parts):
+    """Short hash identifying a prompt template (and anything else that shapes the answer)."""
+    return hashlib.sha256("\x1f".join(map(str, parts)).encode()).hexdigest()[:16]
+
+def cache_namespace(dataset_key, model, template_hash):
+    """Answers are only ever shared within one dataset version, model and prompt template."""
+    return f"{dataset_key}|{model}|{template_hash}"
+
+def cache_key(namespace, query):
+    return hashlib.sha256(f"{namespace}|{normalize_query(query)}".encode()).hexdigest()
+
+# --- BACKENDS ---
+
+class MemoryCacheBackend:
+    """Process-local LRU + TTL store."""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (answer, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, answer, ttl_seconds):
+        with self._lock:
+            self._entries[key] = (answer, time.time() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def size(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+class SQLiteCacheBackend:
+    """SQLite file shared by the workers on one host; LRU by last access."""
+
+    name = 'sqlite'
+
+    def __init__(self, path=RESPONSE_CACHE_SQLITE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, answer TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        # One connection per thread and per process; never reuse one across fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute("SELECT answer FROM responses WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, answer, ttl_seconds):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, answer, expires_at, last_used_at) VALUES (?, ?, ?, ?)",
+            (key, answer, now + ttl_seconds, now)
+        )
+        conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        self._connect().execute("DELETE FROM responses")
+
+    def reset_after_fork(self):
+        pass  # Connections are already per process
+
+class MongoCacheBackend:
+    """
+    Collection shared by every host. Expiry is handled by the TTL index on
+    expires_at (see schema.py); size is bounded by the TTL rather than by
+    max_entries.
+    """
+
+    name = 'mongo'
+
+    def __init__(self, get_collection):
+        self.get_collection = get_collection
+
+    def get(self, key):
+        doc = self.get_collection().find_one(
+            {'_id': key, 'expires_at': {'$gt': datetime.now()}}, {'answer': 1}
+        )
+        return doc['answer'] if doc else None
+
+    def set(self, key, answer, ttl_seconds):
+        self.get_collection().replace_one(
+            {'_id': key},
+            {'answer': answer, 'expires_at': datetime.now() + timedelta(seconds=ttl_seconds)},
+            upsert=True
+        )
+
+    def size(self):
+        return self.get_collection().estimated_document_count()
+
+    def clear(self):
+        self.get_collection().delete_many({})
+
+    def reset_after_fork(self):
+        pass  # The MongoClient is already re-created per process
+
+# --- RESPONSE CACHE ---
+
+class ResponseCache:
+    """
+    Two-tier LLM answer cache. The exact tier looks up the normalized question
+    in the backend; the optional similarity tier keeps question embeddings per
+    namespace in this process and reuses the backend answer of the nearest
+    cached question above the similarity threshold.
+    """
+
+    def __init__(self, backend, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, embed=None,
+                 similarity_threshold=RESPONSE_CACHE_SIMILARITY_THRESHOLD, max_vectors=RESPONSE_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.max_vectors = max_vectors
+        self._vectors = OrderedDict()  # key -> (namespace, unit vector)
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def lookup(self, namespace, query):
+        """
+        Returns (answer, entry). answer is None on a miss; pass entry to
+        store() once the real answer is known.
+        """
+        entry = {'key': cache_key(namespace, query), 'namespace': namespace, 'vector': None}
+        try:
+            answer = self.backend.get(entry['key'])
+            if answer is not None:
+                self.exact_hits += 1
+                return answer, entry
+
+            if self.embed is not None:
+                entry['vector'] = self._unit(self.embed(normalize_query(query)))
+                similar_key = self._nearest(namespace, entry['vector'])
+                answer = self.backend.get(similar_key) if similar_key else None
+                if answer is not None:
+                    self.similar_hits += 1
+                    return answer, entry
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Response cache lookup failed: {e}")
+        self.misses += 1
+        return None, entry
+
+    def store(self, entry, answer):
+        if entry is None or not answer:
+            return
+        try:
+            self.backend.set(entry['key'], answer, self.ttl_seconds)
+            if entry['vector'] is not None:
+                with self._lock:
+                    self._vectors[entry['key']] = (entry['namespace'], entry['vector'])
+                    self._vectors.move_to_end(entry['key'])
+                    while len(self._vectors) > self.max_vectors:
+                        self._vectors.popitem(last=False)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Response cache store failed: {e}")
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self.backend.reset_after_fork()
+        self.exact_hits = self.similar_hits = self.misses = self.errors = 0
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self._vectors.clear()
+
+    def stats(self):
+        hits = self.exact_hits + self.similar_hits
+        total = hits + self.misses
+        try:
+            size = self.backend.size()
+        except Exception:
+            size = None
+        return {
+            'backend': self.backend.name,
+            'size': size,
+            'ttl_seconds': self.ttl_seconds,
+            'exact_hits': self.exact_hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+            'similarity_tier': self.embed is not None,
+        }
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _nearest(self, namespace, vector):
+        with self._lock:
+            candidates = [(key, cached) for key, (ns, cached) in self._vectors.items() if ns == namespace]
+        if not candidates:
+            return None
+        similarities = np.stack([cached for _, cached in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        return candidates[best][0] if similarities[best] >= self.similarity_threshold else None
+
+def build_response_cache(get_collection, embed=None):
+    """Creates the process-wide cache for RESPONSE_CACHE_BACKEND, or None when caching is off."""
+    if RESPONSE_CACHE_BACKEND == 'off':
+        return None
+    backend = None
+    try:
+        if RESPONSE_CACHE_BACKEND == 'sqlite':
+            backend = SQLiteCacheBackend()
+        elif RESPONSE_CACHE_BACKEND == 'mongo':
+            backend = MongoCacheBackend(get_collection)
+    except Exception as e:
+        logging.error(f"Response cache backend '{RESPONSE_CACHE_BACKEND}' unavailable, using memory: {e}")
+    cache = ResponseCache(backend or MemoryCacheBackend(), embed=embed if RESPONSE_CACHE_EMBEDDING_MODEL else None)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=cache.reset_after_fork)
+    return cache
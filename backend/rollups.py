@@ -0,0 +1,129 @@
+import pandas as pd
+
+from .context_builder import detect_column_roles
+
+# --- ROLLUP DEFINITIONS ---
+
+ROW_COUNT = '_rows'
+
+# name -> roles of the dimensions it groups by (date parts are derived from the date column)
+ROLLUP_DIMENSIONS = {
+    'by_employee': ['employee'],
+    'by_project': ['project'],
+    'by_day': ['day'],
+    'by_week': ['week'],
+    'by_month': ['month'],
+    'by_employee_project': ['employee', 'project'],
+}
+DATE_PARTS = ('day', 'week', 'month')
+
+class RollupAccumulator:
+    """
+    Builds the aggregate cube incrementally, one parsed chunk at a time, so
+    ingestion can compute rollups without holding the whole file. Memory is
+    bounded by the number of distinct groups, not by the row count.
+    """
+
+    def __init__(self):
+        self.roles = None
+        self.measures = []
+        self.dimension_columns = {}
+        self.totals = {}
+
+    def _resolve_roles(self, chunk):
+        self.roles = detect_column_roles(chunk)
+        self.measures = list(self.roles['hours'])
+        for role in ('employee', 'project'):
+            if self.roles.get(role) is not None:
+                self.dimension_columns[role] = self.roles[role]
+        if self.roles.get('date') is not None:
+            for part in DATE_PARTS:
+                self.dimension_columns[part] = f"_{part}"
+
+    def add(self, chunk):
+        if self.roles is None:
+            self._resolve_roles(chunk)
+
+        frame = chunk[self.measures].copy()
+        frame[ROW_COUNT] = 1
+        for role in ('employee', 'project'):
+            if role in self.dimension_columns:
+                series = chunk[self.dimension_columns[role]]
+                frame[self.dimension_columns[role]] = series.astype(str).where(series.notna())
+        if self.roles.get('date') is not None:
+            dates = pd.to_datetime(chunk[self.roles['date']], errors='coerce')
+            frame['_day'] = dates.dt.strftime('%Y-%m-%d')
+            frame['_week'] = dates.dt.to_period('W').dt.start_time.dt.strftime('%Y-%m-%d')
+            frame['_month'] = dates.dt.strftime('%Y-%m')
+
+        for name, roles in ROLLUP_DIMENSIONS.items():
+            if not all(role in self.dimension_columns for role in roles):
+                continue
+            dimensions = [self.dimension_columns[role] for role in roles]
+            partial = frame.dropna(subset=dimensions).groupby(dimensions)[self.measures + [ROW_COUNT]].sum()
+            previous = self.totals.get(name)
+            # Fold each chunk into the running totals so only group-level data is kept
+            self.totals[name] = partial if previous is None else previous.add(partial, fill_value=0)
+
+    def result(self):
+        """Returns {name: {'dimensions': [...], 'measures': [...], 'cells': [...]}} ready for MongoDB."""
+        rollups = {}
+        for name, table in self.totals.items():
+            dimensions = [self.dimension_columns[role] for role in ROLLUP_DIMENSIONS[name]]
+            cells = []
+            for key, values in table.iterrows():
+                key = key if isinstance(key, tuple) else (key,)
+                cell = {'key': [str(part) for part in key], ROW_COUNT: int(values[ROW_COUNT])}
+                cell.update({str(measure): float(values[measure]) for measure in self.measures})
+                cells.append(cell)
+            rollups[name] = {
+                'dimensions': [self.roles['date'] if d.startswith('_') else d for d in dimensions],
+                'measures': [str(measure) for measure in self.measures],
+                'cells': cells,
+            }
+        return rollups
+
+def compute_rollups(df):
+    """Rollups for a whole DataFrame (non-streaming uploads)."""
+    accumulator = RollupAccumulator()
+    if not df.empty:
+        accumulator.add(df)
+    return accumulator.result()
+
+# --- CHAT-TIME HELPERS ---
+
+def find_rollup(rollups, dimensions):
+    """Returns the name of the rollup grouped by exactly these columns, or None."""
+    wanted = [str(d) for d in dimensions]
+    return next((name for name, rollup in (rollups or {}).items() if rollup['dimensions'] == wanted), None)
+
+def rollup_series(rollups, name, measure):
+    """Returns a Series of measure totals indexed by the rollup key, or None if unavailable."""
+    rollup = (rollups or {}).get(name)
+    if not rollup or str(measure) not in rollup['measures'] or not rollup['cells']:
+        return None
+    return pd.Series(
+        {" / ".join(cell['key']): cell[str(measure)] for cell in rollup['cells']},
+        dtype='float64'
+    )
+
+def format_rollups(rollups, top=15):
+    """Renders the precomputed cube as compact context lines."""
+    lines = []
+    for name in ('by_employee', 'by_project', 'by_month', 'by_week', 'by_employee_project'):
+        rollup = (rollups or {}).get(name)
+        if not rollup:
+            continue
+        label = " x ".join(rollup['dimensions'])
+        if name in ('by_month', 'by_week'):
+            label += f" ({name.split('_')[1]})"
+        for measure in rollup['measures']:
+            series = rollup_series(rollups, name, measure)
+            if name in ('by_month', 'by_week'):
+                shown = series.sort_index().tail(top)  # Most recent periods
+            else:
+                shown = series.sort_values(ascending=False).head(top)
+            parts = ", ".join(f"{key}={value:.2f}" for key, value in shown.items())
+            more = f" (+{len(series) - len(shown)} more)" if len(series) > len(shown) else ""
+            lines.append(f"{measure} by {label}: {parts}{more}")
+    return lines
@@ -29,8 +29,7 @@ def review():
     if timesheet_data.empty:
         return jsonify({"answer": "I’m sorry, but the timesheet data is empty. Please upload a file first."})
     
-    summary_text = "Here's a summary of the timesheet data:\n" + timesheet_data.to_string()
-    
-    llm_answer = get_llm_response(user_query, summary_text)
+    # get_llm_response builds a compact, token-bounded context itself
+    llm_answer = get_llm_response(user_query)
     
     return jsonify({"answer": llm_answer})
\ No newline at end of file
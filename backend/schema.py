@@ -0,0 +1,181 @@
+import os
+import logging
+from datetime import datetime
+
+import click
+import pymongo
+from flask.cli import AppGroup
+
+from .llm_service import (
+    CHAT_RETENTION_DAYS,
+    backfill_session_stats,
+    get_database,
+    migrate_embedded_messages,
+    sweep_expired_chat_sessions,
+)
+
+# --- CONFIGURATION ---
+
+# Timesheet columns that chat-time lookups filter on. CSV layouts differ per
+# deployment, so the list is configurable (comma separated).
+TIMESHEET_INDEX_COLUMNS = [
+    c.strip() for c in os.getenv("TIMESHEET_INDEX_COLUMNS", "Employee,Project,Date").split(",") if c.strip()
+]
+
+SCHEMA_META_COLLECTION = 'schema_meta'
+
+# Every index the application relies on, per collection. Index names are left
+# to MongoDB's defaults (e.g. 'username_1') so they match indexes created by
+# earlier versions of the app.
+REQUIRED_INDEXES = {
+    'users': [
+        {'keys': [('username', pymongo.ASCENDING)], 'unique': True},
+        {'keys': [('session_token', pymongo.ASCENDING)]},
+        {'keys': [('email', pymongo.ASCENDING)]},
+    ],
+    'chat_sessions': [
+        {'keys': [('chat_id', pymongo.ASCENDING)], 'unique': True},
+        # Retention sweeps select idle sessions across all users
+        {'keys': [('updated_at', pymongo.ASCENDING)]},
+        # Sidebar pages: one user's sessions by recency, _id breaking ties for the cursor
+        {'keys': [('username', pymongo.ASCENDING), ('updated_at', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]},
+    ],
+    # History pages are read newest first within one chat
+    'chat_messages': [
+        {'keys': [('chat_id', pymongo.ASCENDING), ('timestamp', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]},
+        {'keys': [('message_id', pymongo.ASCENDING)], 'unique': True},
+    ],
+    # Rows are always read within one dataset scope and upload generation
+    'timesheets': [
+        {'keys': [('_scope', pymongo.ASCENDING), ('_gen', pymongo.ASCENDING)]},
+    ] + [
+        {'keys': [('_scope', pymongo.ASCENDING), ('_gen', pymongo.ASCENDING), (column, pymongo.ASCENDING)]}
+        for column in TIMESHEET_INDEX_COLUMNS
+    ],
+    'timesheet_rollups': [
+        {'keys': [('_scope', pymongo.ASCENDING), ('_gen', pymongo.ASCENDING), ('name', pymongo.ASCENDING)]},
+    ],
+    # Revocation log of signed session tokens, polled by every worker
+    'session_revocations': [
+        {'keys': [('created_at', pymongo.ASCENDING)]},
+        {'keys': [('expires_at', pymongo.ASCENDING)], 'expireAfterSeconds': 0},
+    ],
+    # Used when RESPONSE_CACHE_BACKEND=mongo; MongoDB deletes entries once expires_at passes
+    'response_cache': [
+        {'keys': [('expires_at', pymongo.ASCENDING)], 'expireAfterSeconds': 0},
+    ],
+}
+
+_indexes_ensured = False
+
+# --- SCHEMA MANAGEMENT ---
+
+def index_name(keys):
+    """Returns the default MongoDB name for an index key specification."""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+def verify_indexes(db=None):
+    """
+    Compares the required indexes against the ones that exist on the server.
+    Returns {collection: {'present': [...], 'missing': [...]}}.
+    """
+    db = db if db is not None else get_database()
+    report = {}
+    for collection_name, specs in REQUIRED_INDEXES.items():
+        existing = set(db[collection_name].index_information().keys())
+        wanted = [index_name(spec['keys']) for spec in specs]
+        report[collection_name] = {
+            'present': [name for name in wanted if name in existing],
+            'missing': [name for name in wanted if name not in existing],
+        }
+    return report
+
+def ensure_indexes(db=None, force=False):
+    """
+    Creates all required indexes once per process and records the result in
+    the schema_meta collection. Subsequent calls are no-ops unless force=True.
+    """
+    global _indexes_ensured
+    if _indexes_ensured and not force:
+        return None
+
+    db = db if db is not None else get_database()
+    created = {}
+    for collection_name, specs in REQUIRED_INDEXES.items():
+        models = [
+            pymongo.IndexModel(spec['keys'], **{k: v for k, v in spec.items() if k != 'keys'})
+            for spec in specs
+        ]
+        created[collection_name] = db[collection_name].create_indexes(models) if models else []
+
+    db[SCHEMA_META_COLLECTION].update_one(
+        {'_id': 'indexes'},
+        {'$set': {'collections': created, 'updated_at': datetime.now()}},
+        upsert=True
+    )
+    _indexes_ensured = True
+    logging.info(f"Schema bootstrap complete: {created}")
+    return created
+
+def bootstrap_schema():
+    """Startup hook: ensures indexes but never prevents the app from starting."""
+    try:
+        ensure_indexes()
+    except Exception as e:
+        logging.error(f"Schema bootstrap failed, indexes will be retried on next start: {e}")
+
+# --- FLASK CLI ---
+
+db_indexes_cli = AppGroup('db-indexes', help="Verify or migrate MongoDB indexes.")
+
+@db_indexes_cli.command('verify')
+def verify_indexes_command():
+    """Lists required indexes and exits non-zero if any are missing."""
+    report = verify_indexes()
+    missing_total = 0
+    for collection_name, result in report.items():
+        for name in result['present']:
+            click.echo(f"ok       {collection_name}.{name}")
+        for name in result['missing']:
+            click.echo(f"MISSING  {collection_name}.{name}")
+        missing_total += len(result['missing'])
+    if missing_total:
+        raise SystemExit(1)
+
+@db_indexes_cli.command('migrate')
+def migrate_indexes_command():
+    """Creates any missing indexes."""
+    created = ensure_indexes(force=True)
+    for collection_name, names in created.items():
+        click.echo(f"{collection_name}: {', '.join(names) or '-'}")
+
+db_migrate_cli = AppGroup('db-migrate', help="Run one-off MongoDB data migrations.")
+
+@db_migrate_cli.command('chat-messages')
+def migrate_chat_messages_command():
+    """Moves messages embedded in chat_sessions into the chat_messages collection."""
+    sessions, messages = migrate_embedded_messages()
+    click.echo(f"Migrated {messages} messages from {sessions} chat sessions.")
+
+@db_migrate_cli.command('chat-session-stats')
+def backfill_session_stats_command():
+    """Fills in message counts and last-message previews of older chat sessions."""
+    click.echo(f"Updated {backfill_session_stats()} chat sessions.")
+
+db_retention_cli = AppGroup('db-retention', help="Apply data retention policies.")
+
+@db_retention_cli.command('sweep')
+@click.option('--days', type=float, default=CHAT_RETENTION_DAYS, show_default=True,
+              help="Delete chat sessions idle for longer than this many days.")
+def sweep_retention_command(days):
+    """Deletes idle chat sessions and their messages in throttled batches."""
+    if days <= 0:
+        click.echo("Retention is disabled (set CHAT_RETENTION_DAYS or pass --days).")
+        return
+    click.echo(f"Deleted {sweep_expired_chat_sessions(days)} chat sessions.")
+
+def register_schema_commands(app):
+    """Attaches the db-indexes, db-migrate and db-retention command groups to a Flask app."""
+    app.cli.add_command(db_indexes_cli)
+    app.cli.add_command(db_migrate_cli)
+    app.cli.add_command(db_retention_cli)
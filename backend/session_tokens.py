@@ -0,0 +1,192 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+# --- CONFIGURATION ---
+
+# 'opaque' = random token stored in users.session_token and resolved through
+# MongoDB (one session per user); 'signed' = HMAC-signed, expiring token
+# verified in-process, any number of sessions per user.
+SESSION_TOKEN_MODE = os.getenv("SESSION_TOKEN_MODE", "opaque")
+# Signing key shared by every worker and host. Older keys listed in
+# SESSION_TOKEN_PREVIOUS_SECRETS (comma separated) still verify, for rotation.
+SESSION_TOKEN_SECRET = os.getenv("SESSION_TOKEN_SECRET", "")
+SESSION_TOKEN_PREVIOUS_SECRETS = [s for s in os.getenv("SESSION_TOKEN_PREVIOUS_SECRETS", "").split(",") if s]
+SESSION_TOKEN_TTL_SECONDS = int(os.getenv("SESSION_TOKEN_TTL_SECONDS", str(12 * 3600)))
+# How often each worker pulls new revocations from MongoDB
+SESSION_REVOCATION_POLL_SECONDS = float(os.getenv("SESSION_REVOCATION_POLL_SECONDS", "2"))
+SESSION_REVOCATIONS_COLLECTION = 'session_revocations'
+
+SIGNATURE_BYTES = 16
+# Re-read this much of the revocation log on every poll to tolerate clock skew between writers
+REVOCATION_POLL_OVERLAP = timedelta(seconds=5)
+
+# --- ENCODING ---
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def is_signed_token(token):
+    """Opaque tokens are UUIDs; signed tokens are '<payload>.<signature>'."""
+    return bool(token) and '.' in token
+
+# --- SIGNER ---
+
+class SessionTokenSigner:
+    """Issues and checks '<base64 payload>.<base64 HMAC-SHA256>' tokens."""
+
+    def __init__(self, secret, previous_secrets=(), ttl_seconds=SESSION_TOKEN_TTL_SECONDS):
+        self.keys = [key.encode('utf-8') for key in [secret, *previous_secrets]]
+        self.ttl_seconds = ttl_seconds
+
+    def issue(self, username, generation):
+        """New token for a user at their current revocation generation."""
+        claims = {
+            'u': username,
+            'g': generation,
+            'exp': int(time.time()) + self.ttl_seconds,
+            'jti': _b64encode(secrets.token_bytes(8)),
+        }
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        return f"{payload}.{self._sign(self.keys[0], payload)}"
+
+    def decode(self, token):
+        """Returns the claims of a well-formed, correctly signed, unexpired token, else None."""
+        # Anything outside base64url and '.' is forged; it must not reach encode('ascii') or compare_digest
+        if not isinstance(token, str) or not token.isascii():
+            return None
+        try:
+            payload, signature = token.split('.')
+        except ValueError:
+            return None
+        if not any(hmac.compare_digest(signature, self._sign(key, payload)) for key in self.keys):
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        if claims.get('exp', 0) <= time.time():
+            return None
+        return claims
+
+    @staticmethod
+    def _sign(key, payload):
+        return _b64encode(hmac.new(key, payload.encode('ascii'), hashlib.sha256).digest()[:SIGNATURE_BYTES])
+
+# --- REVOCATIONS ---
+
+class RevocationSet:
+    """
+    In-process copy of the revocation log: single tokens revoked on signout
+    (by jti, until they expire) and per-user minimum generations (password
+    changes, sign-out-everywhere). Checking a token never does I/O; refresh()
+    pulls new log entries and is due every poll_seconds.
+    """
+
+    def __init__(self, get_collection, poll_seconds=SESSION_REVOCATION_POLL_SECONDS):
+        self.get_collection = get_collection
+        self.poll_seconds = poll_seconds
+        self.reset_after_fork()
+
+    def is_revoked(self, claims):
+        with self._lock:
+            if claims.get('jti') in self._tokens:
+                return True
+            return claims.get('g', 0) < self._min_generation.get(claims.get('u'), 0)
+
+    def refresh_due(self):
+        return time.monotonic() >= self._next_poll_at
+
+    def refresh(self):
+        """Applies revocations logged since the last poll (by any worker or host)."""
+        self._next_poll_at = time.monotonic() + self.poll_seconds
+        since = self._last_seen - REVOCATION_POLL_OVERLAP if self._last_seen else datetime.min
+        try:
+            entries = list(self.get_collection().find(
+                {'created_at': {'$gte': since}, 'expires_at': {'$gt': datetime.now()}},
+                {'kind': 1, 'value': 1, 'generation': 1, 'created_at': 1, 'expires_at': 1}
+            ))
+        except Exception as e:
+            logging.error(f"Failed to poll session revocations: {e}")
+            return
+        for entry in entries:
+            self._apply(entry)
+            self._last_seen = max(self._last_seen or entry['created_at'], entry['created_at'])
+        self._prune()
+
+    def revoke_token(self, claims):
+        """Revokes one token everywhere until it would have expired anyway."""
+        self._log({
+            'kind': 'token',
+            'value': claims['jti'],
+            'expires_at': datetime.fromtimestamp(claims['exp']),
+        })
+
+    def revoke_user(self, username, generation):
+        """Revokes every token of a user issued below `generation`."""
+        self._log({
+            'kind': 'user',
+            'value': username,
+            'generation': generation,
+            # Tokens issued before this entry are all expired once it lapses
+            'expires_at': datetime.now() + timedelta(seconds=SESSION_TOKEN_TTL_SECONDS),
+        })
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._tokens = {}             # jti -> expires_at
+        self._min_generation = {}     # username -> lowest valid generation
+        self._generation_expiry = {}  # username -> when that entry lapses
+        self._last_seen = None
+        self._next_poll_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'revoked_tokens': len(self._tokens),
+                'revoked_users': len(self._min_generation),
+                'poll_seconds': self.poll_seconds,
+            }
+
+    def _log(self, entry):
+        entry['created_at'] = datetime.now()
+        self._apply(entry)
+        self.get_collection().insert_one(entry)
+
+    def _apply(self, entry):
+        with self._lock:
+            if entry['kind'] == 'token':
+                self._tokens[entry['value']] = entry['expires_at']
+            else:
+                username = entry['value']
+                if entry['generation'] >= self._min_generation.get(username, 0):
+                    self._min_generation[username] = entry['generation']
+                    self._generation_expiry[username] = entry['expires_at']
+
+    def _prune(self):
+        now = datetime.now()
+        with self._lock:
+            for jti in [jti for jti, expires_at in self._tokens.items() if expires_at <= now]:
+                del self._tokens[jti]
+            for username in [u for u, expires_at in self._generation_expiry.items() if expires_at <= now]:
+                del self._generation_expiry[username]
+                self._min_generation.pop(username, None)
+
+def build_session_signer():
+    """The signer for SESSION_TOKEN_MODE=signed, or None for opaque tokens (also when no secret is set)."""
+    if SESSION_TOKEN_MODE != 'signed':
+        return None
+    if not SESSION_TOKEN_SECRET:
+        logging.error("SESSION_TOKEN_MODE=signed requires SESSION_TOKEN_SECRET; falling back to opaque tokens.")
+        return None
+    return SessionTokenSigner(SESSION_TOKEN_SECRET, SESSION_TOKEN_PREVIOUS_SECRETS)
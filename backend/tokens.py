@@ -0,0 +1,55 @@
+import os
+import logging
+
+# tiktoken gives exact counts for OpenAI models; without it a ~4 chars/token estimate is used
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# --- CONFIGURATION ---
+
+# Hard ceiling on the prompt of any single LLM request (system + user messages)
+LLM_MAX_PROMPT_TOKENS = int(os.getenv("LLM_MAX_PROMPT_TOKENS", "4000"))
+# Per-message framing overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+_encoding = None
+
+# --- COUNTING ---
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            logging.error(f"Token encoding '{TOKEN_ENCODING}' unavailable, estimating token counts: {e}")
+            _encoding = False
+    return _encoding or None
+
+def count_tokens(text):
+    """Number of tokens in text (exact with tiktoken, estimated otherwise)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def count_message_tokens(messages):
+    """Prompt tokens of a chat-completion message list."""
+    return sum(count_tokens(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+def truncate_to_tokens(text, max_tokens, marker=" [...]"):
+    """Cuts text so that it fits in max_tokens, marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= count_tokens(marker):
+        return ""
+    encoding = _get_encoding()
+    budget = max_tokens - count_tokens(marker)
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:budget]) + marker
+    return text[:max(0, budget - 1) * 4] + marker
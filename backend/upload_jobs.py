@@ -0,0 +1,332 @@
+import os
+import time
+import uuid
+import atexit
+import logging
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from .ingestion import ingest_timesheet_csv
+from .llm_service import discard_timesheet_generation
+
+# --- CONFIGURATION ---
+
+# Job table shared by every web worker on the host; spooled CSVs live next to it
+UPLOAD_JOBS_DB = os.getenv("UPLOAD_JOBS_DB", os.path.join("uploads", "upload_jobs.sqlite3"))
+# Ingestion threads per web worker; each holds one CSV chunk in memory at a time
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+# Idle workers look for jobs queued by other processes this often
+UPLOAD_JOB_POLL_SECONDS = float(os.getenv("UPLOAD_JOB_POLL_SECONDS", "1"))
+# A running job whose worker has not reported progress for this long is
+# assumed dead (process killed mid-upload) and handed to another worker
+UPLOAD_JOB_STALE_SECONDS = int(os.getenv("UPLOAD_JOB_STALE_SECONDS", "600"))
+UPLOAD_JOB_MAX_ATTEMPTS = int(os.getenv("UPLOAD_JOB_MAX_ATTEMPTS", "2"))
+# Finished jobs stay visible to status polling for this long
+UPLOAD_JOB_RETENTION_SECONDS = int(os.getenv("UPLOAD_JOB_RETENTION_SECONDS", str(7 * 86400)))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    job_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    scope TEXT,
+    path TEXT NOT NULL,
+    filename TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    rows_processed INTEGER NOT NULL DEFAULT 0,
+    rows_per_sec REAL,
+    coerced_cells TEXT,
+    generation INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS upload_jobs_status ON upload_jobs (status, created_at);
+"""
+# Columns added after the table was first created: name -> type
+ADDED_COLUMNS = {'coerced_cells': 'TEXT', 'generation': 'INTEGER'}
+
+JOB_FIELDS = ('job_id', 'filename', 'status', 'attempts', 'rows_processed', 'rows_per_sec', 'coerced_cells', 'error',
+              'created_at', 'started_at', 'updated_at', 'finished_at')
+
+# --- JOB FORMATTING ---
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value).isoformat() if value else None
+
+def format_upload_job(row):
+    """Public view of a job row for the status endpoint (no paths or scopes)."""
+    job = {field: row[field] for field in JOB_FIELDS}
+    # Values dropped because they were not numbers, per column
+    job['coerced_cells'] = json.loads(job['coerced_cells']) if job['coerced_cells'] else {}
+    for field in ('created_at', 'started_at', 'updated_at', 'finished_at'):
+        job[field] = _timestamp(job[field])
+    return job
+
+# --- QUEUE ---
+
+class UploadJobQueue:
+    """
+    Durable ingestion queue in a local SQLite file. submit() records a
+    spooled CSV as 'queued' and returns at once; worker threads claim jobs
+    inside a write transaction (so any web worker on the host may run any
+    job), call ingest(stream, scope, progress_callback, generation_callback)
+    and record the outcome. The partial generation of a job whose worker
+    died is handed to discard(scope, generation) when the job is reclaimed.
+    Spooled files are removed once a job reaches a final state. Workers
+    start on first use in each process, never in a preloading master.
+    """
+
+    def __init__(self, ingest, discard, db_path=UPLOAD_JOBS_DB, workers=UPLOAD_JOB_WORKERS, poll_seconds=UPLOAD_JOB_POLL_SECONDS,
+                 stale_seconds=UPLOAD_JOB_STALE_SECONDS, max_attempts=UPLOAD_JOB_MAX_ATTEMPTS):
+        self.ingest = ingest
+        self.discard = discard
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.poll_seconds = poll_seconds
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._schema_ready = False
+        self.reset_after_fork()
+
+    def submit(self, username, scope, path, filename=None):
+        """Queues a spooled CSV and returns its job id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO upload_jobs (job_id, username, scope, path, filename, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, username, scope, path, filename, JOB_QUEUED, now, now)
+            )
+        self._ensure_workers()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id, username):
+        """The user's job as a status dict, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM upload_jobs WHERE job_id = ? AND username = ?", (job_id, username)
+            ).fetchone()
+        return format_upload_job(row) if row else None
+
+    def start(self):
+        """Starts this process's workers if they are not running (cheap; called on every request)."""
+        self._ensure_workers()
+
+    def close(self, timeout=5):
+        """Stops the workers after their current job. Safe to call more than once (e.g. from atexit)."""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout=timeout)
+        self._threads = []
+
+    def reset_after_fork(self):
+        # Threads do not survive fork; the child starts its own workers on first use
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+        self.completed = 0
+        self.failed = 0
+
+    def stats(self):
+        try:
+            with self._connect() as conn:
+                counts = dict(conn.execute(
+                    "SELECT status, COUNT(*) FROM upload_jobs GROUP BY status"
+                ).fetchall())
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read upload job stats: {e}")
+            counts = {}
+        return {
+            'workers': len([t for t in self._threads if t.is_alive()]),
+            'queued': counts.get(JOB_QUEUED, 0),
+            'running': counts.get(JOB_RUNNING, 0),
+            'succeeded': counts.get(JOB_SUCCEEDED, 0),
+            'failed': counts.get(JOB_FAILED, 0),
+            'completed_here': self.completed,
+            'failed_here': self.failed,
+        }
+
+    def _connect(self):
+        if not self._schema_ready:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute("PRAGMA table_info(upload_jobs)")}
+            for column, kind in ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE upload_jobs ADD COLUMN {column} {kind}")
+            self._schema_ready = True
+        return _Connection(conn)
+
+    def _ensure_workers(self):
+        if self._threads and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            self._stopping.clear()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"upload-job-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to claim upload job: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_seconds)
+                continue
+            self._execute(job)
+
+    def _claim(self):
+        """Takes the oldest queued job (requeuing stale ones first); None when there is nothing to do."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                abandoned = self._recover_stale(conn, now)
+                row = conn.execute(
+                    "SELECT * FROM upload_jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE upload_jobs SET status = ?, attempts = attempts + 1, rows_processed = 0, "
+                        "generation = NULL, started_at = ?, updated_at = ? WHERE job_id = ?",
+                        (JOB_RUNNING, now, now, row['job_id'])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        # Outside the SQLite write lock: the partial rows of dead workers' jobs
+        for scope, generation in abandoned:
+            try:
+                self.discard(scope, generation)
+            except Exception as e:
+                logging.error(f"Could not discard abandoned upload generation {generation} for scope {scope}: {e}")
+        return row
+
+    def _recover_stale(self, conn, now):
+        """Requeues (or fails, past max_attempts) jobs whose worker died; returns their (scope, generation) to discard."""
+        cutoff = now - self.stale_seconds
+        stale = conn.execute(
+            "SELECT job_id, scope, path, attempts, generation FROM upload_jobs WHERE status = ? AND updated_at < ?",
+            (JOB_RUNNING, cutoff)
+        ).fetchall()
+        for row in stale:
+            if row['attempts'] < self.max_attempts:
+                conn.execute(
+                    "UPDATE upload_jobs SET status = ?, generation = NULL, updated_at = ? WHERE job_id = ?",
+                    (JOB_QUEUED, now, row['job_id'])
+                )
+            else:
+                conn.execute(
+                    "UPDATE upload_jobs SET status = ?, error = ?, generation = NULL, updated_at = ?, finished_at = ? "
+                    "WHERE job_id = ?",
+                    (JOB_FAILED, "Ingestion was interrupted and retried too often.", now, now, row['job_id'])
+                )
+                _remove_file(row['path'])
+        conn.execute(
+            "DELETE FROM upload_jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (JOB_SUCCEEDED, JOB_FAILED, now - UPLOAD_JOB_RETENTION_SECONDS)
+        )
+        return [(row['scope'], row['generation']) for row in stale if row['generation'] is not None]
+
+    def _execute(self, job):
+        job_id = job['job_id']
+
+        def report_progress(rows, elapsed, coerced_cells):
+            self._update(job_id, rows_processed=rows, rows_per_sec=round(rows / elapsed, 1) if elapsed else None,
+                         coerced_cells=json.dumps(coerced_cells))
+
+        def record_generation(generation):
+            self._update(job_id, generation=generation)
+
+        try:
+            with open(job['path'], 'rb') as stream:
+                result = self.ingest(stream, job['scope'], report_progress, record_generation)
+        except Exception as e:
+            logging.error(f"Upload job {job_id} for {job['username']} failed: {e}")
+            self.failed += 1
+            self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+        else:
+            self.completed += 1
+            self._update(job_id, status=JOB_SUCCEEDED, rows_processed=result['rows'], rows_per_sec=result['rows_per_sec'],
+                         coerced_cells=json.dumps(result['coerced_cells']), finished_at=time.time())
+        _remove_file(job['path'])
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        try:
+            with self._connect() as conn:
+                conn.execute(f"UPDATE upload_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to update upload job {job_id}: {e}")
+
+class _Connection:
+    """Closes the sqlite3 connection on exit (sqlite3's own context manager only commits)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc_info):
+        self.conn.close()
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.error(f"Failed to remove spooled upload {path}: {e}")
+
+def _ingest_csv(stream, scope, progress_callback, generation_callback):
+    return ingest_timesheet_csv(stream, scope=scope, progress_callback=progress_callback,
+                                generation_callback=generation_callback)
+
+upload_jobs = UploadJobQueue(_ingest_csv, discard_timesheet_generation)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=upload_jobs.reset_after_fork)
+atexit.register(upload_jobs.close)
+
+def submit_upload_job(username, scope, path, filename=None):
+    return upload_jobs.submit(username, scope, path, filename)
+
+def get_upload_job(job_id, username):
+    return upload_jobs.get(job_id, username)
+
+def start_upload_workers():
+    upload_jobs.start()
+
+def get_upload_job_stats():
+    return upload_jobs.stats()
@@ -0,0 +1,124 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+# --- CONFIGURATION ---
+
+# Documents written per insert, and how long the writer waits to fill a batch
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+# Beyond this many queued writes put() refuses and the caller writes inline
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+
+# --- QUEUE ---
+
+class WriteBehindQueue:
+    """
+    Defers writes to one background thread per process. Each put() is a list
+    of documents that must be written together; the writer concatenates
+    whatever is pending (up to max_batch documents) into a single
+    write_batch() call. Queued writes are lost if the process is killed
+    before flush() / close() run.
+    """
+
+    def __init__(self, write_batch, max_batch=WRITE_BEHIND_MAX_BATCH, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_pending=WRITE_BEHIND_MAX_PENDING, retries=WRITE_BEHIND_RETRIES):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retries = retries
+        self.reset_after_fork()
+
+    def put(self, documents):
+        """Queues documents; returns False when the queue is full (write them inline instead)."""
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(list(documents))
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def flush(self):
+        """Blocks until everything queued so far has been written (or dropped)."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """Flushes and stops the writer. Safe to call more than once (e.g. from atexit)."""
+        self.flush()
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+        self._writer = None
+
+    def reset_after_fork(self):
+        # Threads do not survive fork; the child starts with an empty queue and no writer
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._lock = threading.Lock()
+        self._writer = None
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'batches': self.batches,
+            'written': self.written,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            items = [item]
+            documents = list(item)
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(documents) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                items.append(item)
+                if item is None:
+                    stop = True
+                    break
+                documents.extend(item)
+            self._write(documents)
+            for _ in items:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, documents):
+        for attempt in range(self.retries + 1):
+            try:
+                self.write_batch(documents)
+                self.batches += 1
+                self.written += len(documents)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += len(documents)
+                    logging.error(f"Write-behind dropped {len(documents)} documents after {attempt + 1} attempts: {e}")
+                    return
+                time.sleep(min(0.1 * 2 ** attempt, 2.0))
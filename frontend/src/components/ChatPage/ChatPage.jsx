@@ -4,6 +4,7 @@ import './ChatPage.css';
 import ChatPageView from './ChatPageView';
 
 const API_BASE_URL = 'http://127.0.0.1:5000';
+const UPLOAD_POLL_INTERVAL_MS = 1000;
 
 const ChatPage = ({ user, sessionToken, onSignOut }) => {
     const { chatId: urlChatId } = useParams(); // Get chatId from URL
@@ -16,7 +17,10 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
     const [currentChatId, setCurrentChatId] = useState(urlChatId || null);
     const [chatSessions, setChatSessions] = useState([]);
     const [hasLoadedSessions, setHasLoadedSessions] = useState(false);
+    const [sessionsCursor, setSessionsCursor] = useState(null); // next_before of the last loaded sessions page
+    const [olderCursor, setOlderCursor] = useState(null); // next_before of the oldest loaded page
     const chatEndRef = useRef(null);
+    const keepScrollRef = useRef(false); // Set when older messages are prepended
 
     // Sync URL with current chat ID
     useEffect(() => {
@@ -35,7 +39,8 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
     // Load chat from URL parameter if provided
     useEffect(() => {
         if (urlChatId && sessionToken && hasLoadedSessions) {
-            const chatExists = chatSessions.some(session => session.chat_id === urlChatId);
+            // Sessions are paged, so a chat may exist beyond the loaded pages
+            const chatExists = chatSessions.some(session => session.chat_id === urlChatId) || Boolean(sessionsCursor);
             if (chatExists) {
                 loadChatSession(urlChatId);
             } else {
@@ -45,9 +50,11 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
         }
     }, [urlChatId, sessionToken, hasLoadedSessions, chatSessions, navigate]);
 
-    const fetchChatSessions = async () => {
+    const fetchChatSessions = async (before = null) => {
         try {
-            const response = await fetch(`${API_BASE_URL}/chat/sessions`, {
+            const params = new URLSearchParams({ include_stats: '1' });
+            if (before) params.set('before', before);
+            const response = await fetch(`${API_BASE_URL}/chat/sessions?${params}`, {
                 headers: {
                     'Authorization': `Bearer ${sessionToken}`
                 }
@@ -63,7 +70,8 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
             }
 
             const data = await response.json();
-            setChatSessions(data.sessions || []);
+            setChatSessions(prev => before ? [...prev, ...(data.sessions || [])] : (data.sessions || []));
+            setSessionsCursor(data.has_more ? data.next_before : null);
             setHasLoadedSessions(true);
 
         } catch (error) {
@@ -98,6 +106,7 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
 
             setCurrentChatId(data.chat_id);
             setMessages([]);
+            setOlderCursor(null);
             await fetchChatSessions(); // Refresh sessions list
 
         } catch (err) {
@@ -128,6 +137,7 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
 
             const data = await response.json();
             setMessages(data.messages || []);
+            setOlderCursor(data.has_more ? data.next_before : null);
             setCurrentChatId(chatId);
 
         } catch (error) {
@@ -138,6 +148,40 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
         }
     };
 
+    const loadMoreSessions = () => {
+        if (sessionsCursor) fetchChatSessions(sessionsCursor);
+    };
+
+    const loadOlderMessages = async () => {
+        if (!currentChatId || !olderCursor) return;
+        try {
+            const params = new URLSearchParams({ before: olderCursor });
+            const response = await fetch(`${API_BASE_URL}/chat/sessions/${currentChatId}?${params}`, {
+                headers: {
+                    'Authorization': `Bearer ${sessionToken}`
+                }
+            });
+
+            if (response.status === 401) {
+                onSignOut();
+                return;
+            }
+
+            if (!response.ok) {
+                throw new Error("Failed to load earlier messages.");
+            }
+
+            const data = await response.json();
+            keepScrollRef.current = true;
+            setMessages(prev => [...(data.messages || []), ...prev]);
+            setOlderCursor(data.has_more ? data.next_before : null);
+
+        } catch (error) {
+            console.error("Error loading earlier messages:", error);
+            setError("Could not load earlier messages.");
+        }
+    };
+
     const deleteChatSession = async (chatId) => {
         try {
             const response = await fetch(`${API_BASE_URL}/chat/sessions/${chatId}`, {
@@ -160,6 +204,7 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
             if (currentChatId === chatId) {
                 setCurrentChatId(null);
                 setMessages([]);
+                setOlderCursor(null);
                 navigate('/chat', { replace: true });
             }
 
@@ -173,6 +218,10 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
 
     // Scroll to bottom when messages change
     useEffect(() => {
+        if (keepScrollRef.current) {
+            keepScrollRef.current = false;
+            return;
+        }
         chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
     }, [messages]);
 
@@ -204,7 +253,8 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
         setMessages(prev => [...prev, newMessage]);
 
         try {
-            const response = await fetch(`${API_BASE_URL}/chat`, {
+            // Streaming endpoint: answer deltas arrive as Server-Sent Events
+            const response = await fetch(`${API_BASE_URL}/chat/stream`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -221,15 +271,41 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
                 onSignOut();
                 return;
             }
-            
-            const data = await response.json();
 
             if (!response.ok) {
+                const data = await response.json();
                 throw new Error(data.error || 'Failed to get response from chatbot.');
             }
 
-            const botMessage = { sender: 'bot', text: data.answer, timestamp: new Date().toISOString() };
-            setMessages(prev => [...prev, botMessage]);
+            const botTimestamp = new Date().toISOString();
+            setMessages(prev => [...prev, { sender: 'bot', text: '', timestamp: botTimestamp }]);
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let answer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // SSE frames are separated by a blank line
+                const frames = buffer.split('\n\n');
+                buffer = frames.pop();
+                for (const frame of frames) {
+                    const dataLine = frame.split('\n').find(line => line.startsWith('data: '));
+                    if (!dataLine) continue;
+                    const payload = JSON.parse(dataLine.slice(6));
+                    if (payload.delta) {
+                        answer += payload.delta;
+                    } else if (payload.answer !== undefined) {
+                        answer = payload.answer;
+                    }
+                    const text = answer;
+                    setMessages(prev => [...prev.slice(0, -1), { sender: 'bot', text, timestamp: botTimestamp }]);
+                }
+            }
 
         } catch (err) {
             console.error(err);
@@ -255,6 +331,30 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
         uploadFileToChat(file);
     };
 
+    const waitForUploadJob = async (jobId) => {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, UPLOAD_POLL_INTERVAL_MS));
+            const response = await fetch(`${API_BASE_URL}/upload/jobs/${jobId}`, {
+                headers: {
+                    'Authorization': `Bearer ${sessionToken}`
+                }
+            });
+
+            if (response.status === 401) {
+                onSignOut();
+                return null;
+            }
+
+            const job = await response.json();
+            if (!response.ok) {
+                throw new Error(job.error || 'Failed to check upload status.');
+            }
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                return job;
+            }
+        }
+    };
+
     const uploadFileToChat = async (file) => {
         setIsLoading(true);
         setError('');
@@ -282,8 +382,20 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
                 throw new Error(data.error || 'File upload failed.');
             }
             
+            // Ingestion runs in the background; poll until the job finishes
+            const job = await waitForUploadJob(data.job_id);
+            if (!job) return;
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'File processing failed.');
+            }
+
             // Add bot confirmation message
-            const botMessage = { sender: 'bot', text: data.message, timestamp: new Date().toISOString() };
+            const dropped = Object.values(job.coerced_cells || {}).reduce((sum, count) => sum + count, 0);
+            let text = `File uploaded and processed successfully (${job.rows_processed} rows).`;
+            if (dropped > 0) {
+                text += ` ${dropped} non-numeric values were left empty.`;
+            }
+            const botMessage = { sender: 'bot', text, timestamp: new Date().toISOString() };
             setMessages(prev => [...prev, botMessage]);
 
         } catch (err) {
@@ -300,6 +412,8 @@ const ChatPage = ({ user, sessionToken, onSignOut }) => {
         currentChatId, chatSessions, hasLoadedSessions,
         handleSendMessage, handleFileUpload,
         createNewChatSession, loadChatSession, deleteChatSession,
+        hasOlderMessages: Boolean(olderCursor), loadOlderMessages,
+        hasMoreSessions: Boolean(sessionsCursor), loadMoreSessions,
         setError
     };
 
@@ -8,6 +8,8 @@ const ChatPageView = ({
     currentChatId, chatSessions, hasLoadedSessions,
     handleSendMessage, handleFileUpload,
     createNewChatSession, loadChatSession, deleteChatSession,
+    hasOlderMessages, loadOlderMessages,
+    hasMoreSessions, loadMoreSessions,
     setError
 }) => {
     
@@ -72,11 +74,16 @@ const ChatPageView = ({
                                         e.preventDefault();
                                         handleSessionClick(session.chat_id);
                                     }}
-                                    title={session.session_name}
+                                    title={session.message_count ? `${session.session_name} (${session.message_count} messages)` : session.session_name}
                                 >
                                     <div className="session-name">
                                         {session.session_name}
                                     </div>
+                                    {session.last_message && (
+                                        <div className="session-preview">
+                                            {session.last_message.text}
+                                        </div>
+                                    )}
                                 </Link>
                                 <button 
                                     onClick={() => deleteChatSession(session.chat_id)}
@@ -88,6 +95,11 @@ const ChatPageView = ({
                                 </button>
                             </div>
                         ))}
+                        {hasMoreSessions && (
+                            <button onClick={loadMoreSessions} className="load-older-button">
+                                Load more chats
+                            </button>
+                        )}
                         {hasLoadedSessions && chatSessions.length === 0 && (
                             <div className="no-sessions-message">
                                 No chat sessions yet. Click "New Chat" to start!
@@ -109,6 +121,11 @@ const ChatPageView = ({
                     </header>
 
                     <main className="chat-messages">
+                        {currentChatId && hasOlderMessages && (
+                            <button onClick={loadOlderMessages} className="load-older-button" disabled={isLoading}>
+                                Load earlier messages
+                            </button>
+                        )}
                         {!currentChatId ? (
                             <div className="welcome-message">
                                 <p>Welcome back, <strong>{user}</strong>!</p>
@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+from backend.analytics import answer_locally, parse_query
+
+
+@pytest.fixture
+def timesheet():
+    return pd.DataFrame({
+        'Employee': ['Alice'] * 6 + ['Bob'] * 6,
+        'Project': ['Apollo', 'Borealis', 'Cygnus'] * 4,
+        'Date': pd.to_datetime(['2024-01-01', '2024-01-01', '2024-01-02', '2024-01-02', '2024-02-03', '2024-02-03'] * 2),
+        'Hours': [1, 2, 3, 4, 5, 6, 2, 2, 2, 2, 2, 2],
+    })
+
+
+def test_total_hours_for_an_employee(timesheet):
+    query = parse_query("How many hours did Alice work?", timesheet)
+    assert query['metric'] == 'sum'
+    assert query['measure'] == 'Hours'
+    assert query['group_by'] is None
+    assert query['value_filters'] == {'Employee': ['Alice']}
+
+
+def test_counting_hours_sums_them(timesheet):
+    query = parse_query("What is the total number of hours Alice worked?", timesheet)
+    assert query['metric'] == 'sum'
+
+
+def test_how_many_employees_is_a_distinct_count(timesheet):
+    query = parse_query("How many employees are there?", timesheet)
+    assert query['metric'] == 'count'
+    assert query['distinct'] == 'Employee'
+    assert query['group_by'] is None
+    assert answer_locally(timesheet, "How many employees are there?")['result']['value'] == 2
+
+
+def test_how_many_days_counts_distinct_dates(timesheet):
+    query = parse_query("How many days did Alice work?", timesheet)
+    assert query['metric'] == 'count'
+    assert query['distinct'] == 'Date'
+
+
+def test_most_hours_ranks_employees(timesheet):
+    query = parse_query("Who logged the most hours?", timesheet)
+    assert query['metric'] == 'max'
+    assert query['group_by'] == 'Employee'
+
+
+def test_top_n_is_a_limited_ranking(timesheet):
+    query = parse_query("What are the top 2 projects by hours?", timesheet)
+    assert query['metric'] == 'sum'
+    assert query['group_by'] == 'Project'
+    assert query['limit'] == 2
+
+
+def test_month_filter_sets_a_date_range(timesheet):
+    query = parse_query("How many hours did Bob log in February 2024?", timesheet)
+    assert query['date_range'] == (pd.Timestamp('2024-02-01'), pd.Timestamp('2024-03-01'))
+    assert query['date_column'] == 'Date'
+
+
+def test_by_a_cell_value_is_a_filter(timesheet):
+    query = parse_query("Total hours logged by Alice", timesheet)
+    assert query is not None
+    assert query['value_filters'] == {'Employee': ['Alice']}
+
+
+@pytest.mark.parametrize('question', [
+    "What is the total hours by client",        # no such column
+    "Total hours by month?",                     # time grouping is not parsed
+    "How many employees per project?",           # grouped distinct count
+    "Why did Alice log so many hours?",          # open-ended
+    "What is the average and total of hours?",   # two metrics
+    "Tell me about the Apollo project",          # no metric at all
+])
+def test_questions_left_to_the_llm(timesheet, question):
+    assert parse_query(question, timesheet) is None
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from backend.chat_api import BATCH_MAX_QUERIES, parse_chat_batch_request, parse_chat_request
+from backend.llm_service import BULK_DELETE_MAX_IDS, BULK_DELETE_MAX_DAYS, older_than_cursor, parse_bulk_delete_request
+
+
+# --- BULK DELETE ---
+
+def test_bulk_delete_by_ids():
+    assert parse_bulk_delete_request({'chat_ids': ['a', 'b']}) == ({'chat_ids': ['a', 'b']}, None)
+
+
+def test_bulk_delete_all():
+    assert parse_bulk_delete_request({'all': True}) == ({}, None)
+
+
+def test_bulk_delete_older_than():
+    criteria, error = parse_bulk_delete_request({'older_than_days': 30})
+    assert error is None
+    assert abs(criteria['older_than'] - (datetime.now() - timedelta(days=30))) < timedelta(seconds=5)
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    {},
+    [],
+    'all',
+    {'all': True, 'chat_ids': ['a']},
+    {'all': 'yes'},
+    {'chat_ids': []},
+    {'chat_ids': 'a'},
+    {'chat_ids': ['a', '']},
+    {'chat_ids': ['x'] * (BULK_DELETE_MAX_IDS + 1)},
+    {'older_than_days': -1},
+    {'older_than_days': True},
+    {'older_than_days': '30'},
+    {'older_than_days': float('nan')},
+    {'older_than_days': float('inf')},
+    {'older_than_days': BULK_DELETE_MAX_DAYS + 1},
+])
+def test_bulk_delete_rejects(body):
+    criteria, error = parse_bulk_delete_request(body)
+    assert criteria is None
+    assert error
+
+
+# --- PAGE CURSORS ---
+
+def test_no_cursor():
+    assert older_than_cursor('updated_at', None) == {}
+
+
+def test_bare_timestamp_cursor():
+    assert older_than_cursor('updated_at', '2024-05-01T10:00:00') == {'updated_at': {'$lt': datetime(2024, 5, 1, 10)}}
+
+
+def test_timestamp_and_id_cursor_breaks_ties_on_id():
+    object_id = ObjectId()
+    timestamp = datetime(2024, 5, 1, 10)
+    assert older_than_cursor('timestamp', f"{timestamp.isoformat()}|{object_id}") == {'$or': [
+        {'timestamp': {'$lt': timestamp}},
+        {'timestamp': timestamp, '_id': {'$lt': object_id}},
+    ]}
+
+
+@pytest.mark.parametrize('before', ['yesterday', '2024-05-01T10:00:00|not-an-object-id'])
+def test_malformed_cursor_raises_value_error(before):
+    with pytest.raises(ValueError):
+        older_than_cursor('updated_at', before)
+
+
+# --- CHAT BODIES ---
+
+def test_chat_request():
+    assert parse_chat_request({'query': 'Hours?', 'chat_id': 'c1'}) == (('Hours?', 'c1'), None)
+
+
+@pytest.mark.parametrize('body', [None, ['Hours?'], {'chat_id': 'c1'}, {'query': 'Hours?'}])
+def test_chat_request_rejects(body):
+    parsed, error = parse_chat_request(body)
+    assert parsed is None
+    assert error
+
+
+def test_batch_request():
+    assert parse_chat_batch_request({'queries': ['a', 'b'], 'chat_id': 'c1'}) == ((['a', 'b'], 'c1'), None)
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    {'queries': [], 'chat_id': 'c1'},
+    {'queries': ['a', ' '], 'chat_id': 'c1'},
+    {'queries': 'a', 'chat_id': 'c1'},
+    {'queries': ['a'] * (BATCH_MAX_QUERIES + 1), 'chat_id': 'c1'},
+    {'queries': ['a']},
+])
+def test_batch_request_rejects(body):
+    parsed, error = parse_chat_batch_request(body)
+    assert parsed is None
+    assert error
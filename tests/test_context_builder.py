@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+from backend.context_builder import find_date_range
+
+
+@pytest.mark.parametrize('question, expected', [
+    ("Hours on 2024-03-05?", (pd.Timestamp('2024-03-05'), pd.Timestamp('2024-03-06'))),
+    ("Hours between 2024-03-09 and 2024-03-01", (pd.Timestamp('2024-03-01'), pd.Timestamp('2024-03-10'))),
+    ("Hours in March 2024", (pd.Timestamp('2024-03-01'), pd.Timestamp('2024-04-01'))),
+    ("Hours in Dec of 2023", (pd.Timestamp('2023-12-01'), pd.Timestamp('2024-01-01'))),
+    ("Total hours in 2023", (pd.Timestamp('2023-01-01'), pd.Timestamp('2024-01-01'))),
+])
+def test_explicit_ranges(question, expected):
+    assert find_date_range(question) == expected
+
+
+def test_month_without_year_is_resolved_by_the_caller():
+    assert find_date_range("How many hours in May?") == ('month', 5)
+
+
+@pytest.mark.parametrize('question', [
+    "May I see the total hours?",
+    "How many hours did Alice work?",
+])
+def test_no_date_range(question):
+    assert find_date_range(question) is None
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from backend.session_tokens import SessionTokenSigner, is_signed_token
+
+
+@pytest.fixture
+def signer():
+    return SessionTokenSigner('current-secret', previous_secrets=['old-secret'], ttl_seconds=60)
+
+
+def test_round_trip(signer):
+    token = signer.issue('alice', 3)
+    assert is_signed_token(token)
+    claims = signer.decode(token)
+    assert claims['u'] == 'alice'
+    assert claims['g'] == 3
+
+
+def test_previous_secret_still_verifies(signer):
+    token = SessionTokenSigner('old-secret').issue('alice', 0)
+    assert signer.decode(token)['u'] == 'alice'
+
+
+def test_unknown_secret_is_rejected(signer):
+    assert signer.decode(SessionTokenSigner('other-secret').issue('alice', 0)) is None
+
+
+def test_tampered_payload_is_rejected(signer):
+    signature = signer.issue('alice', 0).split('.')[1]
+    forged = SessionTokenSigner('current-secret').issue('mallory', 0).split('.')[0]
+    assert signer.decode(f"{forged}.{signature}") is None
+
+
+def test_expired_token_is_rejected(signer, monkeypatch):
+    token = signer.issue('alice', 0)
+    monkeypatch.setattr(time, 'time', lambda: 10 ** 12)
+    assert signer.decode(token) is None
+
+
+@pytest.mark.parametrize('token', [
+    None,
+    b'abc.def',
+    '',
+    'no-dot',
+    'a.b.c',
+    'payéload.signature',
+    'payload.sign☃ture',
+])
+def test_malformed_tokens_are_rejected(signer, token):
+    assert signer.decode(token) is None
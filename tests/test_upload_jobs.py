@@ -0,0 +1,181 @@
+import sqlite3
+import time
+
+import pytest
+
+from backend.upload_jobs import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, UploadJobQueue
+
+
+class FakeIngest:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, stream, scope, progress_callback, generation_callback):
+        self.calls.append((stream.read(), scope))
+        generation_callback(7)
+        progress_callback(2, 1.0, {})
+        if self.fail:
+            raise ValueError("bad csv")
+        return {'rows': 2, 'rows_per_sec': 2.0, 'coerced_cells': {'Hours': 1}}
+
+
+@pytest.fixture
+def ingest():
+    return FakeIngest()
+
+
+@pytest.fixture
+def discarded():
+    return []
+
+
+@pytest.fixture
+def queue(tmp_path, ingest, discarded, monkeypatch):
+    queue = UploadJobQueue(ingest, lambda scope, generation: discarded.append((scope, generation)),
+                           db_path=str(tmp_path / 'jobs.sqlite3'), stale_seconds=60, max_attempts=2)
+    # Jobs are claimed by the test itself, not by background workers
+    monkeypatch.setattr(queue, '_ensure_workers', lambda: None)
+    return queue
+
+
+@pytest.fixture
+def spooled(tmp_path):
+    path = tmp_path / 'upload.csv'
+    path.write_bytes(b"Employee,Hours\nAlice,1\nBob,2\n")
+    return str(path)
+
+
+def job_row(queue, job_id):
+    with queue._connect() as conn:
+        return conn.execute("SELECT * FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+
+def age_job(queue, job_id, seconds, **fields):
+    """Makes a running job look like its worker stopped reporting `seconds` ago."""
+    fields['updated_at'] = time.time() - seconds
+    assignments = ", ".join(f"{field} = ?" for field in fields)
+    with queue._connect() as conn:
+        conn.execute(f"UPDATE upload_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+
+def test_claim_takes_the_oldest_queued_job(queue, spooled):
+    first = queue.submit('alice', 'scope-a', spooled, 'first.csv')
+    queue.submit('alice', 'scope-a', spooled, 'second.csv')
+
+    job = queue._claim()
+
+    assert job['job_id'] == first
+    row = job_row(queue, first)
+    assert row['status'] == JOB_RUNNING
+    assert row['attempts'] == 1
+
+
+def test_claim_with_nothing_queued(queue):
+    assert queue._claim() is None
+
+
+def test_running_job_is_not_claimed_twice(queue, spooled):
+    queue.submit('alice', 'scope-a', spooled)
+    assert queue._claim() is not None
+    assert queue._claim() is None
+
+
+def test_stale_job_is_requeued_and_its_partial_upload_discarded(queue, spooled, discarded):
+    job_id = queue.submit('alice', 'scope-a', spooled)
+    queue._claim()
+    age_job(queue, job_id, 120, generation=5)
+
+    job = queue._claim()
+
+    assert job['job_id'] == job_id
+    assert discarded == [('scope-a', 5)]
+    row = job_row(queue, job_id)
+    assert row['status'] == JOB_RUNNING
+    assert row['attempts'] == 2
+    assert row['generation'] is None
+
+
+def test_fresh_running_job_is_left_alone(queue, spooled, discarded):
+    job_id = queue.submit('alice', 'scope-a', spooled)
+    queue._claim()
+    age_job(queue, job_id, 10, generation=5)
+
+    assert queue._claim() is None
+    assert discarded == []
+    assert job_row(queue, job_id)['status'] == JOB_RUNNING
+
+
+def test_stale_job_past_max_attempts_fails(queue, spooled, discarded, tmp_path):
+    job_id = queue.submit('alice', 'scope-a', spooled)
+    queue._claim()
+    age_job(queue, job_id, 120, generation=5, attempts=2)
+
+    assert queue._claim() is None
+
+    assert discarded == [('scope-a', 5)]
+    row = job_row(queue, job_id)
+    assert row['status'] == JOB_FAILED
+    assert row['error']
+    assert not (tmp_path / 'upload.csv').exists()
+
+
+def test_discard_errors_do_not_block_claims(queue, spooled):
+    def failing_discard(scope, generation):
+        raise RuntimeError("database unavailable")
+
+    queue.discard = failing_discard
+    job_id = queue.submit('alice', 'scope-a', spooled)
+    queue._claim()
+    age_job(queue, job_id, 120, generation=5)
+
+    assert queue._claim()['job_id'] == job_id
+
+
+def test_execute_records_success(queue, ingest, spooled, tmp_path):
+    job_id = queue.submit('alice', 'scope-a', spooled, 'hours.csv')
+
+    queue._execute(queue._claim())
+
+    assert ingest.calls == [(b"Employee,Hours\nAlice,1\nBob,2\n", 'scope-a')]
+    job = queue.get(job_id, 'alice')
+    assert job['status'] == JOB_SUCCEEDED
+    assert job['rows_processed'] == 2
+    assert job['coerced_cells'] == {'Hours': 1}
+    assert job['filename'] == 'hours.csv'
+    assert 'path' not in job
+    assert not (tmp_path / 'upload.csv').exists()
+
+
+def test_execute_records_failure(queue, ingest, spooled):
+    ingest.fail = True
+    job_id = queue.submit('alice', 'scope-a', spooled)
+
+    queue._execute(queue._claim())
+
+    job = queue.get(job_id, 'alice')
+    assert job['status'] == JOB_FAILED
+    assert job['error'] == "bad csv"
+    assert queue.stats()['failed'] == 1
+
+
+def test_jobs_are_private_to_their_user(queue, spooled):
+    job_id = queue.submit('alice', 'scope-a', spooled)
+    assert queue.get(job_id, 'bob') is None
+    assert queue.get(job_id, 'alice')['status'] == JOB_QUEUED
+
+
+def test_columns_added_later_are_migrated(tmp_path, ingest):
+    db_path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE upload_jobs (job_id TEXT PRIMARY KEY, username TEXT NOT NULL, scope TEXT, path TEXT NOT NULL, "
+        "filename TEXT, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, rows_processed INTEGER NOT NULL DEFAULT 0, "
+        "rows_per_sec REAL, error TEXT, created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL, finished_at REAL)"
+    )
+    conn.close()
+
+    queue = UploadJobQueue(ingest, lambda scope, generation: None, db_path=db_path)
+    with queue._connect() as conn:
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(upload_jobs)")}
+    assert {'generation', 'coerced_cells'} <= columns